@@ -0,0 +1,100 @@
+"""
+Benchmark for the completion throughput of the signature database.
+
+Simulates worker threads of the :class:`wasp.execution.ParallelExecutor`
+which finish tasks concurrently: Each completed task looks up the produced
+signatures of its sources and refreshes the signatures of its targets
+(i.e. hashes the target files). The number of completed tasks per second
+is reported for different job counts.
+
+Run from the repository root::
+
+    PYTHONPATH=src python benchmarks/signature_throughput.py --tasks 2000 --jobs 1 8 64
+
+Use ``--global-lock`` to emulate the previous behaviour, where every access
+to the signature database was serialized on one lock.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import wasp
+from wasp import FileNode
+from wasp.signature import SignatureProvider
+
+
+class GlobalLockSignatureProvider(SignatureProvider):
+    """
+    Serializes all accesses and signature refreshes on one lock.
+    """
+    def __init__(self):
+        super().__init__()
+        self._global_lock = threading.Lock()
+
+    def get_or_add(self, key, factory_fun, ns=None):
+        with self._global_lock:
+            return super().get_or_add(key, factory_fun, ns=ns)
+
+
+def make_files(directory, count, size):
+    data = os.urandom(size)
+    ret = []
+    for i in range(count):
+        fpath = os.path.join(directory, 'file{0}.o'.format(i))
+        with open(fpath, 'wb') as f:
+            f.write(data)
+        ret.append(fpath)
+    return ret
+
+
+def complete_task(fpath, ns, global_lock):
+    n = FileNode(fpath)
+    wasp.ctx.produced_signatures.get(n.key, ns=ns)
+    sig = n.signature(ns=ns)
+    if global_lock is not None:
+        with global_lock:
+            sig.refresh()
+    else:
+        sig.refresh()
+
+
+def run(files, jobs, use_global_lock):
+    if use_global_lock:
+        provider = GlobalLockSignatureProvider()
+        global_lock = provider._global_lock
+    else:
+        provider = SignatureProvider()
+        global_lock = None
+    wasp.ctx._signatures = provider
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(complete_task, f, 'bench', global_lock) for f in files]
+        for fut in futures:
+            fut.result()
+    return len(files) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Signature database completion throughput.')
+    parser.add_argument('--tasks', type=int, default=2000, help='Number of completed tasks (target files).')
+    parser.add_argument('--size', type=int, default=256 * 1024, help='Size of each target file in bytes.')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 8, 32, 64], help='Job counts to benchmark.')
+    parser.add_argument('--global-lock', action='store_true', help='Serialize all accesses on one lock.')
+    args = parser.parse_args()
+    tmpdir = tempfile.mkdtemp(prefix='wasp-bench-')
+    try:
+        files = make_files(tmpdir, args.tasks, args.size)
+        print('{0:>6}  {1:>14}'.format('jobs', 'tasks/s'))
+        for jobs in args.jobs:
+            throughput = run(files, jobs, args.global_lock)
+            print('{0:>6}  {1:>14.1f}'.format(jobs, throughput))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark for the startup time of ``wasp``.
+
+Generates a project with ``--tasks`` shell tasks and measures the wall time of
+``wasp --help`` and of a no-op ``wasp build`` (i.e. a build in which all tasks are
+up-to-date). Each invocation runs in a fresh interpreter. Additionally, the time
+for importing ``wasp`` and the number of threads alive after the import are reported.
+
+Run from the repository root::
+
+    PYTHONPATH=src python benchmarks/startup.py --tasks 200 --repeat 10
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+RUN_WASP = 'import os, sys; from wasp.main import run; sys.argv = ["wasp"] + sys.argv[1:]; ' \
+           'sys.exit(0 if run(os.getcwd()) else 1)'
+
+IMPORT_WASP = 'import time, threading; start = time.perf_counter(); import wasp.main; ' \
+              'print(time.perf_counter() - start, threading.active_count())'
+
+BUILD_SCRIPT = '''
+from wasp import *
+
+
+@build
+def _build():
+    return [shell('cp {{src}} {{tgt}}', sources='src/{{0}}.txt'.format(i), targets='build/{{0}}.txt'.format(i))
+            for i in range({0})]
+'''
+
+
+def make_project(directory, tasks):
+    os.makedirs(os.path.join(directory, 'src'))
+    for i in range(tasks):
+        with open(os.path.join(directory, 'src', '{0}.txt'.format(i)), 'w') as f:
+            f.write(str(i))
+    with open(os.path.join(directory, 'build.py'), 'w') as f:
+        f.write(BUILD_SCRIPT.format(tasks))
+
+
+def python(code, *args, cwd):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = SRC_DIR
+    return subprocess.run([sys.executable, '-c', code] + list(args), cwd=cwd, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True)
+
+
+def measure(repeat, *args, cwd):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        python(RUN_WASP, *args, cwd=cwd)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time of wasp.')
+    parser.add_argument('--tasks', type=int, default=200, help='Number of tasks in the generated project.')
+    parser.add_argument('--repeat', type=int, default=10, help='Number of invocations per measurement.')
+    args = parser.parse_args()
+    tmpdir = tempfile.mkdtemp(prefix='wasp-bench-')
+    try:
+        make_project(tmpdir, args.tasks)
+        import_times = []
+        for _ in range(args.repeat):
+            out = python(IMPORT_WASP, cwd=tmpdir).stdout.decode('UTF-8').split()
+            import_times.append(float(out[0]))
+        threads = int(out[1])
+        print('{0:<16}  {1:>10}'.format('measurement', 'ms'))
+        print('{0:<16}  {1:>10.1f}  ({2} threads alive)'.format(
+            'import wasp', statistics.median(import_times) * 1000, threads))
+        print('{0:<16}  {1:>10.1f}'.format('wasp --help', measure(args.repeat, '--help', cwd=tmpdir) * 1000))
+        # populate the cache, s.t. the following builds are no-ops
+        python(RUN_WASP, 'build', cwd=tmpdir)
+        print('{0:<16}  {1:>10.1f}'.format('no-op build', measure(args.repeat, 'build', cwd=tmpdir) * 1000))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
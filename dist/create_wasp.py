@@ -1,7 +1,28 @@
-import zlib
-import sys, os
+"""
+Creates the ``wasp`` script, which is a zip application (see :mod:`zipapp`) consisting
+of a short header (the shebang line) followed by a zip archive. The archive contains
+``wasp-prebuild`` as ``__main__.py`` and the ``wasp`` package, both as sources and as
+precompiled bytecode. Thus, python imports ``wasp`` directly from the script using
+:mod:`zipimport` without unpacking or compiling anything. The bytecode is stored as
+unchecked hash-based ``.pyc`` files (PEP 552), which do not depend on timestamps in the
+archive. If the script is run by a python version with a different bytecode format,
+the sources are used instead.
+"""
+
+import io
+import os
+import py_compile
 import shutil
-import binascii
+import stat
+import sys
+import tempfile
+import zipfile
+
+# the marker of argcomplete must be found in the first lines of the script
+HEADER = b'#!/usr/bin/env python3\n# PYTHON_ARGCOMPLETE_OK\n'
+
+# fixed timestamp, s.t. the archive only changes if the sources change
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
 
 
 def recursive_list(dirname):
@@ -16,33 +37,60 @@ def recursive_list(dirname):
     return ret
 
 
-def main():
-    dirname = os.path.dirname(sys.argv[0])
-    dirname = os.path.realpath(dirname)
-    waspdir = os.path.join(dirname, '../src')
-    target = os.path.join(dirname, 'wasp-build')
-    shutil.copy(os.path.join(dirname, 'wasp-prebuild'), target)
-    with open(target, 'a') as out:
-        out.write('\n\nwasp_packed=[')
-        for fpath in recursive_list(waspdir):
-            ext = os.path.splitext(fpath)[1]
-            if ext != '.py':
-                continue
-            relpath = os.path.relpath(fpath, start=waspdir)
-            with open(fpath, 'rb') as f:
-                data = f.read()
-                data = zlib.compress(data)
-                data = binascii.b2a_base64(data)
-                out.write('\n("{0}", {1}),'.format(relpath, data))
-        out.write('\n]\n')
-        out.write("""
+def compile_source(fpath, relpath, tmpdir):
+    """
+    Compiles ``fpath`` into an unchecked hash-based ``.pyc`` file and returns its content.
+    ``relpath`` is the path shown in tracebacks.
+    """
+    cfile = os.path.join(tmpdir, 'module.pyc')
+    py_compile.compile(fpath, cfile=cfile, dfile=relpath, doraise=True,
+                       invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+    with open(cfile, 'rb') as f:
+        return f.read()
+
+
+def write_entry(archive, name, data):
+    info = zipfile.ZipInfo(name, date_time=ZIP_DATE_TIME)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o644 << 16
+    archive.writestr(info, data)
 
-if __name__ == '__main__':
-    main()
 
+def create_wasp(srcdir, prebuild, target):
+    """
+    Packs the ``wasp`` package found in ``srcdir`` together with the
+    ``prebuild`` script into the executable zip application ``target``.
+    """
+    buf = io.BytesIO()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with zipfile.ZipFile(buf, 'w') as archive:
+            with open(prebuild, 'rb') as f:
+                write_entry(archive, '__main__.py', f.read().replace(b'\r\n', b'\n'))
+            write_entry(archive, '__main__.pyc', compile_source(prebuild, '__main__.py', tmpdir))
+            waspdir = os.path.join(srcdir, 'wasp')
+            for fpath in sorted(recursive_list(waspdir)):
+                if os.path.splitext(fpath)[1] != '.py':
+                    continue
+                # replace \ with / on windows
+                relpath = os.path.relpath(fpath, start=srcdir).replace('\\', '/')
+                with open(fpath, 'rb') as f:
+                    write_entry(archive, relpath, f.read().replace(b'\r\n', b'\n'))
+                write_entry(archive, relpath + 'c', compile_source(fpath, relpath, tmpdir))
+    finally:
+        shutil.rmtree(tmpdir)
+    with open(target, 'wb') as out:
+        out.write(HEADER)
+        out.write(buf.getvalue())
+    mode = os.stat(target).st_mode
+    os.chmod(target, mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
 
-""")
 
+def main():
+    dirname = os.path.dirname(sys.argv[0])
+    dirname = os.path.realpath(dirname)
+    create_wasp(os.path.join(dirname, '..', 'src'), os.path.join(dirname, 'wasp-prebuild'),
+                os.path.join(dirname, 'wasp-build'))
 
 
 if __name__ == '__main__':
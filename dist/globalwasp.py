@@ -3,37 +3,171 @@
 """
 This code is public domain.
 
-This script unpacks the wasp build tool and should be checked into vcs
-repositories.
+This script runs the wasp build tool of the project in which it is invoked,
+i.e. the ``wasp`` script found in the current directory or in one of its parents.
 """
 
 # PYTHON_ARGCOMPLETE_OK
 
 import json
+import struct
 import sys
 import os
 import zlib
+import zipfile
 import binascii
 
 UNPACK_DIR = '.wasp'
 CACHE_FILE = 'c4che.json'
+SQLITE_CACHE_FILE = 'c4che.sqlite'
+BINARY_CACHE_FILE = 'c4che.bin'
+SHARDED_CACHE_DIR = 'c4che.d'
+
+def is_topdir(dir):
+    return os.path.isfile(os.path.join(dir, 'wasp'))
+
+
+def read_binary_section(fpath, section_name):
+    """
+    Decodes a section of a binary cache file (see ``wasp.cache.BinaryStorage``).
+    """
+    u32 = struct.Struct('<I')
+    with open(fpath, 'rb') as f:
+        data = f.read()
+    magic = b'WASPC4CHE1'
+    if data[:len(magic)] != magic:
+        return None
+    pos = len(magic)
+    count = u32.unpack_from(data, pos)[0]
+    pos += 4
+    for _ in range(count):
+        length = u32.unpack_from(data, pos)[0]
+        pos += 4
+        name = data[pos:pos + length].decode('UTF-8')
+        pos += length
+        flags = data[pos]
+        length = u32.unpack_from(data, pos + 1)[0]
+        pos += 5
+        payload = data[pos:pos + length]
+        pos += length
+        if name == section_name:
+            break
+    else:
+        return None
+    if flags & 1:
+        payload = zlib.decompress(payload)
+    state = {'pos': 0}
+
+    def read_u32():
+        ret = u32.unpack_from(payload, state['pos'])[0]
+        state['pos'] += 4
+        return ret
+
+    def read_value():
+        tag = payload[state['pos']:state['pos'] + 1]
+        state['pos'] += 1
+        if tag == b'S':
+            return strings[read_u32()]
+        elif tag == b'M':
+            return dict((strings[read_u32()], read_value()) for _ in range(read_u32()))
+        elif tag == b'L':
+            return [read_value() for _ in range(read_u32())]
+        elif tag in (b'N', b'T', b'F'):
+            return {b'N': None, b'T': True, b'F': False}[tag]
+        elif tag in (b'I', b'D'):
+            ret = struct.unpack_from('<q' if tag == b'I' else '<d', payload, state['pos'])[0]
+            state['pos'] += 8
+            return ret
+        elif tag == b'B':
+            return int(strings[read_u32()])
+        raise ValueError('Invalid tag in cache section.')
+
+    strings = []
+    for _ in range(read_u32()):
+        length = read_u32()
+        strings.append(payload[state['pos']:state['pos'] + length].decode('UTF-8'))
+        state['pos'] += length
+    return read_value()
+
+
+def read_cache_ctx(builddir):
+    """
+    Reads the 'ctx' prefix from the cache in ``builddir``.
+    """
+    json_file = os.path.join(builddir, CACHE_FILE)
+    if os.path.isfile(json_file):
+        try:
+            with open(json_file, 'r') as fobj:
+                d = json.load(fobj)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(d, dict):
+            return None
+        return d.get('ctx', None)
+    sharded_file = os.path.join(builddir, SHARDED_CACHE_DIR, 'ctx.json')
+    if os.path.isfile(sharded_file):
+        try:
+            with open(sharded_file, 'r') as fobj:
+                d = json.load(fobj)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(d, dict):
+            return None
+        return d
+    sqlite_file = os.path.join(builddir, SQLITE_CACHE_FILE)
+    if os.path.isfile(sqlite_file):
+        import sqlite3
+        try:
+            conn = sqlite3.connect(sqlite_file)
+            try:
+                row = conn.execute("SELECT tablename FROM prefixes WHERE name = 'ctx'").fetchone()
+                if row is None:
+                    return None
+                return {k: json.loads(v) for k, v in conn.execute('SELECT key, value FROM {0}'.format(row[0]))}
+            finally:
+                conn.close()
+        except (sqlite3.Error, ValueError):
+            return None
+    binary_file = os.path.join(builddir, BINARY_CACHE_FILE)
+    if os.path.isfile(binary_file):
+        try:
+            return read_binary_section(binary_file, 'ctx')
+        except (OSError, ValueError, struct.error, zlib.error):
+            return None
+    return None
+
+
+def topdir_from_cache(builddir):
+    """
+    Reads the topdir from the cache in ``builddir``. If the build
+    directory has been moved (e.g. restored from a CI cache into a different
+    workspace), the stored topdir is rebased using the stored location of
+    the build directory relative to the topdir.
+    """
+    ctx = read_cache_ctx(builddir)
+    if not isinstance(ctx, dict):
+        return None
+    topdir = ctx.get('topdir', None)
+    if not isinstance(topdir, str):
+        return None
+    rel_builddir = ctx.get('builddir', None)
+    if not isinstance(rel_builddir, str):
+        # written by an older version of wasp, cannot rebase
+        return topdir
+    old_builddir = os.path.normpath(os.path.join(topdir, rel_builddir))
+    if old_builddir == builddir and is_topdir(topdir):
+        return topdir
+    rebased = os.path.normpath(os.path.join(builddir, os.path.relpath(topdir, old_builddir)))
+    if is_topdir(rebased):
+        return rebased
+    return None
+
 
 def detect_topdir():
     dir = os.getcwd()
-    for f in os.listdir(dir):
-        if f == CACHE_FILE:
-            with open(f, 'r') as fobj:
-                try:
-                    d = json.load(fobj)
-                except:
-                    break
-                ctx = d.get('ctx', None)
-                if ctx is None:
-                    break
-                if not isinstance(ctx, dict):
-                    break
-                topdir = ctx.get('topdir', None)
-                return topdir
+    topdir = topdir_from_cache(dir)
+    if topdir is not None:
+        return topdir
     while dir != '/':
         for f in os.listdir(dir):
             if f == 'wasp':
@@ -50,24 +184,31 @@ def main():
               'containing a ``wasp`` file or from a build directory '
               'containing an initialized `{0}` file.'.format(CACHE_FILE))
         sys.exit(1)
+    fname = os.path.join(topdir, 'wasp')
     unpack_dir = os.path.join(topdir, UNPACK_DIR)
-    if not os.path.exists(unpack_dir):
-        fname = os.path.join(topdir, 'wasp')
-        code = []
-        with open(fname, 'r') as f:
-            start = False
-            for line in f:
-                if 'wasp_packed=[' in line:
-                    start = True
-                if line == '\n' and start:
-                    break
-                if start:
-                    code.append(line)
-        vs = {}
-        exec(''.join(code), vs, vs)
-        unpack(unpack_dir, vs['wasp_packed'])
-    sys.path.append(unpack_dir)
-    run(topdir, unpack_dir)
+    package_path = unpack_dir
+    if zipfile.is_zipfile(fname):
+        # the wasp script is a zip application, import wasp directly from it
+        package_path = fname
+        sys.path.insert(0, fname)
+    else:
+        # wasp scripts of older versions contain the packed sources
+        if not os.path.exists(unpack_dir):
+            code = []
+            with open(fname, 'r') as f:
+                start = False
+                for line in f:
+                    if 'wasp_packed=[' in line:
+                        start = True
+                    if line == '\n' and start:
+                        break
+                    if start:
+                        code.append(line)
+            vs = {}
+            exec(''.join(code), vs, vs)
+            unpack(unpack_dir, vs['wasp_packed'])
+        sys.path.append(unpack_dir)
+    run(topdir, unpack_dir, package_path)
 
 
 class WaspInstallationError(RuntimeError):
@@ -111,10 +252,133 @@ def unpack(unpack_dir, code):
             f.write(s)
 
 
-def run(topdir, unpack_dir):
+SERVER_SOCKET = 'wasp.sock'
+SERVER_RESTART_TIMEOUT = 60
+
+
+def builddir():
+    """
+    Returns the build directory given on the command line or in the environment.
+    """
+    argv = sys.argv[1:]
+    for i, arg in enumerate(argv[:-1]):
+        if arg == '-b' or arg == '--builddir':
+            return argv[i + 1]
+    return os.environ.get('BUILDDIR', 'build')
+
+
+def server_socket_path():
+    """
+    Returns the path of the socket of a wasp server (see ``wasp.server``) based
+    on the build directory given on the command line or in the environment.
+    """
+    return os.path.join(builddir(), SERVER_SOCKET)
+
+
+def load_noop(path):
+    """
+    Loads the module ``wasp.noop`` from ``path``, which is either a zip application
+    or a directory containing the ``wasp`` package, without importing ``wasp`` itself.
+    Returns None if the module cannot be loaded (e.g. for older versions of wasp).
+    """
+    import types
+    try:
+        if os.path.isfile(path):
+            import zipimport
+            code = zipimport.zipimporter(os.path.join(path, 'wasp')).get_code('noop')
+        else:
+            fpath = os.path.join(path, 'wasp', 'noop.py')
+            with open(fpath, 'r') as f:
+                code = compile(f.read(), fpath, 'exec')
+        module = types.ModuleType('wasp.noop')
+        exec(code, module.__dict__)
+    except (ImportError, OSError, SyntaxError):
+        return None
+    return module
+
+
+def up_to_date(path):
+    """
+    Checks the manifest written by the last invocation if nothing had to be done
+    (see ``wasp.noop.up_to_date``). Returns the message to be printed if the command line,
+    the environment and all recorded files are unchanged, otherwise None.
+
+    :param path: The location of the ``wasp`` package, see :func:`load_noop`.
+    """
+    if '--server' in sys.argv:
+        return None
+    noop = load_noop(path)
+    if noop is None or not hasattr(noop, 'up_to_date'):
+        return None
+    return noop.up_to_date(builddir(), sys.argv[1:])
+
+
+def run_client():
+    """
+    Forwards the invocation to a running wasp server (see ``wasp.server``) and
+    streams its output. Returns the exit code or None if no server is running.
+    """
+    import json
+    import socket
+    import time
+    path = server_socket_path()
+    if '--server' in sys.argv or not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+    request = json.dumps({'argv': sys.argv[1:], 'env': dict(os.environ),
+                          'tty': [sys.stdout.isatty(), sys.stderr.isatty()]}) + '\n'
+    deadline = None
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except OSError:
+            sock.close()
+            if deadline is None:
+                return None
+            if time.monotonic() > deadline:
+                print('Timeout while waiting for the wasp server to restart.', file=sys.stderr)
+                return 1
+            # the server is restarting
+            time.sleep(0.05)
+            continue
+        with sock, sock.makefile('rb') as f:
+            try:
+                sock.sendall(request.encode('UTF-8'))
+                for line in f:
+                    msg = json.loads(line.decode('UTF-8'))
+                    if 'stdout' in msg:
+                        sys.stdout.write(msg['stdout'])
+                        sys.stdout.flush()
+                    elif 'stderr' in msg:
+                        sys.stderr.write(msg['stderr'])
+                        sys.stderr.flush()
+                    elif 'exit' in msg:
+                        return msg['exit']
+                    elif msg.get('restart', False):
+                        deadline = time.monotonic() + SERVER_RESTART_TIMEOUT
+                        break
+                else:
+                    print('Connection to the wasp server was lost.', file=sys.stderr)
+                    return 1
+            except OSError:
+                print('Connection to the wasp server was lost.', file=sys.stderr)
+                return 1
+
+
+def run(topdir, unpack_dir, package_path):
     # make sure cwd is the directory in which the wasp script
     # is. Thus, topdir gets set to cwd.
     os.chdir(topdir)
+    # exit immediately if nothing has changed since the last invocation
+    message = up_to_date(package_path)
+    if message is not None:
+        if message:
+            print(message)
+        sys.exit(0)
+    # forward the invocation to a running server
+    exit_code = run_client()
+    if exit_code is not None:
+        sys.exit(exit_code)
     try:
         wasp = __import__('wasp')
     except ImportError:
@@ -213,10 +213,13 @@ from .argument import Argument, value, arg, format_string, find_argumentkeys_in_
 from .commands import command, Command, CommandFailedError
 from .fs import Directory, File, copy, remove, paths, path, find, find_exe
 from .fs import files, file, path, paths, directories, directory, move
+from .fs import GlobNode, glob
 from .task import Task, group, chain, task, TaskCollection, TaskGroup, collect, empty, TaskFailedError
 from .shell import shell, ShellTask, quote
+from .worker import WorkerTask, python_worker
 from .tools import tool
 from .builtin import build, configure, alias, init, clean
 from .metadata import metadata, Metadata
-from .node import Node, FileNode, SymbolicNode, nodes, node, spawn, SpawningNode
+from .node import Node, FileNode, SymbolicNode, EnvNode, nodes, node, spawn, SpawningNode
+from .memo import memoize
 
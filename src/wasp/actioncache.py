@@ -0,0 +1,642 @@
+"""
+Local, content-addressed cache for the outputs of tasks.
+
+The cache consists of two stores below a common directory:
+
+    * ``cas/``: The content-addressed store. Each blob is a copy of a target file
+      and is named after the sha256 digest of its content.
+    * ``ac/``: The action cache. Each entry is a json file named after the action key
+      of a task (see :meth:`ActionCache.action_key`). It maps the targets of the task
+      to blobs in the content-addressed store and contains the output of the task
+      (see :meth:`wasp.task.Task.cached_output`) as well as the digests of the files
+      discovered while running the task (see :meth:`wasp.task.Task.discovered_sources`).
+
+If the action key of a task is found in the cache, the targets of the task are
+restored from the store instead of running the task. The size of the cache is accounted
+for and the least recently used blobs are evicted once it grows beyond its maximum size.
+
+Optionally, a remote cache server may be used (see :class:`RemoteCache`), which serves the
+same stores over http using the paths ``/ac/<key>`` and ``/cas/<digest>``. Actions which
+are missing in the local cache are downloaded from the server and actions stored
+locally are uploaded to the server. A reference server is implemented by :func:`serve`.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from .node import FileNode
+from .fs import relocatable_path, expand_path
+from . import log, osinfo
+
+LINK_MODES = ['auto', 'copy', 'hardlink']
+"""
+Valid values for the ``link`` option of the action cache:
+
+    * ``auto``: Clone the file if the filesystem supports it (reflink), copy it otherwise.
+    * ``copy``: Always copy the file.
+    * ``hardlink``: Hardlink the file into the build directory, fall back to copying it.
+      The restored files are read-only, since modifying them in-place would
+      alter the content of the cache.
+"""
+
+DEFAULT_MAX_SIZE = 5 * 1024 ** 3
+"""
+Default maximum size of the action cache (5 GiB).
+"""
+
+EVICT_RATIO = 0.8
+"""
+Once the cache exceeds its maximum size, blobs are evicted until
+the size of the cache falls below ``EVICT_RATIO * max_size``.
+"""
+
+FICLONE = 0x40049409
+"""
+ioctl request for cloning a file on linux (see ``ioctl_ficlone(2)``).
+"""
+
+REMOTE_JOBS = 8
+"""
+Number of parallel connections used for uploading to and downloading from a remote cache.
+"""
+
+REMOTE_TIMEOUT = 10.0
+"""
+Timeout in seconds for requests to a remote cache.
+"""
+
+STORES = ['ac', 'cas']
+"""
+Names of the stores of the cache, which also define the paths used by remote caches.
+"""
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+_BLOCK_SIZE = 1024 * 1024
+_SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def parse_size(value):
+    """
+    Parses a size given either as number of bytes or as string
+    with a unit suffix, such as '512M' or '10G'.
+
+    :return: The size in bytes. Raises a ValueError if the value cannot be parsed.
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if not isinstance(value, str):
+        raise ValueError('Expected an int or str as size, got `{0}`'.format(type(value).__name__))
+    m = re.match(r'^\s*(\d+)\s*([kmgt]?)i?b?\s*$', value.lower())
+    if m is None:
+        raise ValueError('Invalid size: `{0}`'.format(value))
+    return int(m.group(1)) * _SIZE_UNITS[m.group(2)]
+
+
+def file_digest(fpath):
+    """
+    Returns the sha256 hexdigest of the content of a file.
+    """
+    h = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        while True:
+            data = f.read(_BLOCK_SIZE)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+def _reflink(src, dst):
+    if not osinfo.linux:
+        return False
+    import fcntl
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+class ActionCache(object):
+    """
+    Local content-addressed cache for task outputs.
+
+    :param directory: Directory in which the cache is stored.
+    :param max_size: Maximum size of the cache in bytes (see :func:`parse_size`).
+    :param link: Determines how files are restored from the cache, see :data:`LINK_MODES`.
+    :param remote: Optional :class:`RemoteCache` which is queried for actions missing
+        in the local cache.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, link='auto', remote=None):
+        assert link in LINK_MODES, 'Invalid link mode `{0}`, expected one of `{1}`'.format(link, LINK_MODES)
+        self._directory = os.path.abspath(directory)
+        self._max_size = parse_size(max_size)
+        self._link = link
+        self._remote = remote
+        self._size = None
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        """
+        Returns the directory in which the cache is stored.
+        """
+        return self._directory
+
+    @property
+    def max_size(self):
+        """
+        Returns the maximum size of the cache in bytes.
+        """
+        return self._max_size
+
+    @property
+    def remote(self):
+        """
+        Returns the :class:`RemoteCache` used by this cache or None.
+        """
+        return self._remote
+
+    @property
+    def size(self):
+        """
+        Returns the size of all files in the cache in bytes. The size is determined
+        by scanning the cache once and is then updated as files are added or evicted.
+        """
+        with self._lock:
+            return self._get_size()
+
+    def _get_size(self):
+        if self._size is None:
+            self._size = sum(entry.stat().st_size for entry in self._scan('cas') + self._scan('ac'))
+        return self._size
+
+    def _scan(self, store):
+        ret = []
+        root = os.path.join(self._directory, store)
+        if not os.path.isdir(root):
+            return ret
+        for subdir in os.scandir(root):
+            if not subdir.is_dir(follow_symlinks=False):
+                continue
+            ret.extend(entry for entry in os.scandir(subdir.path)
+                       if entry.is_file(follow_symlinks=False) and not entry.name.endswith('.tmp'))
+        return ret
+
+    def _path(self, store, digest):
+        return os.path.join(self._directory, store, digest[:2], digest)
+
+    def cacheable(self, task):
+        """
+        Returns True if the outputs of ``task`` may be stored in the cache. This is the
+        case if :attr:`wasp.task.Task.cacheable` is set, the task is not run always and
+        its targets consist of files and possibly symbolic nodes. All source files must exist.
+        """
+        if not task.cacheable or task.always:
+            return False
+        if not any(isinstance(t, FileNode) for t in task.targets):
+            return False
+        for src in task.sources:
+            if isinstance(src, FileNode) and not os.path.isfile(src.path):
+                return False
+        return True
+
+    def action_key(self, task, ns=None):
+        """
+        Computes the key under which the outputs of ``task`` are stored. It is derived from
+        the fingerprint of the task (see :meth:`wasp.task.Task.fingerprint`), the content
+        of all source files, the signatures of all other sources and the target keys.
+        Paths are made relocatable, s.t. the cache may be shared between different checkouts.
+        """
+        h = hashlib.sha256()
+        h.update(task.fingerprint().encode('UTF-8'))
+        for src in sorted(task.sources, key=lambda n: n.key):
+            if isinstance(src, FileNode):
+                value = file_digest(src.path)
+                key = relocatable_path(src.key)
+            else:
+                signature = src.signature(ns=ns)
+                if not signature.valid:
+                    signature.refresh()
+                value = signature.value
+                key = src.key
+            h.update('\0src:{0}={1}'.format(key, value).encode('UTF-8'))
+        for tgt in sorted(task.targets, key=lambda n: n.key):
+            key = relocatable_path(tgt.key) if isinstance(tgt, FileNode) else tgt.key
+            h.update('\0tgt:{0}'.format(key).encode('UTF-8'))
+        return h.hexdigest()
+
+    def lookup(self, key):
+        """
+        Returns the action stored under ``key`` or None if there is no such action or if
+        any of its blobs has been evicted. Actions missing in the local cache are
+        downloaded from the remote cache, if any.
+        """
+        fpath = self._path('ac', key)
+        try:
+            with open(fpath, 'r') as f:
+                action = json.load(f)
+        except (OSError, ValueError):
+            return self._download(key)
+        for target in action['targets'].values():
+            if not os.path.exists(self._path('cas', target['blob'])):
+                self._remove(fpath)
+                return self._download(key)
+        return action
+
+    def _download(self, key):
+        if self._remote is None:
+            return None
+        data = self._remote.get('ac', key)
+        if data is None:
+            return None
+        try:
+            action = json.loads(data.decode('UTF-8'))
+            digests = set(target['blob'] for target in action['targets'].values())
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+        digests = [d for d in digests if not os.path.exists(self._path('cas', d))]
+        # download the blobs in parallel, the action is only stored once all blobs are available
+        blobs = self._remote.map(lambda digest: self._remote.get('cas', digest), digests)
+        try:
+            for digest, blob in zip(digests, blobs):
+                if blob is None or hashlib.sha256(blob).hexdigest() != digest:
+                    return None
+                self._write(self._path('cas', digest), blob, readonly=True)
+            self._write(self._path('ac', key), data)
+        except OSError as e:
+            log.warn(log.format_warn('Failed to store downloaded action: {0}'.format(str(e))))
+            return None
+        return action
+
+    def restore(self, key, task):
+        """
+        Restores the targets and the output of ``task`` from the action stored under ``key``.
+        Nothing is restored if any of the discovered sources stored with the action has changed.
+
+        :return: True if the action was found and restored, False otherwise.
+        """
+        action = self.lookup(key)
+        if action is None:
+            return False
+        targets = [t for t in task.targets if isinstance(t, FileNode)]
+        if any(relocatable_path(t.key) not in action['targets'] for t in targets):
+            return False
+        # the action key does not cover the discovered sources (e.g. headers),
+        # since they are not known before the task has run.
+        for fpath, digest in action.get('inputs', {}).items():
+            fpath = expand_path(fpath)
+            if not os.path.isfile(fpath) or file_digest(fpath) != digest:
+                log.debug('Not restoring outputs from the action cache, `{0}` has changed.'.format(fpath))
+                return False
+        try:
+            for tgt in targets:
+                stored = action['targets'][relocatable_path(tgt.key)]
+                blob = self._path('cas', stored['blob'])
+                self._restore_file(blob, tgt.path, stored['mode'])
+                os.utime(blob)
+        except OSError as e:
+            log.debug(log.format_warn('Failed to restore outputs from the action cache: {0}'.format(str(e))))
+            return False
+        os.utime(self._path('ac', key))
+        task.restore_output(action['output'])
+        return True
+
+    def _restore_file(self, blob, dst, mode):
+        if os.path.lexists(dst):
+            os.remove(dst)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if self._link == 'hardlink':
+            try:
+                os.link(blob, dst)
+                return
+            except OSError:
+                pass
+        if self._link == 'copy' or not _reflink(blob, dst):
+            shutil.copyfile(blob, dst)
+        os.chmod(dst, mode)
+
+    def unlink_targets(self, task):
+        """
+        Removes target files of ``task`` which are hardlinked, s.t. running the
+        task cannot modify the content of the cache in-place.
+        """
+        if self._link != 'hardlink':
+            return
+        for tgt in task.targets:
+            if not isinstance(tgt, FileNode):
+                continue
+            try:
+                if os.stat(tgt.path).st_nlink > 1:
+                    os.remove(tgt.path)
+            except OSError:
+                pass
+
+    def store(self, key, task):
+        """
+        Stores the targets, the output and the digests of the discovered sources of ``task``
+        under ``key``. If a target file or a discovered source is missing, nothing is stored. Evicts the least recently used blobs if the cache grows too large.
+        """
+        try:
+            targets = {}
+            for tgt in task.targets:
+                if not isinstance(tgt, FileNode):
+                    continue
+                if not os.path.isfile(tgt.path):
+                    return
+                targets[relocatable_path(tgt.key)] = {
+                    'blob': self._put_blob(tgt.path),
+                    'mode': os.stat(tgt.path).st_mode & 0o777
+                }
+            inputs = {}
+            for fpath in task.discovered_sources():
+                fpath = os.path.abspath(str(fpath))
+                if not os.path.isfile(fpath):
+                    return
+                inputs[relocatable_path(fpath)] = file_digest(fpath)
+            data = json.dumps({'targets': targets, 'output': task.cached_output(),
+                               'inputs': inputs}).encode('UTF-8')
+            self._write(self._path('ac', key), data)
+        except OSError as e:
+            log.warn(log.format_warn('Failed to store outputs in the action cache: {0}'.format(str(e))))
+            return
+        if self._remote is not None and self._remote.upload:
+            blobs = set(target['blob'] for target in targets.values())
+            self._remote.upload_action(key, data, {digest: self._path('cas', digest) for digest in blobs})
+        with self._lock:
+            if self._get_size() > self._max_size:
+                self._evict()
+
+    def flush(self):
+        """
+        Waits until all pending uploads to the remote cache have finished.
+        """
+        if self._remote is not None:
+            self._remote.flush()
+
+    def _put_blob(self, fpath):
+        digest = file_digest(fpath)
+        blob = self._path('cas', digest)
+        if os.path.exists(blob):
+            os.utime(blob)
+            return digest
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp = '{0}.{1}.tmp'.format(blob, threading.get_ident())
+        shutil.copyfile(fpath, tmp)
+        # blobs may be hardlinked into the build directory, make sure they cannot be modified in-place
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, blob)
+        self._account(os.stat(blob).st_size)
+        return digest
+
+    def _write(self, fpath, data, readonly=False):
+        old_size = os.stat(fpath).st_size if os.path.exists(fpath) else 0
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        tmp = '{0}.{1}.tmp'.format(fpath, threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        if readonly:
+            os.chmod(tmp, 0o444)
+        os.replace(tmp, fpath)
+        self._account(len(data) - old_size)
+
+    def _account(self, delta):
+        with self._lock:
+            if self._size is not None:
+                self._size += delta
+
+    def _remove(self, fpath):
+        try:
+            size = os.stat(fpath).st_size
+            os.remove(fpath)
+        except OSError:
+            return
+        self._account(-size)
+
+    def _evict(self):
+        # must be called while holding self._lock.
+        # blobs and actions are touched whenever they are used, thus removing
+        # the files with the oldest modification time evicts the least recently used entries.
+        entries = sorted(self._scan('cas') + self._scan('ac'), key=lambda entry: entry.stat().st_mtime)
+        target_size = int(self._max_size * EVICT_RATIO)
+        for entry in entries:
+            if self._size <= target_size:
+                break
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._size -= entry.stat().st_size
+        log.debug('Evicted entries from the action cache, size is now {0} bytes.'.format(self._size))
+
+
+class RemoteCache(object):
+    """
+    Client for a remote cache server, which stores actions with ``GET`` and ``PUT`` requests
+    to ``<url>/ac/<key>`` and blobs to ``<url>/cas/<sha256>``. Downloads are done in parallel,
+    uploads are run in the background (see :meth:`RemoteCache.flush`). If the server cannot
+    be reached, the remote cache is disabled for the rest of the run.
+
+    :param url: Base url of the server, e.g. 'http://localhost:9092'.
+    :param upload: Determines whether the outputs of tasks are uploaded to the server.
+    :param jobs: Number of parallel connections to the server.
+    :param timeout: Timeout of the requests in seconds.
+    """
+
+    def __init__(self, url, upload=True, jobs=REMOTE_JOBS, timeout=REMOTE_TIMEOUT):
+        self._url = url.rstrip('/')
+        self._upload = upload
+        self._timeout = timeout
+        self._jobs = jobs
+        self._pool = None
+        self._uploads = []
+        self._lock = threading.Lock()
+        self._disabled = False
+
+    @property
+    def url(self):
+        """
+        Returns the base url of the server.
+        """
+        return self._url
+
+    @property
+    def upload(self):
+        """
+        Returns True if the outputs of tasks are uploaded to the server.
+        """
+        return self._upload
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self._jobs)
+            return self._pool
+
+    def _request(self, method, store, key, data=None):
+        if self._disabled:
+            return None
+        request = Request('{0}/{1}/{2}'.format(self._url, store, key), data=data, method=method)
+        try:
+            with urlopen(request, timeout=self._timeout) as response:
+                return response.read()
+        except HTTPError as e:
+            if e.code != 404:
+                log.debug(log.format_warn('Remote cache: {0} {1}/{2} failed: {3}'.format(method, store, key, str(e))))
+            return None
+        except (URLError, OSError) as e:
+            if not self._disabled:
+                self._disabled = True
+                log.warn(log.format_warn('Remote cache at `{0}` is not reachable, '
+                                         'disabling it: {1}'.format(self._url, str(e))))
+            return None
+
+    def get(self, store, key):
+        """
+        Returns the content of ``<url>/<store>/<key>`` as bytes or None if it does not exist.
+        """
+        return self._request('GET', store, key)
+
+    def contains(self, store, key):
+        """
+        Returns True if ``<url>/<store>/<key>`` exists on the server.
+        """
+        return self._request('HEAD', store, key) is not None
+
+    def put(self, store, key, data):
+        """
+        Uploads ``data`` to ``<url>/<store>/<key>``.
+        """
+        self._request('PUT', store, key, data=data)
+
+    def map(self, fun, items):
+        """
+        Applies ``fun`` to all ``items`` in parallel and returns a list of the results.
+        """
+        if len(items) <= 1:
+            return [fun(item) for item in items]
+        return list(self._get_pool().map(fun, items))
+
+    def upload_action(self, key, data, blobs):
+        """
+        Uploads an action in the background. The blobs are uploaded first, s.t. the action
+        is only visible to other clients once all its blobs are available.
+
+        :param key: The action key.
+        :param data: The json encoded action as bytes.
+        :param blobs: dict of ``{digest: path}`` of the blobs the action refers to.
+        """
+        def _upload():
+            for digest, fpath in blobs.items():
+                if self.contains('cas', digest):
+                    continue
+                try:
+                    with open(fpath, 'rb') as f:
+                        self.put('cas', digest, f.read())
+                except OSError:
+                    return
+            self.put('ac', key, data)
+        future = self._get_pool().submit(_upload)
+        with self._lock:
+            self._uploads.append(future)
+
+    def flush(self):
+        """
+        Waits until all pending uploads have finished.
+        """
+        with self._lock:
+            uploads = self._uploads
+            self._uploads = []
+        for future in uploads:
+            future.result()
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the reference cache server (see :func:`serve`).
+    The served :class:`ActionCache` is accessible as ``self.server.cache``.
+    """
+
+    def _parse(self):
+        splits = self.path.strip('/').split('/')
+        if len(splits) != 2 or splits[0] not in STORES or _DIGEST_RE.match(splits[1]) is None:
+            self.send_error(400, 'Invalid path, expected /ac/<key> or /cas/<sha256>.')
+            return None
+        return self.server.cache._path(*splits)
+
+    def do_HEAD(self):
+        fpath = self._parse()
+        if fpath is None:
+            return
+        if not os.path.exists(fpath):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(os.stat(fpath).st_size))
+        self.end_headers()
+
+    def do_GET(self):
+        fpath = self._parse()
+        if fpath is None:
+            return
+        try:
+            with open(fpath, 'rb') as f:
+                data = f.read()
+            os.utime(fpath)
+        except OSError:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        fpath = self._parse()
+        if fpath is None:
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length)
+        is_blob = self.path.strip('/').startswith('cas/')
+        if is_blob and hashlib.sha256(data).hexdigest() != os.path.basename(fpath):
+            self.send_error(400, 'Content does not match its digest.')
+            return
+        cache = self.server.cache
+        cache._write(fpath, data, readonly=is_blob)
+        with cache._lock:
+            if cache._get_size() > cache.max_size:
+                cache._evict()
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        log.debug('cache-server: ' + (format % args))
+
+
+def serve(directory, host='localhost', port=9092, max_size=DEFAULT_MAX_SIZE):
+    """
+    Runs a reference implementation of a remote cache server, storing its
+    data in ``directory``. This function blocks until interrupted.
+    """
+    server = ThreadingHTTPServer((host, port), CacheRequestHandler)
+    server.cache = ActionCache(directory, max_size=max_size)
+    log.info(log.format_info('Serving the action cache in `{0}` at http://{1}:{2}/'
+                             .format(server.cache.directory, host, server.server_address[1])))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,11 +1,30 @@
+import os
+import re
+
 from . import options, ctx, CommandFailedError, decorators, StringOption, log
 from .main import run_command
 from .util import FunctionDecorator
 from .commands import Command, command
 from .option import FlagOption, handle_options, ArgumentOption, IntOption
 from .argument import Argument
-from .fs import remove
-from .cache import CACHE_FILE
+from .fs import remove, expand_path
+from .execution import refresh_pool
+from .signature import SIGNATUREDB_PREFIX, SIGNATURE_RUNS_PREFIX, RUN_COUNTS_PREFIX
+from .node import SYMBOLIC_NODES_PREFIX
+from .cache import split_shard, shard_prefix
+
+
+GC_KEEP_RUNS = 5
+"""
+Default number of runs (of each command) for which the outputs are kept by the `gc` command.
+"""
+
+GC_BYPRODUCT_EXTENSIONS = ['.d']
+"""
+Extensions of files which are produced as byproducts of targets without being targets
+themselves (e.g. dependency files produced by compilers using ``-MMD``). If a target is removed
+by the `gc` command, files with the same name but with these extensions are removed as well.
+"""
 
 
 class init(object):
@@ -54,8 +73,12 @@ def _add_log_options(col):
                        , description=desc_debug, prefix=['-', '-', '--']))
     col.add(FlagOption(name='no-pretty', description='Disable pretty printing'
                        , keys=['u', 'no-pretty', 'ugly']))
+    col.add(FlagOption(name='grouped', keys=['grouped'], description='Print the output of shell commands once '
+                       'they have finished instead of printing it as soon as it is received'))
     col.add(StringOption(name='builddir', keys=['b', 'builddir'], prefix=['-', '--']
                          , description='Sets the build directory'))
+    col.add(FlagOption(name='server', keys=['server'], description='Keep wasp running and execute the '
+                       'commands of subsequent invocations in this process'))
 
 
 @handle_options
@@ -178,7 +201,7 @@ def _clean():
     Default implementation of the `clean` command.
     Delete everything within the `build` directory.
     """
-    cache_exculde = CACHE_FILE
+    cache_exculde = '|'.join(re.escape(os.path.basename(f)) + '$' for f in ctx.cache.files)
     yield remove(ctx.builddir.glob('.*', exclude=cache_exculde, recursive=False, dirs=True), recursive=True)
     ctx.signatures.invalidate_all()
     _clear_cache()
@@ -200,6 +223,133 @@ def alias(from_, to_):
         run_command(to_)
 
 
+@options
+def _add_cache_server_options(col):
+    grp = col.group('cache-server')
+    grp.add(StringOption('directory', 'Directory in which the cache server stores its data.',
+                         keys=['directory']))
+    grp.add(StringOption('host', 'Address on which the cache server listens.', keys=['host']))
+    grp.add(IntOption('port', 'Port on which the cache server listens.', keys=['port']))
+
+
+@command('cache-server', description='Runs a remote cache server for testing.')
+def _cache_server():
+    """
+    Runs the reference implementation of a remote cache server
+    (see :func:`wasp.actioncache.serve`) until interrupted.
+    """
+    grp = ctx.options.group('cache-server')
+    directory = grp['directory'].value or ctx.builddir.join('cache-server').path
+    host = grp['host'].value or 'localhost'
+    port = grp['port'].value or 9092
+    from .actioncache import serve
+    serve(directory, host=host, port=port)
+
+
+@options
+def _add_gc_options(col):
+    grp = col.group('gc')
+    grp.add(IntOption('keep-runs', 'Keep outputs used within the given number of runs '
+                                   '(default: {0}).'.format(GC_KEEP_RUNS), value=GC_KEEP_RUNS))
+    grp.add(FlagOption('dry-run', 'Only print the files which would be removed.'))
+
+
+def _key_to_path(key):
+    if key.startswith(':') or key.startswith('$'):
+        return None  # symbolic nodes and environment variables
+    return os.path.abspath(os.path.join(ctx.topdir.path, expand_path(key)))
+
+
+def _remove_file(fpath):
+    try:
+        os.remove(fpath)
+        return fpath
+    except OSError:
+        return None
+
+
+def _remove_empty_dirs(fpaths, root):
+    dirs = set(os.path.dirname(f) for f in fpaths)
+    for d in sorted(dirs, key=len, reverse=True):
+        while d.startswith(root + os.sep):
+            try:
+                os.rmdir(d)
+            except OSError:
+                break
+            d = os.path.dirname(d)
+
+
+@command('gc', description='Removes stale outputs from the build directory and prunes the cache.')
+def _gc():
+    """
+    Removes files from the build directory which were recorded as nodes in the signature
+    database but which have not been used within the last ``--keep-runs`` runs (e.g. because their
+    sources were removed). The stale entries of the signature database and of the symbolic
+    nodes are pruned from the cache as well.
+    """
+    grp = ctx.options.group('gc')
+    keep_runs = grp['keep_runs'].value
+    if keep_runs is None:
+        keep_runs = GC_KEEP_RUNS
+    cache = ctx.cache
+    run_counts = cache.prefix(RUN_COUNTS_PREFIX)
+    live = set()
+    stale = {}
+    for prefix in cache.prefixes():
+        name, shard = split_shard(prefix)
+        if not name.startswith(SIGNATUREDB_PREFIX):
+            continue
+        ns = name[len(SIGNATUREDB_PREFIX):]
+        oldest = run_counts.get(ns, 0) - keep_runs + 1
+        runs_prefix = shard_prefix(SIGNATURE_RUNS_PREFIX + ns, shard)
+        last_used = cache.prefix(runs_prefix)
+        stale[(prefix, runs_prefix)] = []
+        for key in cache.prefix(prefix).keys():
+            # signatures recorded before their use was tracked are kept
+            if last_used.get(key, oldest) >= oldest:
+                live.add(key)
+            else:
+                stale[(prefix, runs_prefix)].append(key)
+    stale_keys = set(key for keys in stale.values() for key in keys) - live
+    # collect the stale files, only files in the build directory are removed
+    builddir = os.path.abspath(ctx.builddir.path)
+    excluded = set(os.path.abspath(f) for f in cache.files)
+    excluded.update(_key_to_path(key) for key in live)
+    files = set()
+    for key in stale_keys:
+        fpath = _key_to_path(key)
+        if fpath is None or not fpath.startswith(builddir + os.sep):
+            continue
+        candidates = [fpath] + [os.path.splitext(fpath)[0] + ext for ext in GC_BYPRODUCT_EXTENSIONS]
+        for f in candidates:
+            if f not in excluded and os.path.isfile(f):
+                files.add(f)
+    files = sorted(files)
+    if grp['dry_run'].value:
+        for f in files:
+            log.info(log.format_info('Would remove: {0}'.format(f)))
+        return
+    removed = [f for f in refresh_pool().map(_remove_file, files) if f is not None]
+    _remove_empty_dirs(removed, builddir)
+    # prune the cache
+    for (prefix, runs_prefix), keys in stale.items():
+        signaturedb = cache.prefix(prefix)
+        last_used = cache.prefix(runs_prefix)
+        for key in keys:
+            if key in live:
+                continue
+            signaturedb.pop(key, None)
+            last_used.pop(key, None)
+    for prefix in cache.prefixes():
+        if split_shard(prefix)[0] != SYMBOLIC_NODES_PREFIX:
+            continue
+        symbolic_nodes = cache.prefix(prefix)
+        for key in stale_keys:
+            symbolic_nodes.pop(key, None)
+    log.info(log.format_success('Removed {0} stale files and {1} stale cache entries.'
+                                .format(len(removed), len(stale_keys))))
+
+
 @command('diff')
 def _diff():
     thislog = log.clone().configure(verbosity=log.INFO)
@@ -1,5 +1,12 @@
 import json
-from .fs import File
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+from .fs import File, expand_path
 from . import log, factory
 
 CACHE_FILE = 'c4che.json'
@@ -7,6 +14,993 @@ CACHE_FILE = 'c4che.json'
 name of the cache file.
 """
 
+SQLITE_CACHE_FILE = 'c4che.sqlite'
+"""
+name of the cache file used by :class:`SqliteStorage`.
+"""
+
+BINARY_CACHE_FILE = 'c4che.bin'
+"""
+name of the cache file used by :class:`BinaryStorage`.
+"""
+
+JOURNAL_FILE = 'c4che.journal'
+"""
+name of the journal file, see :class:`Journal`.
+"""
+
+LOCK_FILE = 'c4che.lock'
+"""
+name of the lock file, see :class:`FileLock`.
+"""
+
+SHARDED_CACHE_DIR = 'c4che.d'
+"""
+name of the directory used by :class:`ShardedStorage`.
+"""
+
+SHARD_SEPARATOR = '@'
+"""
+Separates the name of a prefix from the name of its shard, see :func:`shard_prefix`.
+"""
+
+_shard_roots = (None, [])
+_shard_cache = {}
+_shard_lock = threading.Lock()
+
+
+def _recurse_roots():
+    global _shard_roots, _shard_cache
+    from . import recursion, ctx
+    registered, roots = _shard_roots
+    if registered == (recursion.index.revision, ctx.topdir.path):
+        return roots
+    with _shard_lock:
+        # the index also contains the directories which have not been loaded by this invocation
+        revision = recursion.index.revision
+        roots = set()
+        for root in recursion.index.directories:
+            if root != recursion.TOPDIR and not root.startswith('..'):
+                roots.add(root)
+        roots = sorted(roots, key=len, reverse=True)
+        _shard_cache = {}
+        _shard_roots = ((revision, ctx.topdir.path), roots)
+        return roots
+
+
+def cache_shard(key):
+    """
+    Returns the name of the shard in which the cache entries belonging to a node with ``key``
+    are stored. The cache is sharded by the subprojects registered using :func:`wasp.recurse`,
+    as recorded in :data:`wasp.recursion.index`, s.t. the shards do not depend on which
+    directories have been loaded: For files, the shard is the subproject directory containing
+    the file (outputs in the build directory are mapped as if the build directory was the
+    top directory). The keys of symbolic nodes of the form ``:name/path`` are mapped based
+    on ``path``. All other keys belong to the root shard, which is named ''.
+    """
+    roots = _recurse_roots()
+    if len(roots) == 0:
+        return ''
+    ret = _shard_cache.get(key)
+    if ret is not None:
+        return ret
+    from . import ctx
+    ret = ''
+    path = None
+    if key.startswith(':'):
+        idx = key.find('/')
+        if idx > 0:
+            path = key[idx + 1:]
+    elif not key.startswith('$'):
+        path = key
+    if path is not None:
+        path = os.path.abspath(expand_path(path))
+        for base in [ctx.builddir, ctx.topdir]:
+            if base is None:
+                continue
+            basepath = os.path.abspath(base.path)
+            if path.startswith(basepath + os.sep):
+                path = os.path.relpath(path, basepath).replace(os.sep, '/')
+                break
+        for root in roots:
+            if path == root or path.startswith(root + '/'):
+                ret = root
+                break
+    _shard_cache[key] = ret
+    return ret
+
+
+def shard_prefix(prefix, shard):
+    """
+    Returns the name of the prefix in which the entries of ``shard`` (see :func:`cache_shard`)
+    are stored, i.e. ``prefix`` for the root shard and ``prefix@shard`` otherwise.
+    """
+    if shard == '':
+        return prefix
+    return prefix + SHARD_SEPARATOR + shard
+
+
+def split_shard(prefix):
+    """
+    Inverse of :func:`shard_prefix`. Returns a tuple ``(prefix, shard)``.
+    """
+    idx = prefix.find(SHARD_SEPARATOR)
+    if idx < 0:
+        return prefix, ''
+    return prefix[:idx], prefix[idx + 1:]
+
+
+def _file_id(fpath):
+    """
+    Returns a tuple identifying the version of a file or None if it does not exist.
+    """
+    try:
+        st = os.stat(fpath)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _replace_file(fpath, data):
+    """
+    Atomically replaces the content of ``fpath`` with ``data``, s.t. concurrent
+    readers never observe a partially written file.
+    """
+    dirname = os.path.dirname(fpath)
+    if dirname != '':
+        os.makedirs(dirname, exist_ok=True)
+    tmp_path = '{0}.{1}.tmp'.format(fpath, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, fpath)
+
+
+def _pid_alive(pid):
+    """
+    Returns True if a process with id ``pid`` is running.
+    """
+    if os.name == 'nt':
+        import ctypes
+        # os.kill() would terminate the process on windows
+        process_query_limited_information = 0x1000
+        still_active = 259
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(process_query_limited_information, False, pid)
+        if not handle:
+            return False
+        try:
+            exit_code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+                return False
+            return exit_code.value == still_active
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class FileLock(object):
+    """
+    Advisory lock (using ``fcntl.flock``) which serializes the access of multiple
+    ``wasp`` processes to the cache files of a build directory. Within a process, the lock
+    is additionally protected by a ``threading.Lock``, since ``flock`` does not
+    exclude threads of the same process. On platforms without ``fcntl`` only
+    the latter is used.
+
+    :param fpath: Path of the lock file.
+    """
+
+    def __init__(self, fpath):
+        self._fpath = str(fpath)
+        self._fd = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        """
+        Returns the path of the lock file.
+        """
+        return self._fpath
+
+    def acquire(self, exclusive=True):
+        """
+        Acquires the lock. Multiple processes may hold a shared lock at the same time,
+        whereas an exclusive lock is only held by a single process.
+        """
+        self._lock.acquire()
+        try:
+            import fcntl
+        except ImportError:
+            return
+        try:
+            dirname = os.path.dirname(self._fpath)
+            if dirname != '':
+                os.makedirs(dirname, exist_ok=True)
+            self._fd = os.open(self._fpath, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        except OSError:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._lock.release()
+            raise
+
+    def release(self):
+        """
+        Releases the lock.
+        """
+        if self._fd is not None:
+            import fcntl
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._lock.release()
+
+    @contextmanager
+    def shared(self):
+        """
+        Context manager holding the lock in shared mode.
+        """
+        self.acquire(exclusive=False)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Context manager holding the lock in exclusive mode.
+        """
+        self.acquire(exclusive=True)
+        try:
+            yield self
+        finally:
+            self.release()
+
+
+class CacheStorage(object):
+    """
+    Base class for storage backends of :class:`Cache`.
+    The cache is organized in prefixes, each of which contains
+    rows indexed by a string key. The rows are passed to and from the storage
+    in their jsonified form (see :func:`wasp.util.Factory.to_json`).
+    """
+
+    def open(self):
+        """
+        Called by :meth:`Cache.load` before any prefix is read. Storages
+        which keep the content in memory must discard it, s.t. it is re-read.
+        """
+        pass
+
+    def prefixes(self):
+        """
+        Returns a list of the names of all prefixes in the storage.
+        """
+        raise NotImplementedError
+
+    def load_prefix(self, prefix):
+        """
+        Returns a dict mapping keys to the jsonified rows of ``prefix``.
+        An empty dict is returned if the prefix does not exist.
+        """
+        raise NotImplementedError
+
+    def save(self, changes, removed):
+        """
+        Persists changes of the cache. Since other processes may have modified the
+        storage since it was opened, the changes must be applied to the current
+        content of the storage instead of overwriting it. The caller
+        holds the lock of the cache (see :class:`FileLock`) while saving.
+
+        :param changes: dict mapping prefix names to ``(updated, deleted)`` tuples,
+            where ``updated`` is a dict of jsonified rows which were added or changed
+            and ``deleted`` is a set of keys which were removed.
+        :param removed: Set of prefixes which were removed entirely. They are removed
+            before ``changes`` are applied.
+        """
+        raise NotImplementedError
+
+    @property
+    def files(self):
+        """
+        Returns a list of paths of the files the storage writes to.
+        """
+        return []
+
+    def close(self):
+        """
+        Releases all resources held by the storage.
+        """
+        pass
+
+
+class JsonStorage(CacheStorage):
+    """
+    Stores the cache as a single json file, which is read entirely at
+    startup and rewritten when saved.
+
+    :param fpath: Path of the json file.
+    :param debug: Format the file such that it is human readable.
+    """
+
+    def __init__(self, fpath, debug=True):
+        self._fpath = str(fpath)
+        self._debug = debug
+        self._data = None
+        self._file_id = None
+
+    def _read(self):
+        if self._data is not None:
+            return self._data
+        self._data = {}
+        self._file_id = _file_id(self._fpath)
+        try:
+            with open(self._fpath, 'r') as f:
+                jsonified = None
+                try:
+                    jsonified = json.load(f)
+                except ValueError:
+                    pass
+            if not isinstance(jsonified, dict):
+                # invalid cache file, ignore
+                # XXX: cannot use ctx.log
+                log.error('Cachefile is invalid. Ignoring.')
+            else:
+                self._data = {k: v for k, v in jsonified.items() if isinstance(v, dict)}
+        except FileNotFoundError:
+            # nvm, cachefile was probably never written
+            # since wasp was never excuted or had anything
+            # to write in the first place
+            pass
+        return self._data
+
+    def open(self):
+        self._data = None
+
+    def prefixes(self):
+        return list(self._read().keys())
+
+    def load_prefix(self, prefix):
+        return dict(self._read().get(prefix, {}))
+
+    def save(self, changes, removed):
+        if self._file_id != _file_id(self._fpath):
+            # modified by another process, merge the changes into the current content
+            self._data = None
+        data = self._read()
+        for prefix in removed:
+            data.pop(prefix, None)
+        for prefix, (updated, deleted) in changes.items():
+            rows = data.setdefault(prefix, {})
+            for key in deleted:
+                rows.pop(key, None)
+            rows.update(updated)
+        if self._debug:
+            jsonified = json.dumps(data, indent=4, separators=(',', ': '))
+        else:
+            jsonified = json.dumps(data)
+        _replace_file(self._fpath, jsonified.encode('UTF-8'))
+        self._file_id = _file_id(self._fpath)
+
+    @property
+    def files(self):
+        return [self._fpath]
+
+    def close(self):
+        self._data = None
+
+
+class SqliteStorage(CacheStorage):
+    """
+    Stores the cache in an sqlite database with one table per prefix and
+    one row per key. Prefixes are only read when they are accessed and saving
+    only writes the rows which have changed in a single transaction.
+
+    :param fpath: Path of the database file.
+    :param migrate_from: Path of a json cache file (see :class:`JsonStorage`). If
+        the database does not exist yet, its content is imported and the json file
+        is removed.
+    """
+
+    def __init__(self, fpath, migrate_from=None):
+        self._fpath = str(fpath)
+        self._migrate_from = migrate_from
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is not None:
+            return self._conn
+        import sqlite3
+        dirname = os.path.dirname(self._fpath)
+        if dirname != '':
+            os.makedirs(dirname, exist_ok=True)
+        exists = os.path.exists(self._fpath)
+        # the cache may be accessed from the worker threads of the executor,
+        # access is serialized using self._lock
+        self._conn = sqlite3.connect(self._fpath, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS prefixes (name TEXT PRIMARY KEY, tablename TEXT)')
+        self._conn.commit()
+        if not exists and self._migrate_from is not None and os.path.exists(self._migrate_from):
+            self._migrate()
+        return self._conn
+
+    def _migrate(self):
+        json_storage = JsonStorage(self._migrate_from)
+        changes = {}
+        for prefix in json_storage.prefixes():
+            changes[prefix] = (json_storage.load_prefix(prefix), set())
+        self._write(changes, set())
+        os.remove(self._migrate_from)
+
+    def _tablename(self, prefix, create=False):
+        conn = self._conn
+        row = conn.execute('SELECT tablename FROM prefixes WHERE name = ?', (prefix,)).fetchone()
+        if row is not None:
+            return row[0]
+        if not create:
+            return None
+        cursor = conn.execute('INSERT INTO prefixes (name, tablename) VALUES (?, NULL)', (prefix,))
+        tablename = 'prefix_{0}'.format(cursor.lastrowid)
+        conn.execute('UPDATE prefixes SET tablename = ? WHERE name = ?', (tablename, prefix))
+        conn.execute('CREATE TABLE {0} (key TEXT PRIMARY KEY, value TEXT)'.format(tablename))
+        return tablename
+
+    def prefixes(self):
+        with self._lock:
+            conn = self._connection()
+            return [row[0] for row in conn.execute('SELECT name FROM prefixes')]
+
+    def load_prefix(self, prefix):
+        with self._lock:
+            self._connection()
+            tablename = self._tablename(prefix)
+            if tablename is None:
+                return {}
+            rows = self._conn.execute('SELECT key, value FROM {0}'.format(tablename))
+            return {key: json.loads(value) for key, value in rows}
+
+    def _write(self, changes, removed):
+        conn = self._conn
+        with conn:
+            for prefix in removed:
+                tablename = self._tablename(prefix)
+                if tablename is None:
+                    continue
+                conn.execute('DROP TABLE {0}'.format(tablename))
+                conn.execute('DELETE FROM prefixes WHERE name = ?', (prefix,))
+            for prefix, (updated, deleted) in changes.items():
+                tablename = self._tablename(prefix, create=True)
+                if len(deleted) > 0:
+                    conn.executemany('DELETE FROM {0} WHERE key = ?'.format(tablename),
+                                     ((key,) for key in deleted))
+                if len(updated) > 0:
+                    conn.executemany('INSERT OR REPLACE INTO {0} (key, value) VALUES (?, ?)'.format(tablename),
+                                     ((key, json.dumps(value)) for key, value in updated.items()))
+
+    def save(self, changes, removed):
+        with self._lock:
+            self._connection()
+            self._write(changes, removed)
+
+    @property
+    def files(self):
+        return [self._fpath]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_BINARY_MAGIC = b'WASPC4CHE1'
+_FLAG_ZLIB = 1
+_U32 = struct.Struct('<I')
+_I64 = struct.Struct('<q')
+_F64 = struct.Struct('<d')
+
+
+class _SectionEncoder(object):
+    """
+    Encodes the rows of a prefix. All strings (keys and values) are interned in
+    a string table at the beginning of the section, s.t. paths which are referenced
+    multiple times (e.g. as key and in the signature) are only stored once.
+    """
+
+    def __init__(self):
+        self._strings = {}
+        self._out = []
+
+    def _string(self, s):
+        idx = self._strings.get(s)
+        if idx is None:
+            idx = len(self._strings)
+            self._strings[s] = idx
+        self._out.append(_U32.pack(idx))
+
+    def _value(self, v):
+        out = self._out
+        if v is None:
+            out.append(b'N')
+        elif v is True:
+            out.append(b'T')
+        elif v is False:
+            out.append(b'F')
+        elif isinstance(v, str):
+            out.append(b'S')
+            self._string(v)
+        elif isinstance(v, int):
+            if -2**63 <= v < 2**63:
+                out.append(b'I')
+                out.append(_I64.pack(v))
+            else:
+                out.append(b'B')
+                self._string(str(v))
+        elif isinstance(v, float):
+            out.append(b'D')
+            out.append(_F64.pack(v))
+        elif isinstance(v, (list, tuple)):
+            out.append(b'L')
+            out.append(_U32.pack(len(v)))
+            for item in v:
+                self._value(item)
+        elif isinstance(v, dict):
+            out.append(b'M')
+            out.append(_U32.pack(len(v)))
+            for key, item in v.items():
+                self._string(str(key))
+                self._value(item)
+        else:
+            raise ValueError('Cannot encode object of type `{0}` in cache.'.format(type(v).__name__))
+
+    def encode(self, rows):
+        self._value(rows)
+        strings = [s.encode('UTF-8') for s in self._strings.keys()]
+        header = [_U32.pack(len(strings))]
+        for s in strings:
+            header.append(_U32.pack(len(s)))
+            header.append(s)
+        return b''.join(header + self._out)
+
+
+class _SectionDecoder(object):
+    """
+    Decodes a section encoded by :class:`_SectionEncoder`.
+    """
+
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+    def _u32(self):
+        ret = _U32.unpack_from(self._data, self._pos)[0]
+        self._pos += 4
+        return ret
+
+    def _value(self, strings):
+        data = self._data
+        tag = data[self._pos:self._pos + 1]
+        self._pos += 1
+        if tag == b'S':
+            return strings[self._u32()]
+        elif tag == b'M':
+            ret = {}
+            for _ in range(self._u32()):
+                key = strings[self._u32()]
+                ret[key] = self._value(strings)
+            return ret
+        elif tag == b'L':
+            return [self._value(strings) for _ in range(self._u32())]
+        elif tag == b'N':
+            return None
+        elif tag == b'T':
+            return True
+        elif tag == b'F':
+            return False
+        elif tag == b'I':
+            ret = _I64.unpack_from(data, self._pos)[0]
+            self._pos += 8
+            return ret
+        elif tag == b'D':
+            ret = _F64.unpack_from(data, self._pos)[0]
+            self._pos += 8
+            return ret
+        elif tag == b'B':
+            return int(strings[self._u32()])
+        raise ValueError('Invalid tag in cache section.')
+
+    def decode(self):
+        strings = []
+        for _ in range(self._u32()):
+            length = self._u32()
+            strings.append(bytes(self._data[self._pos:self._pos + length]).decode('UTF-8'))
+            self._pos += length
+        return self._value(strings)
+
+
+class BinaryStorage(CacheStorage):
+    """
+    Stores the cache in a compact binary file. The file consists of
+    length-prefixed sections, one for each prefix. A section is only decoded once
+    the prefix is accessed. When saving, the sections of prefixes which
+    have not changed are copied without decoding them.
+
+    Each section starts with a table of all strings used in the section,
+    followed by the encoded rows which reference the strings by index.
+
+    :param fpath: Path of the cache file.
+    :param compress: If True, sections are compressed using zlib.
+    :param migrate_from: Path of a json cache file (see :class:`JsonStorage`). If
+        the binary file does not exist yet, the content of the json file is
+        imported and the json file is removed.
+    """
+
+    def __init__(self, fpath, compress=True, migrate_from=None):
+        self._fpath = str(fpath)
+        self._compress = compress
+        self._migrate_from = migrate_from
+        self._sections = None
+        self._file_id = None
+        self._lock = threading.Lock()
+
+    def _read(self):
+        if self._sections is not None:
+            return self._sections
+        self._sections = {}
+        self._file_id = _file_id(self._fpath)
+        if not os.path.exists(self._fpath) and self._migrate_from is not None \
+                and os.path.exists(self._migrate_from):
+            json_storage = JsonStorage(self._migrate_from)
+            for prefix in json_storage.prefixes():
+                self._sections[prefix] = self._encode_section(json_storage.load_prefix(prefix))
+            return self._sections
+        try:
+            with open(self._fpath, 'rb') as f:
+                data = memoryview(f.read())
+        except FileNotFoundError:
+            return self._sections
+        try:
+            self._sections = self._parse(data)
+        except (ValueError, struct.error):
+            self._sections = {}
+            log.error('Cachefile is invalid. Ignoring.')
+        return self._sections
+
+    @staticmethod
+    def _parse(data):
+        if bytes(data[:len(_BINARY_MAGIC)]) != _BINARY_MAGIC:
+            raise ValueError('Invalid cache file.')
+        pos = len(_BINARY_MAGIC)
+        count = _U32.unpack_from(data, pos)[0]
+        pos += 4
+        ret = {}
+        for _ in range(count):
+            length = _U32.unpack_from(data, pos)[0]
+            pos += 4
+            name = bytes(data[pos:pos + length]).decode('UTF-8')
+            pos += length
+            flags = data[pos]
+            pos += 1
+            length = _U32.unpack_from(data, pos)[0]
+            pos += 4
+            if pos + length > len(data):
+                raise ValueError('Truncated cache file.')
+            ret[name] = (flags, data[pos:pos + length])
+            pos += length
+        return ret
+
+    def _encode_section(self, rows):
+        payload = _SectionEncoder().encode(rows)
+        if self._compress:
+            return _FLAG_ZLIB, zlib.compress(payload)
+        return 0, payload
+
+    @staticmethod
+    def _decode_section(section):
+        flags, payload = section
+        if flags & _FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        return _SectionDecoder(payload).decode()
+
+    def open(self):
+        with self._lock:
+            self._sections = None
+
+    def prefixes(self):
+        with self._lock:
+            return list(self._read().keys())
+
+    def load_prefix(self, prefix):
+        with self._lock:
+            section = self._read().get(prefix)
+        if section is None:
+            return {}
+        return self._decode_section(section)
+
+    def save(self, changes, removed):
+        with self._lock:
+            if self._file_id != _file_id(self._fpath):
+                # modified by another process, merge the changes into the current content
+                self._sections = None
+            sections = self._read()
+            for prefix in removed:
+                sections.pop(prefix, None)
+            for prefix, (updated, deleted) in changes.items():
+                section = sections.get(prefix)
+                rows = self._decode_section(section) if section is not None else {}
+                for key in deleted:
+                    rows.pop(key, None)
+                rows.update(updated)
+                sections[prefix] = self._encode_section(rows)
+            out = [_BINARY_MAGIC, _U32.pack(len(sections))]
+            for name, (flags, payload) in sections.items():
+                name = name.encode('UTF-8')
+                out.extend([_U32.pack(len(name)), name, bytes([flags]), _U32.pack(len(payload)), payload])
+            _replace_file(self._fpath, b''.join(out))
+            self._file_id = _file_id(self._fpath)
+            if self._migrate_from is not None and os.path.exists(self._migrate_from):
+                os.remove(self._migrate_from)
+
+    @property
+    def files(self):
+        return [self._fpath]
+
+    def close(self):
+        with self._lock:
+            self._sections = None
+
+
+class ShardedStorage(CacheStorage):
+    """
+    Stores each prefix of the cache in a separate json file within a directory.
+    Since the signatures and symbolic nodes are stored in separate prefixes for each
+    namespace and subproject (see :func:`cache_shard`), running a command in a single
+    subproject only reads and writes the files of the prefixes it accesses.
+
+    :param directory: Path of the directory containing the files.
+    :param migrate_from: Path of a json cache file (see :class:`JsonStorage`). If
+        the directory does not exist yet, the content of the json file is
+        imported and the json file is removed.
+    """
+
+    def __init__(self, directory, migrate_from=None):
+        self._directory = str(directory)
+        self._migrate_from = migrate_from
+
+    def _fpath(self, prefix):
+        return os.path.join(self._directory, quote(prefix, safe='') + '.json')
+
+    def _migrate(self):
+        if os.path.exists(self._directory) or self._migrate_from is None \
+                or not os.path.exists(self._migrate_from):
+            return
+        json_storage = JsonStorage(self._migrate_from)
+        changes = {}
+        for prefix in json_storage.prefixes():
+            changes[prefix] = (json_storage.load_prefix(prefix), set())
+        self.save(changes, set())
+        os.remove(self._migrate_from)
+
+    def open(self):
+        self._migrate()
+
+    def prefixes(self):
+        try:
+            fnames = os.listdir(self._directory)
+        except FileNotFoundError:
+            return []
+        return [unquote(f[:-len('.json')]) for f in fnames if f.endswith('.json')]
+
+    def load_prefix(self, prefix):
+        try:
+            with open(self._fpath(prefix), 'r') as f:
+                rows = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            log.error('Cache file for `{0}` is invalid. Ignoring.'.format(prefix))
+            return {}
+        if not isinstance(rows, dict):
+            return {}
+        return rows
+
+    def save(self, changes, removed):
+        for prefix in removed:
+            if os.path.exists(self._fpath(prefix)):
+                os.remove(self._fpath(prefix))
+        for prefix, (updated, deleted) in changes.items():
+            # re-read the file, s.t. changes of other processes are kept
+            rows = self.load_prefix(prefix)
+            for key in deleted:
+                rows.pop(key, None)
+            rows.update(updated)
+            _replace_file(self._fpath(prefix), json.dumps(rows).encode('UTF-8'))
+
+    @property
+    def files(self):
+        return [self._directory]
+
+
+STORAGE_BACKENDS = ['json', 'sqlite', 'binary', 'sharded']
+"""
+Names of the available storage backends, see :func:`create_storage`.
+"""
+
+
+def create_storage(backend, directory):
+    """
+    Creates a :class:`CacheStorage` object.
+
+    :param backend: Name of the backend. One of :data:`STORAGE_BACKENDS`. Defaults to 'json'.
+    :param directory: Directory in which the cache files are stored (i.e. the build directory).
+    """
+    if backend is None or backend == 'json':
+        return JsonStorage(os.path.join(str(directory), CACHE_FILE))
+    elif backend == 'sqlite':
+        return SqliteStorage(os.path.join(str(directory), SQLITE_CACHE_FILE),
+                             migrate_from=os.path.join(str(directory), CACHE_FILE))
+    elif backend == 'binary':
+        return BinaryStorage(os.path.join(str(directory), BINARY_CACHE_FILE),
+                             migrate_from=os.path.join(str(directory), CACHE_FILE))
+    elif backend == 'sharded':
+        return ShardedStorage(os.path.join(str(directory), SHARDED_CACHE_DIR),
+                              migrate_from=os.path.join(str(directory), CACHE_FILE))
+    raise ValueError('Invalid cache backend `{0}`. Expected one of {1}.'.format(backend, STORAGE_BACKENDS))
+
+
+class Journal(object):
+    """
+    Append-only log of cache rows which are recorded while tasks are executed.
+    Since the cache is only saved once ``wasp`` exits, the journal ensures that
+    the results of tasks which have already completed are not lost if ``wasp``
+    is interrupted. The journal is replayed when the cache is loaded and truncated
+    once the cache has been saved.
+
+    Each record is stored as a json object on a separate line. To reduce the
+    overhead of syncing the file to disk, records are buffered and written in batches.
+    A buffered record is written at the latest ``interval`` seconds after it was recorded.
+
+    Multiple processes may share the same journal. Each record is tagged with the id
+    of the process which wrote it and truncating the journal discards the records
+    of the current process and of processes which are no longer running (these have
+    been replayed and saved by the process truncating the journal). Records are appended
+    while holding ``lock`` in shared mode.
+
+    :param fpath: Path of the journal file.
+    :param batch_size: Number of records after which the buffered records are written.
+    :param interval: Time in seconds after which the buffered records are written.
+    :param lock: Optional :class:`FileLock` of the cache.
+    """
+
+    def __init__(self, fpath, batch_size=64, interval=1.0, lock=None):
+        self._fpath = str(fpath)
+        self._batch_size = batch_size
+        self._interval = interval
+        self._buffer = []
+        self._last_sync = time.monotonic()
+        self._timer = None
+        self._lock = threading.Lock()
+        self._file_lock = lock
+        self._pid = os.getpid()
+
+    @property
+    def path(self):
+        """
+        Returns the path of the journal file.
+        """
+        return self._fpath
+
+    def record(self, prefix, key, value):
+        """
+        Records a row of the cache. The value is serialized immediately.
+        """
+        line = json.dumps([prefix, key, factory.to_json(value), self._pid]) + '\n'
+        with self._lock:
+            self._buffer.append(line)
+            sync = len(self._buffer) >= self._batch_size \
+                or time.monotonic() - self._last_sync >= self._interval
+            if not sync and self._timer is None:
+                self._timer = threading.Timer(self._interval, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+        if sync:
+            self.sync()
+
+    def _sync(self):
+        self._last_sync = time.monotonic()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if len(self._buffer) == 0:
+            return
+        dirname = os.path.dirname(self._fpath)
+        if dirname != '':
+            os.makedirs(dirname, exist_ok=True)
+        with open(self._fpath, 'a') as f:
+            f.write(''.join(self._buffer))
+            f.flush()
+            os.fsync(f.fileno())
+        self._buffer = []
+
+    def sync(self):
+        """
+        Writes all buffered records to disk.
+        """
+        # the file lock must always be acquired before self._lock, see Journal.truncate()
+        if self._file_lock is None:
+            with self._lock:
+                self._sync()
+            return
+        with self._file_lock.shared():
+            with self._lock:
+                self._sync()
+
+    def replay(self):
+        """
+        Returns a list of ``(prefix, key, value)`` tuples of all records in the
+        journal, where ``value`` is in jsonified form. Reading stops at the first
+        incomplete record (e.g. if ``wasp`` was killed while writing).
+        """
+        ret = []
+        try:
+            with open(self._fpath, 'r') as f:
+                for line in f:
+                    try:
+                        prefix, key, value = json.loads(line)[:3]
+                    except ValueError:
+                        break
+                    ret.append((prefix, key, value))
+        except FileNotFoundError:
+            pass
+        return ret
+
+    def truncate(self):
+        """
+        Discards all records of the current process and of processes which are no
+        longer running. Thus, this must only be called after the journal has been
+        replayed into the cache and the cache has been saved. If a :class:`FileLock`
+        is used, the caller must hold it in exclusive mode.
+        """
+        with self._lock:
+            self._buffer = []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            try:
+                with open(self._fpath, 'r') as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                return
+            keep = []
+            alive = {}
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if len(record) <= 3 or record[3] == self._pid:
+                    continue
+                pid = record[3]
+                if pid not in alive:
+                    alive[pid] = _pid_alive(pid)
+                if alive[pid]:
+                    keep.append(line)
+            if len(keep) == 0:
+                os.remove(self._fpath)
+            else:
+                _replace_file(self._fpath, ''.join(keep).encode('UTF-8'))
+
+
+_MISSING = object()
+
 
 class Cache(dict):
     """
@@ -14,27 +1008,110 @@ class Cache(dict):
     On the top-level, the cache abstracts groups, which can be accessed using
     :meth:`Cache.prefix`. The objects added must be of type :class:`wasp.util.Serializable` or
     a json-serializable primitive.
+
+    The content is persisted using a :class:`CacheStorage`. Prefixes are only
+    deserialized when they are first accessed and when the cache is saved,
+    only the rows which have changed since they were loaded are passed to
+    the storage. Thus, if multiple processes use the same cache, their changes are
+    merged row by row (the last writer wins only for rows changed by both).
+    Loading and saving is protected by an optional :class:`FileLock`.
     """
-    def __init__(self, cachefile):
+    def __init__(self, cachefile=None, storage=None, journal=None, lock=None):
         """
         Create a cache object.
         :param cachefile: Object of type File which represents the file
-            the cache is saved in or loaded from.
+            the cache is saved in or loaded from. Used to create
+            a :class:`JsonStorage` if no ``storage`` is given.
+        :param storage: The :class:`CacheStorage` object to use.
+        :param journal: Optional :class:`Journal` object, see :meth:`Cache.journal`.
+        :param lock: Optional :class:`FileLock` object, which is held while loading and saving.
         """
         super().__init__()
-        assert isinstance(cachefile, File)
-        self._cachefile = cachefile
+        if storage is None:
+            assert isinstance(cachefile, File)
+            storage = JsonStorage(cachefile.path)
+        self._storage = storage
+        self._journal = journal
+        self._lock = lock
+        self._unloaded = set()
+        self._snapshots = {}
+        self._removed = set()
+        self._load_lock = threading.RLock()
+
+    @property
+    def storage(self):
+        """
+        Returns the :class:`CacheStorage` object used to persist the cache.
+        """
+        return self._storage
+
+    @property
+    def files(self):
+        """
+        Returns a list of paths of all files the cache writes to.
+        """
+        ret = list(self._storage.files)
+        if self._journal is not None:
+            ret.append(self._journal.path)
+        if self._lock is not None:
+            ret.append(self._lock.path)
+        return ret
+
+    def journal(self, prefix, key, value):
+        """
+        Records a row in the journal (if the cache has one), s.t. it is restored
+        when the cache is loaded the next time, even if the cache is not saved
+        (e.g. because ``wasp`` was interrupted). Note that the row is not modified
+        in the cache itself.
+        """
+        if self._journal is not None:
+            self._journal.record(prefix, key, value)
+
+    def sync(self):
+        """
+        Writes all rows recorded with :meth:`Cache.journal` to disk.
+        """
+        if self._journal is not None:
+            self._journal.sync()
+
+    def _ensure_loaded(self, prefix):
+        if prefix not in self._unloaded:
+            return
+        with self._load_lock:
+            if prefix not in self._unloaded:
+                return
+            rows = self._storage.load_prefix(prefix)
+            d = {}
+            for k, v in rows.items():
+                d[k] = factory.from_json(v)
+            self._snapshots[prefix] = rows
+            super().__setitem__(prefix, d)
+            self._unloaded.discard(prefix)
+
+    def _ensure_all_loaded(self):
+        for prefix in list(self._unloaded):
+            self._ensure_loaded(prefix)
+
+    def prefixes(self):
+        """
+        Returns the names of all prefixes without deserializing them.
+        """
+        return list(super().keys()) + list(self._unloaded)
 
     def prefix(self, prefix):
         """
         Returns a dict which is added of the cache if it does not exist yet.
         Same as :meth:`Cache.__getitem__`.
         """
-        if prefix not in self:
-            cache = {}
-            self[prefix] = cache
-            return cache
-        return super().__getitem__(prefix)
+        self._ensure_loaded(prefix)
+        ret = super().get(prefix)
+        if ret is None:
+            with self._load_lock:
+                ret = super().get(prefix)
+                if ret is None:
+                    ret = {}
+                    super().__setitem__(prefix, ret)
+        return ret
 
     def __getitem__(self, prefix):
         """
@@ -49,41 +1126,133 @@ class Cache(dict):
         # return cc.executable('main.c').use(ctx.cache['my-subproject-name'])
         return self.prefix(prefix)
 
-    def save(self, debug=True):
+    def __setitem__(self, prefix, value):
+        assert isinstance(value, dict), 'Cache prefixes must be of type dict.'
+        with self._load_lock:
+            if prefix in self._unloaded:
+                # the stored rows are unknown, thus replace the whole prefix
+                self._unloaded.discard(prefix)
+                self._removed.add(prefix)
+            super().__setitem__(prefix, value)
+
+    def __delitem__(self, prefix):
+        with self._load_lock:
+            if prefix in self._unloaded:
+                self._unloaded.discard(prefix)
+            else:
+                super().__delitem__(prefix)
+            self._snapshots.pop(prefix, None)
+            self._removed.add(prefix)
+
+    def __contains__(self, prefix):
+        return super().__contains__(prefix) or prefix in self._unloaded
+
+    def __iter__(self):
+        self._ensure_all_loaded()
+        return super().__iter__()
+
+    def __len__(self):
+        return super().__len__() + len(self._unloaded)
+
+    def get(self, prefix, default=None):
+        if prefix not in self:
+            return default
+        return self.prefix(prefix)
+
+    def keys(self):
+        self._ensure_all_loaded()
+        return super().keys()
+
+    def values(self):
+        self._ensure_all_loaded()
+        return super().values()
+
+    def items(self):
+        self._ensure_all_loaded()
+        return super().items()
+
+    def update(self, *args, **kw):
+        for k, v in dict(*args, **kw).items():
+            self[k] = v
+
+    def pop(self, prefix, default=_MISSING):
+        if prefix not in self:
+            if default is _MISSING:
+                raise KeyError(prefix)
+            return default
+        ret = self.prefix(prefix)
+        del self[prefix]
+        return ret
+
+    def clear(self):
+        with self._load_lock:
+            self._removed.update(self._unloaded)
+            self._removed.update(super().keys())
+            self._removed.update(self._snapshots.keys())
+            self._unloaded.clear()
+            self._snapshots.clear()
+            super().clear()
+
+    def save(self):
         """
-        Save the content of the cache to the file given in the constructor.
-        :param debug: Format the file such that it is human readable.
+        Saves the changes of the cache to the storage.
         """
-        # that should not fail, since we ensured the existance
-        # of self._cachedir
-        jsonified = factory.to_json(self)
-        self._cachefile.directory().mkdir()
-        with open(self._cachefile.path, 'w') as f:
-            if debug:
-                json.dump(jsonified, f, indent=4, separators=(',', ': '))
-            else:
-                json.dump(jsonified, f)
+        with self._load_lock:
+            changes = {}
+            for prefix, d in list(super().items()):
+                rows = {k: factory.to_json(v) for k, v in list(d.items())}
+                snapshot = self._snapshots.get(prefix)
+                if prefix in self._removed:
+                    # replaced entirely
+                    changes[prefix] = (rows, set())
+                elif snapshot is None:
+                    # new prefix, another process may have created it in the meantime
+                    changes[prefix] = (rows, set())
+                else:
+                    updated = {k: v for k, v in rows.items() if snapshot.get(k, _MISSING) != v}
+                    deleted = set(snapshot.keys()) - set(rows.keys())
+                    if len(updated) > 0 or len(deleted) > 0:
+                        changes[prefix] = (updated, deleted)
+                self._snapshots[prefix] = rows
+            with self._locked(exclusive=True):
+                self._storage.save(changes, self._removed)
+                if self._journal is not None:
+                    # all journaled rows are now contained in the storage
+                    self._journal.truncate()
+            self._removed = set()
+
+    @contextmanager
+    def _locked(self, exclusive):
+        if self._lock is None:
+            yield
+        elif exclusive:
+            with self._lock.exclusive():
+                yield
+        else:
+            with self._lock.shared():
+                yield
 
     def load(self):
         """
-        Loads the cache from the file given in the constructor.
+        Loads the cache from the storage. The prefixes are only deserialized
+        once they are accessed.
         """
-        self.clear()
-        try:
-            with open(self._cachefile.path, 'r') as f:
-                jsonified = None
-                try:
-                    jsonified = json.load(f)
-                except ValueError:
-                    pass
-            if not isinstance(jsonified, dict):
-                # invalid cache file, ignore
-                # XXX: cannot use ctx.log
-                log.error('Cachefile is invalid. Ignoring.')
-            else:
-                self.update(factory.from_json(jsonified))
-        except FileNotFoundError:
-            # nvm, cachefile was probably never written
-            # since wasp was never excuted or had anything
-            # to write in the first place
-            pass
+        with self._load_lock:
+            super().clear()
+            self._snapshots.clear()
+            self._removed = set()
+            with self._locked(exclusive=False):
+                self._storage.open()
+                self._unloaded = set(self._storage.prefixes())
+            if self._journal is not None:
+                self._replay()
+
+    def _replay(self):
+        records = self._journal.replay()
+        if len(records) == 0:
+            return
+        # the previous run was interrupted, apply the recorded rows
+        # and compact them into the storage
+        for prefix, key, value in records:
+            self.prefix(prefix)[key] = factory.from_json(value)
+        self.save()
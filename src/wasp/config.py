@@ -10,6 +10,11 @@ CONFIG_FILE_NAMES = ['wasprc.json', 'wasprc.user.json']
 Default file names for config files.
 """
 
+DEFAULT_ACTION_CACHE_DIR = '~/.cache/wasp'
+"""
+Default directory of the action cache, if it is enabled without specifying a directory.
+"""
+
 
 # TODO: document config keys and how they can be set
 
@@ -108,6 +113,33 @@ def _assert_string(instance, v):
     return v
 
 
+def _parse_cache_backend(instance, v):
+    from .cache import STORAGE_BACKENDS
+    parse_assert(v in STORAGE_BACKENDS, 'Invalid cache backend `{0}`, expected one of `{1}`'.format(v, STORAGE_BACKENDS))
+    return v
+
+
+def _parse_action_cache(instance, v):
+    from .actioncache import parse_size, DEFAULT_MAX_SIZE, LINK_MODES
+    if isinstance(v, str):
+        v = {'directory': v}
+    parse_assert(isinstance(v, dict), 'Expected a directory or a dict for `action_cache`, '
+                                      'was `{0}`'.format(type(v).__name__))
+    directory = v.get('directory', DEFAULT_ACTION_CACHE_DIR)
+    parse_assert(isinstance(directory, str), 'Expected a str as `directory` of `action_cache`.')
+    try:
+        max_size = parse_size(v.get('max_size', DEFAULT_MAX_SIZE))
+    except ValueError as e:
+        parse_assert(False, str(e))
+    link = v.get('link', 'auto')
+    parse_assert(link in LINK_MODES, 'Invalid link mode `{0}`, expected one of `{1}`'.format(link, LINK_MODES))
+    remote = v.get('remote')
+    parse_assert(remote is None or isinstance(remote, str), 'Expected a url as `remote` of `action_cache`.')
+    upload = v.get('upload', True)
+    parse_assert(isinstance(upload, bool), 'Expected a bool as `upload` of `action_cache`.')
+    return {'directory': directory, 'max_size': max_size, 'link': link, 'remote': remote, 'upload': upload}
+
+
 class Config(object):
     """
     Collects config information and parses it from json-like datastructures.
@@ -121,6 +153,9 @@ class Config(object):
     arguments = ConfigKey('arguments', parser=_argument_parser, merger=_argument_merger)
     default_command = ConfigKey('default_command', parser=_assert_string)
     pretty = ConfigKey('pretty', parser=_assert_bool)
+    grouped = ConfigKey('grouped', parser=_assert_bool)
+    cache_backend = ConfigKey('cache_backend', parser=_parse_cache_backend)
+    action_cache = ConfigKey('action_cache', parser=_parse_action_cache)
 
     def __init__(self, json_data=None):
         self._values = {}
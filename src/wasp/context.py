@@ -1,9 +1,11 @@
+import os
+
 from .option import OptionsCollection
-from .cache import Cache, CACHE_FILE
+from .cache import Cache, Journal, FileLock, create_storage, JOURNAL_FILE, LOCK_FILE
 from .signature import SignatureProvider, ProducedSignatures
 from .argument import ArgumentCollection
 from .environment import Environment
-from .fs import Directory, File
+from .fs import Directory
 from .config import Config
 from .metadata import Metadata
 from .tools import ToolsCollection
@@ -35,6 +37,7 @@ class Context(object):
         self._signatures = SignatureProvider()
         # create the cache
         self._cache = None
+        self._action_cache = None
         self._g = Namespace()
         self._current_ns = None
         self._unnamed_node_idx = 0
@@ -127,7 +130,9 @@ class Context(object):
         assert isinstance(builddir, Directory)
         builddir.mkdir()
         self._builddir = builddir
-        self._cache = Cache(File(self._builddir.join(CACHE_FILE)))
+        lock = FileLock(self._builddir.join(LOCK_FILE).path)
+        self._cache = Cache(storage=create_storage(self._config.cache_backend, self._builddir.path),
+                            journal=Journal(self._builddir.join(JOURNAL_FILE).path, lock=lock), lock=lock)
 
     builddir = property(get_builddir, set_builddir)
     """
@@ -172,16 +177,58 @@ class Context(object):
         self.signatures.save(self._cache)
         self._cache.prefix('g')['last_run'] = self._g
         self.cache.save()
+        if self._action_cache is not None:
+            self._action_cache.flush()
 
     def load(self):
         """
         Loads the context from the cache.
         """
         self._cache.load()
-        self._cache.prefix('ctx')['topdir'] = self.topdir.path
+        ctx_cache = self._cache.prefix('ctx')
+        ctx_cache['topdir'] = self.topdir.path
+        # allows locating the topdir from the build directory, even
+        # if both have been moved to a different location
+        ctx_cache['builddir'] = os.path.relpath(os.path.abspath(self._builddir.path), self.topdir.path)
         self._g = self._cache.prefix('g').get('last_run', Namespace())
         self.produced_signatures.load(self._cache)
 
+    def reset(self):
+        """
+        Resets the state which belongs to a single invocation of ``wasp`` (the options,
+        the current signatures and the generated node names), s.t. the context can be
+        reused for running further commands (see :mod:`wasp.server`). The loaded cache
+        and the produced signatures are kept.
+        """
+        self._options = OptionsCollection()
+        self._signatures = SignatureProvider()
+        self._current_ns = None
+        self._unnamed_node_idx = 0
+
+    def get_action_cache(self):
+        config = self._config.action_cache
+        if self._action_cache is None and config is not None:
+            # imported on demand, since the remote cache client is expensive to import
+            from .actioncache import ActionCache, RemoteCache
+            directory = os.path.join(self._topdir.path, os.path.expanduser(config['directory']))
+            remote = None
+            if config['remote'] is not None:
+                remote = RemoteCache(config['remote'], upload=config['upload'])
+            self._action_cache = ActionCache(directory, max_size=config['max_size'],
+                                             link=config['link'], remote=remote)
+        return self._action_cache
+
+    def set_action_cache(self, action_cache):
+        from .actioncache import ActionCache
+        assert action_cache is None or isinstance(action_cache, ActionCache)
+        self._action_cache = action_cache
+
+    action_cache = property(get_action_cache, set_action_cache)
+    """
+    Returns the :class:`wasp.actioncache.ActionCache` used for storing the outputs of tasks
+    or None if no action cache is configured (using the ``action_cache`` config key).
+    """
+
     @property
     def cache(self):
         """
@@ -7,9 +7,14 @@ class Environment(dict):
     It can be initialized from ``os.environ`` using :meth:`load_from_env`.
     The result can be obtained as an :class:`ArgumentCollection`
     using :meth:`argument_collection`.
+
+    The names of the variables which are read are recorded (see :attr:`Environment.read`),
+    s.t. an invocation of ``wasp`` can be repeated if none of them has changed (see :mod:`wasp.noop`).
     """
     def __init__(self):
         super().__init__()
+        self._read = set()
+        self._read_all = False
         self.load_from_env()
 
     def load_from_env(self):
@@ -18,6 +23,46 @@ class Environment(dict):
         """
         self.clear()
         self.update(dict(os.environ))
+        self._read = set()
+        self._read_all = False
+
+    @property
+    def read(self):
+        """
+        Returns the set of names of all variables which have been read or None
+        if the whole environment has been read (e.g. by iterating over it).
+        """
+        if self._read_all:
+            return None
+        return self._read
+
+    def get(self, key, default=None):
+        self._read.add(key)
+        return super().get(key, default)
+
+    def __getitem__(self, key):
+        self._read.add(key)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self._read.add(key)
+        return super().__contains__(key)
+
+    def __iter__(self):
+        self._read_all = True
+        return super().__iter__()
+
+    def keys(self):
+        self._read_all = True
+        return super().keys()
+
+    def values(self):
+        self._read_all = True
+        return super().values()
+
+    def items(self):
+        self._read_all = True
+        return super().items()
 
     def argument_collection(self):
         """
@@ -1,19 +1,53 @@
-import multiprocessing.dummy
+import os
+import threading
 import traceback
-from multiprocessing import cpu_count
 
 from . import log, ctx, extensions
+from .noop import manifest as noop_manifest
 from .node import SpawningNode, Node, node
 from .task import Task, TaskGroup, MissingArgumentError, TaskCollection, TaskFailedError
 from .util import EventLoop, Event, is_iterable, ThreadPool
+from .shell import interrupt_processes
 
 
 REFRESH_THREADS = 10
-thread_pool = multiprocessing.dummy.Pool(REFRESH_THREADS)
+"""
+Number of threads used for refreshing the signatures of nodes, see :func:`refresh_pool`.
+"""
+
+_refresh_pool = None
+_refresh_pool_lock = threading.Lock()
+
+
+def refresh_pool():
+    """
+    Returns the pool of :data:`REFRESH_THREADS` threads which is used for refreshing
+    signatures. The pool is created on first use, s.t. commands which do not execute
+    any tasks (e.g. ``wasp --help``) do not spawn any threads.
+    """
+    global _refresh_pool
+    if _refresh_pool is None:
+        with _refresh_pool_lock:
+            if _refresh_pool is None:
+                import multiprocessing.dummy
+                _refresh_pool = multiprocessing.dummy.Pool(REFRESH_THREADS)
+    return _refresh_pool
+
+
+def __getattr__(name):
+    # the pool used to be created on import and exported as ``thread_pool``
+    if name == 'thread_pool':
+        return refresh_pool()
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+
+TASK_FINGERPRINTS_PREFIX = 'task-fingerprints'
+"""
+Cache prefix in which the fingerprints of the tasks are stored, see :func:`wasp.task.Task.fingerprint`.
+"""
 
 
 # TODO: task timeouts -> kill hanging tasks
-# TODO: limit selection to only a certain set of nodes
 
 
 class DependencyCycleError(Exception):
@@ -33,37 +67,76 @@ class TargetProducedByMultipleTasksError(Exception):
 
 
 class TaskGraph(object):
+    """
+    Dependency graph of the tasks to be executed.
 
-    def __init__(self, tasks, ns=None):
+    :param tasks: List of tasks.
+    :param ns: The namespace in which the tasks are executed.
+    :param produce: A list of nodes or None. If given, only the tasks which are
+        required for producing these nodes are executed (see :func:`limit`).
+    """
+
+    def __init__(self, tasks, ns=None, produce=None):
         self._target_map = {}
         self._source_map = {}
         self._tasks = []
         self._nodes = {}
         self._leafs = set()
         self._ns = ns
+        if produce is not None:
+            tasks = limit(tasks, produce)
         self.add_tasks(tasks)
         self._running_tasks = []
         self._produced_signatures = set()
         self._new_nodes = {}
+        self._fingerprints = {}
+        self._invalidated = set()
 
     @property
     def produced_signatures(self):
         return self._produced_signatures
 
-    def limit(self, target_nodes):
-        pass
-
     def _scan_changes(self, task):
         nodes = list(task.sources)
         nodes.extend(task.targets)
-        changes = thread_pool.map(lambda n: n.has_changed(self._ns), nodes)
+        changes = refresh_pool().map(lambda n: n.has_changed(self._ns), nodes)
         return any(changes)
 
+    def _fingerprint_key(self, task):
+        # targets can only be produced by a single task, thus they identify the task
+        keys = sorted(n.key for n in task.targets)
+        if len(keys) == 0:
+            keys = [type(task).__qualname__] + sorted(n.key for n in task.sources)
+        return '{0}|{1}'.format(self._ns or 'default', '|'.join(keys))
+
+    def _fingerprint_changed(self, task):
+        """
+        Computes the fingerprint of ``task`` and returns True if it differs
+        from the fingerprint which was recorded the last time the task has run.
+        """
+        if ctx.cache is None:
+            return False
+        fingerprint = self._fingerprints.get(task)
+        if fingerprint is None:
+            fingerprint = task.fingerprint()
+            self._fingerprints[task] = fingerprint
+        key = self._fingerprint_key(task)
+        return ctx.cache.prefix(TASK_FINGERPRINTS_PREFIX).get(key) != fingerprint
+
+    def _record_fingerprint(self, task):
+        fingerprint = self._fingerprints.pop(task, None)
+        if fingerprint is None or ctx.cache is None:
+            return
+        key = self._fingerprint_key(task)
+        ctx.cache.prefix(TASK_FINGERPRINTS_PREFIX)[key] = fingerprint
+        ctx.cache.journal(TASK_FINGERPRINTS_PREFIX, key, fingerprint)
+
     def _insert_task(self, t):
         assert isinstance(t, Task)
         if t.disabled:
             return
         self._tasks.append(t)
+        noop_manifest.track(t)
         for target in t.targets:
             if target.key in self._target_map:
                 raise TargetProducedByMultipleTasksError(target)
@@ -117,7 +190,9 @@ class TaskGraph(object):
                 ret = task
                 break
             # task is runnable
-            if self._scan_changes(task):
+            # NOTE: always scan the nodes, since this refreshes their signatures
+            changed = self._scan_changes(task)
+            if self._fingerprint_changed(task) or changed:
                 ret = task
                 break
             # task does not need to be re-run
@@ -141,10 +216,62 @@ class TaskGraph(object):
             raise DependencyCycleError()
         return ret
 
+    def _journal_invalid(self, task):
+        """
+        Records the targets of ``task``, which has not run yet, as invalid in the
+        journal of the cache. Thus, ``task`` is executed in the next run.
+        """
+        self._invalidated.add(task)
+        for tgt in task.targets:
+            sig = tgt.signature(ns=self._ns).clone()
+            sig.invalidate()
+            ctx.signatures.journal(ctx.cache, sig, ns=self._ns)
+
+    def _journal_node(self, n, consumers):
+        """
+        Records the signature of the node ``n`` in the journal of the cache, s.t. the
+        node is regarded as unchanged in the next run. The tasks in ``consumers``
+        have not yet run, thus their targets are recorded as invalid.
+        """
+        if any(len(consumer.targets) == 0 for consumer in consumers):
+            # this consumer can only be forced to run if
+            # the node looks changed
+            sig = n.signature(ns=self._ns).clone()
+            sig.invalidate()
+            ctx.signatures.journal(ctx.cache, sig, ns=self._ns)
+            return
+        for consumer in consumers:
+            if consumer not in self._invalidated:
+                self._journal_invalid(consumer)
+        ctx.signatures.journal(ctx.cache, n.signature(ns=self._ns), ns=self._ns)
+
+    def _journal(self, task):
+        """
+        Records the signatures of the nodes of a task which has run in the
+        journal of the cache. Thus, if ``wasp`` is interrupted, the task is not
+        executed again in the next run. The tasks consuming the same nodes,
+        which have not run yet, are still executed in the next run.
+        """
+        if ctx.cache is None:
+            return
+        for src in task.sources:
+            consumers = [t for t in self._source_map.get(src.key, []) if t is not task]
+            self._journal_node(src, consumers)
+        for tgt in task.targets:
+            self._journal_node(tgt, self._source_map.get(tgt.key, []))
+
     def task_completed(self, task, has_run):
         # TODO: inefficient
         if task in self._running_tasks:
             self._running_tasks.remove(task)
+        if has_run:
+            self._record_fingerprint(task)
+            self._journal(task)
+        elif task in self._invalidated and ctx.cache is not None:
+            # the task is up to date, restore the signatures of its targets
+            for tgt in task.targets:
+                ctx.signatures.journal(ctx.cache, tgt.signature(ns=self._ns), ns=self._ns)
+        self._invalidated.discard(task)
         spawned = task.spawn()
         if spawned is not None:
             if not is_iterable(spawned):
@@ -161,9 +288,9 @@ class TaskGraph(object):
                 del self._nodes[s.key]
                 # thus also no leaf
                 self._leafs.remove(s.key)
-        # promote all targets to leafs
-        touched = task.touched()
-        new_leafs = set(tgt.key for tgt in touched)
+        # promote all targets to leafs, regardless of whether they
+        # were touched or not
+        new_leafs = set(tgt.key for tgt in task.targets)
         self._leafs = self._leafs | new_leafs
         # remove these nodes from the target_map
         for tgt in task.targets:
@@ -179,11 +306,8 @@ class TaskGraph(object):
             new_nodes = [n for n in new_nodes if n.key not in self._nodes]
             for n in new_nodes:
                 self._new_nodes[n.key] = n
-        if not has_run:
-            return
-        # referesh all node that were touched by the task
-        for leaf in touched:
-            leaf.signature(ns=self._ns).refresh()
+        # NOTE: the signatures of the touched targets were already
+        # refreshed by run_task() and thus they are not hashed again.
 
     def post_run(self):
         # rescan all new nodes but only the ones which we didn't already produce
@@ -320,13 +444,13 @@ class ParallelExecutor(Executor):
     def __init__(self, ns=None, jobs=None):
         super().__init__(ns=ns)
         if jobs is None:
-            jobs = cpu_count() * 2
+            jobs = (os.cpu_count() or 1) * 2
         self._loop = EventLoop()
         self._success_event = Event(self._loop).connect(self.task_success)
         self._failed_event = Event(self._loop).connect(self.task_failed)
         self._startup_event = Event(self._loop).connect(self._start)
         self._thread_pool = ThreadPool(self._loop, jobs)
-        self._loop.on_interrupt(self._thread_pool.cancel)
+        self._loop.on_interrupt(self._interrupted)
         self._thread_pool.on_finished(self._loop.cancel)
         self._loop.on_startup(self._start)
         self._cancel = False
@@ -335,6 +459,11 @@ class ParallelExecutor(Executor):
         self._thread_pool.cancel()
         self._cancel = True
 
+    def _interrupted(self):
+        self._thread_pool.cancel()
+        # shell commands run in their own session and do not receive the interrupt
+        interrupt_processes()
+
     def _run(self):
         self._thread_pool.start()
         if not self._loop.run():
@@ -388,7 +517,7 @@ def execute(tasks, executor, produce=None, ns=None):
     tasks = _flatten(tasks.values(), ns=ns)
     if len(tasks) == 0:
         return TaskCollection()
-    dag = TaskGraph(tasks, ns=ns)  # TODO: , produce=produce)
+    dag = TaskGraph(tasks, ns=ns, produce=produce)
     if executor is None:
         executor = SingleThreadedExecutor(ns=ns)
     assert isinstance(executor, Executor)
@@ -405,6 +534,7 @@ def run_task(task, ns):
 
     :param task: A :class:`ExeTask` to be executed.
     """
+    noop_manifest.invalidate()
     ret = extensions.api.run_task(task)
     if ret != NotImplemented:
         return ret
@@ -413,15 +543,28 @@ def run_task(task, ns):
         target.before_run(target=True)
     for source in task.sources:
         source.before_run(target=False)
+    action_cache = ctx.action_cache
+    action_key = None
+    restored = False
     try:
         task.prepare()
-        task.run()
-        if task.success:
+        if action_cache is not None and action_cache.cacheable(task):
+            action_key = action_cache.action_key(task, ns=ns)
+            restored = action_cache.restore(action_key, task)
+        if restored:
+            log.debug('Restored outputs of task `{0}` from the action cache.'.format(type(task).__name__))
             task.on_success()
+            task.postprocess()
         else:
-            task.on_fail()
-            log.debug(log.format_fail('Task `{}` failed'.format(type(task).__name__)))
-        task.postprocess()
+            if action_key is not None:
+                action_cache.unlink_targets(task)
+            task.run()
+            if task.success:
+                task.on_success()
+            else:
+                task.on_fail()
+                log.debug(log.format_fail('Task `{}` failed'.format(type(task).__name__)))
+            task.postprocess()
     except TaskFailedError as e:
         task.success = False
         log.fatal(str(e))
@@ -431,8 +574,12 @@ def run_task(task, ns):
         log.fatal(msg)
         task.success = False
     if task.success:
-        for node in task.targets:
-            node.signature(ns=ns).refresh()
+        if action_key is not None and not restored:
+            action_cache.store(action_key, task)
+        # only refresh the targets which were actually modified
+        # and use signature values provided by the task if available
+        for node in task.touched():
+            node.signature(ns=ns).refresh(task.touched_value(node))
     for target in task.targets:
         target.after_run(target=True)
     for source in task.sources:
@@ -476,3 +623,32 @@ def _flatten(tasks, ns=None):
             ret.append(task)
     return ret
 
+
+def limit(tasks, produce):
+    """
+    Limits a list of tasks to the tasks which are required for producing the given nodes,
+    i.e. the tasks producing the nodes and recursively the tasks producing their sources.
+
+    :param tasks: A flat list of tasks.
+    :param produce: A list of nodes.
+    :return: The list of required tasks in the original order.
+    """
+    target_map = {}
+    for task in tasks:
+        for target in task.targets:
+            target_map.setdefault(target.key, task)
+    required = set()
+    keys = []
+    for n in produce:
+        if n.key not in target_map:
+            log.warn(log.format_warn('No task produces `{0}`.'.format(n.key)))
+            continue
+        keys.append(n.key)
+    while keys:
+        task = target_map.get(keys.pop())
+        if task is None or task in required:
+            continue
+        required.add(task)
+        keys.extend(n.key for n in task.sources)
+    return [task for task in tasks if task in required]
+
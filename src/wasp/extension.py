@@ -2,7 +2,6 @@ from . import log
 from .util import load_module_by_name, is_iterable
 from . import FatalError
 
-from pkgutil import walk_packages
 from importlib import import_module
 
 
@@ -129,6 +128,7 @@ class ExtensionCollection(dict):
             self._meta[name] = meta
 
     def load_all(self, package_name):
+        from pkgutil import walk_packages
         module = import_module(package_name)
         for (module_finder, name, ispkg) in walk_packages(module.__path__, package_name + '.'):
             self.load(name)
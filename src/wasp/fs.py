@@ -16,11 +16,12 @@ import os
 import re
 import shutil
 
-from .node import FileNode, nodes
+from .node import FileNode, SymbolicNode, nodes
+from .signature import GlobSignature
 from .task import Task
-from .util import Serializable, is_iterable
+from .util import Serializable, is_iterable, checksum
 from . import factory
-from .argument import find_argumentkeys_in_string
+from .argument import find_argumentkeys_in_string, ArgumentCollection, Argument
 
 
 def sanitize_path(fpath):
@@ -48,6 +49,63 @@ def top_dir():
     return os.getcwd()
 
 
+TOPDIR_ROOT = '@topdir'
+"""
+Symbolic root which replaces :func:`top_dir` in paths stored in the cache.
+"""
+
+BUILDDIR_ROOT = '@builddir'
+"""
+Symbolic root which replaces the build directory in paths stored in the cache.
+"""
+
+
+def _symbolic_roots():
+    from . import ctx
+    ret = []
+    # the build directory goes first, since it may be a subdirectory of top_dir()
+    if ctx.builddir is not None:
+        ret.append((BUILDDIR_ROOT, os.path.abspath(ctx.builddir.path)))
+    ret.append((TOPDIR_ROOT, top_dir()))
+    return ret
+
+
+def relocatable_path(fpath):
+    """
+    Converts an absolute path below the build directory or :func:`top_dir` into a path
+    relative to a symbolic root (i.e. '@builddir/' or '@topdir/'). This allows
+    storing paths in the cache such that it remains valid if the project (or the build
+    directory) is moved to a different location. Relative paths are returned unchanged.
+
+    :param fpath: Path to convert.
+    :return: The converted path. Use :func:`expand_path` to retrieve the original path.
+    """
+    if fpath is None or not os.path.isabs(fpath):
+        return fpath
+    for root, rootpath in _symbolic_roots():
+        if fpath == rootpath:
+            return root
+        if fpath.startswith(rootpath.rstrip(os.sep) + os.sep):
+            relpath = os.path.relpath(fpath, rootpath)
+            return root + '/' + '/'.join(relpath.split(os.sep))
+    return fpath
+
+
+def expand_path(fpath):
+    """
+    Inverse of :func:`relocatable_path`. Replaces the symbolic root of a path with
+    the absolute path of the current build directory or :func:`top_dir`.
+    """
+    if fpath is None:
+        return fpath
+    for root, rootpath in _symbolic_roots():
+        if fpath == root:
+            return rootpath
+        if fpath.startswith(root + '/'):
+            return os.path.join(rootpath, *fpath[len(root) + 1:].split('/'))
+    return fpath
+
+
 class DirectoryNotEmptyError(Exception):
     """
     Raised if a directory is expected to be empty but it is not.
@@ -180,11 +238,12 @@ class Path(Serializable):
 
     @classmethod
     def from_json(cls, d):
-        return cls(d['path'], make_absolute=d['absolute'], relto=d['relto'])
+        return cls(expand_path(d['path']), make_absolute=d['absolute'], relto=expand_path(d['relto']))
 
     def to_json(self):
         d = super().to_json()
-        d.update({'path': self.path, 'absolute': self._absolute, 'relto': self._relto})
+        d.update({'path': relocatable_path(self.path), 'absolute': self._absolute,
+                  'relto': relocatable_path(self._relto)})
         return d
 
     @property
@@ -715,6 +774,125 @@ def directories(*args, ignore=False):
     return ret
 
 
+def scan_tree(path, recursive=True):
+    """
+    Lists the contents of a directory tree. The listings are stored in the cache
+    together with the modification time of the directory, such that only directories
+    which have changed since the last scan must be listed again. Symbolic links to
+    directories are listed but not descended into.
+
+    :param path: Path of the directory to scan.
+    :param recursive: If True, all subdirectories are scanned as well.
+    :return: List of ``(reldir, entry)`` tuples where ``reldir`` is the path of
+        a directory relative to ``path`` and ``entry`` is a dict with the keys
+        ``mtime``, ``files``, ``dirs`` and ``subdirs`` (the directories to descend into).
+        An empty list is returned if ``path`` does not exist.
+    """
+    from . import ctx
+    listings = ctx.cache.prefix('directory-listings')
+    path = str(path)
+    ret = []
+    todo = ['']
+    while len(todo) > 0:
+        reldir = todo.pop()
+        abspath = os.path.join(path, reldir) if reldir else path
+        try:
+            mtime = os.stat(abspath).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        # relocatable, s.t. the listings remain valid if the project is moved
+        key = relocatable_path(os.path.abspath(abspath))
+        entry = listings.get(key)
+        if entry is None or entry['mtime'] != mtime:
+            files_, dirs_, subdirs = [], [], []
+            with os.scandir(abspath) as it:
+                for dir_entry in it:
+                    if dir_entry.is_dir():
+                        dirs_.append(dir_entry.name)
+                        if not dir_entry.is_symlink():
+                            subdirs.append(dir_entry.name)
+                    else:
+                        files_.append(dir_entry.name)
+            entry = {'mtime': mtime, 'files': sorted(files_), 'dirs': sorted(dirs_), 'subdirs': sorted(subdirs)}
+            listings[key] = entry
+        ret.append((reldir, entry))
+        if recursive:
+            todo.extend(os.path.join(reldir, d) for d in reversed(entry['subdirs']))
+    return ret
+
+
+class GlobNode(SymbolicNode):
+    """
+    A :class:`wasp.node.SymbolicNode` which contains the result of a
+    :meth:`Directory.glob` call. The files are matched at the time the node
+    is read and not when the build script is evaluated. Its signature is computed
+    from the modification times of the scanned directories, thus it only
+    changes if files are added to or removed from the directory tree.
+
+    If used by a task, the sorted list of matching paths is passed as
+    argument with the key ``matches``.
+
+    Parameters are equivalent to :meth:`Directory.glob`.
+    """
+    def __init__(self, directory, pattern, exclude=None, dirs=False, recursive=True):
+        self._path = str(Path(directory))
+        self._pattern = pattern
+        self._exclude = exclude
+        self._dirs = dirs
+        self._recursive = recursive
+        options = '{0}|{1}|{2}|{3}'.format(pattern, exclude, dirs, recursive)
+        path = relocatable_path(os.path.abspath(self._path))
+        key = ':glob/{0}/{1}'.format(path, checksum(options.encode('UTF-8')))
+        super().__init__(key=key)
+
+    def _make_signature(self):
+        return GlobSignature(self.key, path=self._path, recursive=self._recursive)
+
+    @property
+    def matches(self):
+        """
+        Returns a sorted list of all paths matching the glob.
+        """
+        include_re = re.compile(self._pattern)
+        exclude_re = re.compile(self._exclude) if self._exclude is not None else None
+        ret = []
+        for reldir, entry in scan_tree(self._path, recursive=self._recursive):
+            candidates = entry['files']
+            if self._dirs:
+                candidates = chain(entry['dirs'], candidates)
+            for f in candidates:
+                match_path = os.path.join(reldir, f)
+                if not include_re.match(match_path):
+                    continue
+                if exclude_re is not None and exclude_re.match(match_path):
+                    continue
+                ret.append(os.path.join(self._path, match_path))
+        return sorted(ret)
+
+    def read(self):
+        """
+        Returns an ArgumentCollection containing the sorted list of matching paths
+        with key ``matches``.
+        """
+        ret = ArgumentCollection()
+        ret.add(Argument('matches', value=self.matches))
+        return ret
+
+    def write(self, *args, **kw):
+        raise TypeError('GlobNodes cannot be written to.')
+
+    def update(self, *args, **kw):
+        raise TypeError('GlobNodes cannot be written to.')
+
+
+def glob(directory, pattern, exclude=None, dirs=False, recursive=True):
+    """
+    Creates a :class:`GlobNode` which matches files lazily. See :meth:`Directory.glob`
+    for a description of the parameters.
+    """
+    return GlobNode(directory, pattern, exclude=exclude, dirs=dirs, recursive=recursive)
+
+
 class FindTask(Task):
     """
     Task to find files in the file system. It looks for different
@@ -875,6 +1053,34 @@ def remove(*args, recursive=False):
     return RemoveTask(args, recursive=recursive)
 
 
+def write_if_changed(fpath, data):
+    """
+    Writes ``data`` to the file at ``fpath`` unless the file already exists
+    and contains exactly ``data``. Thus, the modification time of the file
+    is kept if the content would not change.
+
+    :param fpath: Path of the file to be written.
+    :param data: ``bytes`` or ``str`` (which is encoded as UTF-8).
+    :return: A tuple ``(changed, value)`` where ``changed`` is True if the file
+        was written and ``value`` is the signature value of the new file content
+        (see :class:`wasp.signature.FileSignature`).
+    """
+    if isinstance(data, str):
+        data = data.encode('UTF-8')
+    fpath = str(fpath)
+    value = checksum(data)
+    try:
+        if os.path.getsize(fpath) == len(data):
+            with open(fpath, 'rb') as f:
+                if f.read() == data:
+                    return False, value
+    except OSError:
+        pass
+    with open(fpath, 'wb') as f:
+        f.write(data)
+    return True, value
+
+
 BINARY_PERMISSIONS = 0o755
 DEFAULT_PERMSSIONS = 0o644
 
@@ -904,6 +1110,7 @@ class CopyTask(Task):
             else:
                 target = file(destination)
             tgts.append(target)
+        self._copies = list(zip(self._files, tgts))
         self._mkdir = mkdir
         super().__init__(sources=nodes(self._files), targets=nodes(tgts), always=True)
 
@@ -912,8 +1119,23 @@ class CopyTask(Task):
         destpath = self._destination.path
         if self._mkdir and isinstance(self._destination, Directory):
             directory(self._destination).mkdir()
-        for f in paths(self._files, ignore=True):
+        for f, target in self._copies:
+            if f.isdir:
+                f.copy_to(destpath)
+                continue
+            # compare the signatures of the source and the target
+            # and skip the copy if the target is already up-to-date
+            src_sig = FileNode(f.path).signature()
+            if not src_sig.valid:
+                src_sig.refresh()
+            tgt_sig = FileNode(target.path).signature()
+            if not tgt_sig.valid:
+                tgt_sig.refresh()
+            if src_sig.value is not None and src_sig.value == tgt_sig.value:
+                self.untouch(target)
+                continue
             f.copy_to(destpath)
+            self.touch(target, value=src_sig.value)
 
 
 def copy(source, destination, mkdir=True):
@@ -90,6 +90,8 @@ class Logger(object):
     :param verbosity: Defines the verbosity level (log level)
     :param io: An io obect where the data should be printed to.
     :param pretty: Defines whether the logger should use pretty printing.
+    :param grouped: Defines whether the output of processes is printed once they have finished
+        instead of printing each line as soon as it is received.
     """
     QUIET = 0
     FATAL = 1
@@ -100,11 +102,12 @@ class Logger(object):
 
     DEFAULT = 3
 
-    def __init__(self, prepend='', verbosity=DEFAULT, io=None, pretty=True):
+    def __init__(self, prepend='', verbosity=DEFAULT, io=None, pretty=True, grouped=False):
         self._verbosity = verbosity
         self._io = io
         self._prepend = prepend
         self._pretty = pretty
+        self._grouped = grouped
 
     @property
     def verbosity(self):
@@ -120,6 +123,13 @@ class Logger(object):
         """
         return self._pretty
 
+    @property
+    def grouped(self):
+        """
+        Returns True if the output of processes is printed once they have finished.
+        """
+        return self._grouped
+
     def color(self, s, fg=None, style=None):
         """
         Returns a LogStr initialized with given parameters.
@@ -235,17 +245,20 @@ class Logger(object):
                 with print_lock:
                     print(str_msg, file=sys.stderr)
 
-    def configure(self, verbosity=None, pretty=None):
+    def configure(self, verbosity=None, pretty=None, grouped=None):
         """
         Configures the :class:`Logger`.
 
         :param verbosity: Defines the verbosity level (log level).
         :param pretty: Defines whether pretty printing is activated or not.
+        :param grouped: Defines whether the output of processes is grouped or streamed.
         """
         if verbosity is not None:
             self._verbosity = verbosity
         if pretty is not None:
             self._pretty = pretty
+        if grouped is not None:
+            self._grouped = grouped
         return self
 
     def fatal(self, msg, stderr=True):
@@ -284,4 +297,5 @@ class Logger(object):
         same configuration.
         """
         # TODO: ensure that io is thread save
-        return Logger(prepend=str(self._prepend), verbosity=self._verbosity, io=self._io, pretty=self._pretty)
+        return Logger(prepend=str(self._prepend), verbosity=self._verbosity, io=self._io,
+                      pretty=self._pretty, grouped=self._grouped)
@@ -6,6 +6,8 @@ import traceback
 
 from . import _recurse_files, ctx, log, extensions, FatalError, CommandFailedError, decorators, Directory
 from . import osinfo
+from . import recursion
+from .noop import manifest as noop_manifest
 from .argument import value
 from .config import Config
 from .execution import execute, ParallelExecutor
@@ -14,6 +16,7 @@ from .option import StringOption
 from .signature import FileSignature
 from .task import Task, group, TaskCollection, TaskGroup
 from .tools import proxies as tool_proxies, NoSuchToolError
+from .fs import sanitize_path
 from .util import is_iterable
 from .util import load_module_by_path
 
@@ -152,6 +155,8 @@ def retrieve_command_tasks(name):
         elif tasks is not None:
             assert False, 'Unrecognized return value from {0}'.format(name)
         # else tasks is None, thats fine
+        if tasks is not None:
+            recursion.index.own(command, tasks)
         found = True
     ret = TaskCollection()
     produced = set()
@@ -167,6 +172,7 @@ def retrieve_command_tasks(name):
         ret.add(tasks.produce(command.produce))
     if not found:
         raise NoSuchCommandError('No command with name `{0}` found!'.format(name))
+    recursion.index.record(ret)
     return ret
 
 
@@ -201,6 +207,7 @@ def execute_tasks(name, tasks):
     :param name: Name of the command for which the tasks should be executed.
     :param tasks: :class:`TaskCollection` of all tasks to be executed.
     """
+    noop_manifest.executed(name, tasks)
     ret = extensions.api.run_task_collection(tasks)
     if ret != NotImplemented:
         return ret
@@ -215,6 +222,9 @@ def execute_tasks(name, tasks):
     produce = ctx.options.group(name)['target'].value
     if produce is not None:
         produce = nodes(produce)
+    if produce is not None or not recursion.index.complete:
+        # the outputs of the tasks which are not executed must not be regarded as stale
+        ctx.signatures.mark_partial(name)
     executor = extensions.api.create_executor(name)
     if executor == NotImplemented:
         executor = ParallelExecutor(ns=name)
@@ -277,24 +287,43 @@ def handle_commands(options):
     return success
 
 
-def load_recursive():
+def load_recursive(select=None):
     """
     Loads all directorires which were defined as recursive, using
     wasp.recurse().
 
+    :param select: A set of directories (see :func:`wasp.recursion.directory_key`)
+        to be loaded or None if all directories should be loaded. If a directory
+        is registered which is not known to the index, all directories are loaded.
     :return: Returns a list of loaded files, [] if no file was loaded.
     """
     loaded = True
     loaded_paths = set()
+    skipped = set()
+    parents = {recursion.directory_key(path): recursion.TOPDIR for path in _recurse_files}
     ret = []
     while loaded:
         loaded = False
         for path in _recurse_files:
             if path in loaded_paths:
                 continue
-            ret.extend(load_directory(path))
             loaded_paths.add(path)
             loaded = True
+            key = recursion.directory_key(path)
+            if select is not None and key not in select:
+                if recursion.index.known(key):
+                    skipped.add(path)
+                    continue
+                # nothing is known about the commands and targets of the directory
+                log.debug(log.format_info('Directory `{0}` is not indexed, loading all directories.'.format(key)))
+                select = None
+                loaded_paths -= skipped
+            registered = len(_recurse_files)
+            with recursion.index.loading(key, parents.get(key)):
+                ret.extend(load_directory(path))
+            for child in _recurse_files[registered:]:
+                parents.setdefault(recursion.directory_key(child), key)
+    recursion.index.loaded(complete=select is None)
     return ret
 
 
@@ -385,6 +414,13 @@ def retrieve_builddir():
     return builddir
 
 
+def retrieve_server_mode():
+    """
+    Retrieves whether wasp should run as server (``--server``), see :mod:`wasp.server`.
+    """
+    return '--server' in sys.argv
+
+
 def retrieve_pretty_printing():
     """
     Retrieves whether pretty printing should be activated.
@@ -395,6 +431,16 @@ def retrieve_pretty_printing():
     return True
 
 
+def retrieve_grouped_output(config=None):
+    """
+    Retrieves whether the output of shell commands should be printed once they
+    have finished (``--grouped`` or the ``grouped`` config key).
+    """
+    if '--grouped' in sys.argv:
+        return True
+    return config is not None and config.grouped is True
+
+
 def load_extensions_from_config(config):
     """
     Loads extensions based on ``config`` (which may be parsed
@@ -454,11 +500,10 @@ def init_context(builddir):
 
 def check_script_signatures(loaded_files):
     """
-    Checks the signatures of all build scripts which have been loaded.
-    If the script signatures have changed since the last time ``wasp`` was
-    executed, the cache as well as all signatures are cleared. Consequently,
-    everything is built from scratch (since the build logic may have changed
-    completely).
+    Checks the signatures of all build scripts which have been loaded and
+    stores them in the cache. The cache is not cleared if the build scripts have
+    changed, since tasks whose definition has changed are detected by
+    their fingerprint (see :func:`wasp.task.Task.fingerprint`).
 
     :param loaded_files: List of file names of loaded files.
     """
@@ -466,6 +511,9 @@ def check_script_signatures(loaded_files):
     d = ctx.cache.prefix('script-signatures')
     current_signatures = {}
     for f in loaded_files:
+        # store the paths relative to the topdir, s.t. the
+        # cache remains valid if the project is moved
+        f = sanitize_path(f)
         cur_sig = FileSignature(f)
         cur_sig.refresh()
         current_signatures[f] = cur_sig
@@ -477,18 +525,100 @@ def check_script_signatures(loaded_files):
         if cur_sig != old_sig:
             changed = True
             break
-    if changed:
-        ctx.cache.clear()
-        ctx.produced_signatures.clear()
-        if len(d) != 0:
-            # don't issue warning if wasp was never run before
-            log.info(log.format_info('Build scripts have changed since last execution!',
-                       'All previous configurations have been cleared!'))
+    if changed and len(d) != 0:
+        # don't issue message if wasp was never run before
+        log.debug(log.format_info('Build scripts have changed since last execution!',
+                                  'Tasks with a changed definition are executed again.'))
     d = ctx.cache.prefix('script-signatures')
     d.clear()
     d.update(current_signatures)
 
 
+def load(dir_path):
+    """
+    Loads the configuration, the extensions and the build scripts from ``dir_path``
+    and initializes the context.
+
+    :param dir_path: The directory from which is used as TOPDIR
+    :return: A list of the loaded build scripts or None if no build file was found.
+    """
+    #
+    # first and foremost, initialize logging
+    log.configure(verbosity=retrieve_verbosity(), pretty=retrieve_pretty_printing())
+    # load configuration from current directory
+    config = Config.load_from_directory(dir_path)
+    extensions.api.config_loaded(config)
+    # allows accessing the configuration while the build scripts are loaded
+    ctx.config = config
+    log.configure(grouped=retrieve_grouped_output(config))
+    if config.verbosity is not None and log.verbosity == log.DEFAULT:
+        # configuration overwrites default from command line/env
+        # but NOT if verbosity was modified from default
+        log.configure(verbosity=config.verbosity, pretty=config.pretty)
+    # load all extensions
+    load_extensions_from_config(config)
+    # import all modules
+    extensions.api.before_load_scripts()
+    # load toplevel directory
+    recursion.index.load(retrieve_builddir())
+    with recursion.index.loading(recursion.TOPDIR, None):
+        loaded_files = load_directory(dir_path)
+    files_to_load = extensions.api.find_scripts()
+    load_files(files_to_load)
+    if len(loaded_files) == 0 and len(files_to_load) == 0:
+        return None
+    extensions.api.top_scripts_loaded()
+    # load recursive files, if possible only the ones required
+    # for the given commands and targets
+    select = None
+    if not retrieve_server_mode():
+        select = recursion.index.select(sys.argv[1:], set(com.name for com in decorators.commands))
+        if select is not None:
+            log.debug(log.format_info('Loading {0} of the recursed directories.'.format(len(select))))
+    loaded_files.extend(load_recursive(select))
+    extensions.api.all_scripts_loaded()
+    # load/overwrite config from decorators
+    load_decorator_config(config)
+    # initialize the context
+    init_context(Directory(retrieve_builddir()))
+    extensions.api.context_created()
+    return loaded_files
+
+
+def initialize(loaded_files):
+    """
+    Registers the commands in the context and runs the ``init()`` hooks,
+    after the build scripts have been loaded with :func:`load`.
+
+    :param loaded_files: List of the loaded build scripts.
+    """
+    check_script_signatures(loaded_files)
+    # load all command decorators into the context
+    for com in decorators.commands:
+        ctx.commands.add(com)
+    # run all init() hooks
+    for hook in decorators.init:
+        hook()
+    extensions.api.initialized()
+
+
+def execute_commands():
+    """
+    Parses the command line options and runs the given commands.
+
+    :return: True if the commands have been executed successfully.
+    """
+    options = OptionHandler()
+    extensions.api.retrieve_options(ctx.options)
+    options.parse()
+    extensions.api.options_parsed(ctx.options)
+    noop_manifest.requested(options.commands)
+    if 'clean' in options.commands:
+        run_command('clean')
+    options.handle_options()
+    return handle_commands(options)
+
+
 def run(dir_path):
     """
     Runs the application from the given directory. It is assumed that:
@@ -496,41 +626,21 @@ def run(dir_path):
      * the current working directory is the TOPDIR of the project,
      * this function is executed once.
 
+    If ``--server`` is given, wasp keeps running and executes the commands
+    of subsequent invocations, see :mod:`wasp.server`.
+
     :param dir_path: The directory from which is used as TOPDIR
     :return: True if a build file was found in `dir_path`, False otherwise
     """
+    if retrieve_server_mode():
+        from .server import serve
+        return serve(dir_path)
     success = False
     try:
-        #
-        # first and foremost, initialize logging
-        log.configure(verbosity=retrieve_verbosity(), pretty=retrieve_pretty_printing())
-        # load configuration from current directory
-        config = Config.load_from_directory(dir_path)
-        extensions.api.config_loaded(config)
-        if config.verbosity is not None and log.verbosity == log.DEFAULT:
-            # configuration overwrites default from command line/env
-            # but NOT if verbosity was modified from default
-            log.configure(verbosity=config.verbosity, pretty=config.pretty)
-        # load all extensions
-        load_extensions_from_config(config)
-        # import all modules
-        extensions.api.before_load_scripts()
-        # load toplevel directory
-        loaded_files = load_directory(dir_path)
-        files_to_load = extensions.api.find_scripts()
-        load_files(files_to_load)
-        if len(loaded_files) == 0 and len(files_to_load) == 0:
+        loaded_files = load(dir_path)
+        if loaded_files is None:
             log.fatal('No build file found. Exiting.')
             return True  # nothing was loaded, no point in continuing
-        extensions.api.top_scripts_loaded()
-        # load recursive files
-        loaded_files.extend(load_recursive())
-        extensions.api.all_scripts_loaded()
-        # load/overwrite config from decorators
-        load_decorator_config(config)
-        # initialize the context
-        init_context(Directory(retrieve_builddir()))
-        extensions.api.context_created()
     except FatalError as e:
         e.print()
         return False
@@ -538,27 +648,16 @@ def run(dir_path):
         traceback.print_exception(None, e, e.__traceback__)
         return False
     try:
-        check_script_signatures(loaded_files)
-        # load all command decorators into the context
-        for com in decorators.commands:
-            ctx.commands.add(com)
-        # run all init() hooks
-        for hook in decorators.init:
-            hook()
-        extensions.api.initialized()
-        # parse options
-        options = OptionHandler()
-        extensions.api.retrieve_options(ctx.options)
-        options.parse()
-        extensions.api.options_parsed(ctx.options)
-        if 'clean' in options.commands:
-            run_command('clean')
-        options.handle_options()
-        success = handle_commands(options)
+        initialize(loaded_files)
+        success = execute_commands()
     except FatalError as e:
         e.print()
         success = False
     except Exception as e:
         traceback.print_exception(None, e, e.__traceback__)
     ctx.save()
+    recursion.index.save()
+    directories = set(os.path.dirname(f) for f in loaded_files)
+    directories.update(recursion.index.directories)
+    noop_manifest.save(ctx.builddir.path, directories, ctx.cache.files, success)
     return success
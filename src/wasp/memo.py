@@ -0,0 +1,137 @@
+"""
+Persistent memoization of functions called by build scripts, see :func:`memoize`.
+"""
+
+import functools
+import json
+import marshal
+import os
+
+from . import ctx, log, factory
+from .cache import Cache, Journal, FileLock, create_storage, JOURNAL_FILE, LOCK_FILE
+from .fs import Directory, paths, relocatable_path
+from .noop import manifest as noop_manifest
+from .signature import FileSignature, GlobSignature, EnvSignature
+from .util import checksum
+
+
+MEMOIZE_PREFIX = 'memoize'
+"""
+The memoized return values are stored in the cache prefix ``MEMOIZE_PREFIX``.
+"""
+
+_early = None
+
+
+class _EarlyCache(object):
+    """
+    Provides access to the cache of the build directory while the build scripts
+    are loaded, i.e. before :data:`wasp.ctx` has been initialized. New rows are
+    recorded in the journal of the cache, which is replayed once the context is loaded.
+    """
+    def __init__(self):
+        from .main import retrieve_builddir
+        builddir = Directory(retrieve_builddir())
+        lock = FileLock(builddir.join(LOCK_FILE).path)
+        self._cache = Cache(storage=create_storage(ctx.config.cache_backend, builddir.path), lock=lock)
+        self._cache.load()
+        self._journal = Journal(builddir.join(JOURNAL_FILE).path, lock=lock)
+
+    def prefix(self, prefix):
+        return self._cache.prefix(prefix)
+
+    def journal(self, prefix, key, value):
+        self._journal.record(prefix, key, value)
+
+    def sync(self):
+        self._journal.sync()
+
+    def close(self):
+        self._cache.storage.close()
+
+
+def _cache():
+    global _early
+    if ctx.cache is not None:
+        if _early is not None:
+            _early.close()
+            _early = None
+        return ctx.cache
+    if _early is None:
+        _early = _EarlyCache()
+    return _early
+
+
+def _dependency_signatures(depends, env):
+    ret = {}
+    for p in paths(depends):
+        noop_manifest.watch(p.path)
+        key = relocatable_path(p.path)
+        if os.path.isdir(p.path):
+            ret[key] = GlobSignature(key, path=p.path).refresh()
+        else:
+            ret[key] = FileSignature(p.path).refresh()
+    for varname in env:
+        noop_manifest.watch_env(varname)
+        ret['$' + varname] = EnvSignature('$' + varname).refresh()
+    return ret
+
+
+class memoize(object):
+    """
+    Decorator which stores the return values of a function in the cache, s.t. expensive
+    computations of build scripts (such as parsing version files or querying ``pkg-config``)
+    are not repeated on every invocation of ``wasp``. The return value is reused as long as
+    the arguments of the call, the definition of the function and the signatures of the
+    dependencies are unchanged.
+
+    The arguments and the return value must be json serializable or of type
+    :class:`wasp.util.Serializable`. Note that tuples are returned as lists.
+    Calls with arguments which cannot be serialized are not memoized.
+
+    :param depends: Files or directories the return value depends on. Accepts anything
+        accepted by :func:`wasp.fs.paths`. The contents of files are compared, for directories
+        only the listing is compared (see :class:`wasp.signature.GlobSignature`).
+    :param env: Names of environment variables the return value depends on.
+    """
+    def __init__(self, depends=None, env=None):
+        if callable(depends) and env is None:
+            raise TypeError('Use @memoize() instead of @memoize.')
+        self._depends = [] if depends is None else depends
+        if isinstance(env, str):
+            env = [env]
+        self._env = [] if env is None else list(env)
+
+    def __call__(self, f):
+        code = checksum(marshal.dumps(f.__code__))
+        name = '{0}:{1}'.format(relocatable_path(f.__code__.co_filename), f.__qualname__)
+
+        @functools.wraps(f)
+        def wrapper(*args, **kw):
+            try:
+                args_json = json.dumps(factory.to_json([list(args), kw]), sort_keys=True)
+            except TypeError:
+                log.debug(log.format_info('Not memoizing call of `{0}`: Arguments are not serializable.'
+                                          .format(f.__qualname__)))
+                return f(*args, **kw)
+            key = '{0}:{1}'.format(name, checksum(args_json.encode('UTF-8')))
+            signatures = _dependency_signatures(self._depends, self._env)
+            cache = _cache()
+            entry = cache.prefix(MEMOIZE_PREFIX).get(key)
+            if entry is not None and entry['code'] == code and entry['depends'] == signatures:
+                return entry['value']
+            value = f(*args, **kw)
+            entry = {'code': code, 'depends': signatures, 'value': value}
+            try:
+                json.dumps(factory.to_json(entry))
+            except TypeError:
+                log.debug(log.format_info('Not memoizing return value of `{0}`: Value is not serializable.'
+                                          .format(f.__qualname__)))
+                return value
+            cache.prefix(MEMOIZE_PREFIX)[key] = entry
+            # journal the entry, s.t. it survives the re-initialization of the cache
+            # if the function is called while the build scripts are loaded
+            cache.journal(MEMOIZE_PREFIX, key, entry)
+            cache.sync()
+            return value
+        return wrapper
@@ -1,9 +1,15 @@
 from uuid import uuid4 as generate_uuid
 
-from .argument import ArgumentCollection, collection
-from .signature import FileSignature, CacheSignature
+from .argument import ArgumentCollection, Argument, collection
+from .signature import FileSignature, CacheSignature, EnvSignature
 from .util import is_iterable
 
+SYMBOLIC_NODES_PREFIX = 'symblic-nodes'
+"""
+The contents of symbolic nodes are stored in the cache prefix ``SYMBOLIC_NODES_PREFIX``,
+which is sharded by subproject (see :func:`wasp.cache.cache_shard`).
+"""
+
 
 class Node(object):
     """
@@ -62,11 +68,7 @@ class Node(object):
         :param ns: The namespace for which the signature should be returned.
         """
         from . import ctx
-        signature = ctx.signatures.get(self.key, ns=ns)
-        if signature is None:
-            signature = self._make_signature()
-            ctx.signatures.add(signature, ns=ns)
-        return signature
+        return ctx.signatures.get_or_add(self.key, self._make_signature, ns=ns)
 
     def has_changed(self, ns=None):
         """
@@ -170,15 +172,23 @@ class SymbolicNode(Node):
             key = ctx.generate_name()
         super().__init__(key=key)
 
+    @property
+    def cache_prefix(self):
+        """
+        Returns the name of the cache prefix in which the content of the node is stored.
+        """
+        from .cache import cache_shard, shard_prefix
+        return shard_prefix(SYMBOLIC_NODES_PREFIX, cache_shard(self.key))
+
     def _make_signature(self):
-        return CacheSignature(self.key, prefix='symblic-nodes', cache_key=self.key)
+        return CacheSignature(self.key, prefix=self.cache_prefix, cache_key=self.key)
 
     def read(self):
         """
         Returns the content of the node in form of an ArgumentCollection.
         """
         from . import ctx
-        arg_col = ctx.cache.prefix('symblic-nodes').get(self.key, None)
+        arg_col = ctx.cache.prefix(self.cache_prefix).get(self.key, None)
         if arg_col is None:
             return ArgumentCollection()
         if isinstance(arg_col, dict):
@@ -200,7 +210,9 @@ class SymbolicNode(Node):
         """
         col = collection(*args, **kw)
         from . import ctx
-        ctx.cache.prefix('symblic-nodes')[self.key] = col
+        prefix = self.cache_prefix
+        ctx.cache.prefix(prefix)[self.key] = col
+        ctx.cache.journal(prefix, self.key, col)
 
     def update(self, *args, **kw):
         """
@@ -218,6 +230,72 @@ class SymbolicNode(Node):
         return self.key
 
 
+class EnvNode(Node):
+    """
+    A node which points to an environment variable (as found in ``ctx.env``).
+    Its signature only changes if the value of the variable changes. Thus,
+    tasks can depend on environment variables such as ``CC`` or ``CFLAGS``
+    without being executed every time. EnvNodes have names which start with
+    a dollar sign ('$') followed by the name of the variable and can be
+    created using the :func:`wasp.node.node` function::
+
+        n = node('$CC')
+
+    If the node is used by a task, the value of the variable is passed to the task
+    as an argument with the lower case name of the variable (e.g. ``cc``).
+
+    :param key: The name of the node, i.e. '$' + the name of the variable.
+    """
+    def __init__(self, key):
+        assert is_env_node_string(key), 'The name of an EnvNode must start with `$`.'
+        super().__init__(key=key)
+        from . import osinfo
+        varname = key[1:]
+        if osinfo.windows:
+            # os.environ only contains upper case variables on windows
+            varname = varname.upper()
+        self._varname = varname
+
+    def _make_signature(self):
+        return EnvSignature(self.key, varname=self._varname)
+
+    @property
+    def varname(self):
+        """
+        Returns the name of the environment variable.
+        """
+        return self._varname
+
+    @property
+    def value(self):
+        """
+        Returns the value of the environment variable or None if it is not set.
+        """
+        from . import ctx
+        return ctx.env.get(self._varname)
+
+    def read(self):
+        """
+        Returns an ArgumentCollection containing the value of the variable (if set)
+        with the lower case name of the variable as key.
+        """
+        ret = ArgumentCollection()
+        value = self.value
+        if value is not None:
+            ret.add(Argument(self._varname.lower(), value=value))
+        return ret
+
+    @property
+    def arguments(self):
+        """
+        Equivalent to self.read()
+        """
+        return self.read()
+
+    def __str__(self):
+        return self.key
+
+
 class SpawningNode(SymbolicNode):
     def __init__(self, key=None):
         super().__init__(key=key)
@@ -256,6 +334,15 @@ def is_symbolic_node_string(arg):
     return len(arg) > 1 and arg[0] == ':'
 
 
+def is_env_node_string(arg):
+    """
+    Returns True if the argument string qualifies as a name
+    for an :class:`EnvNode`.
+    """
+    assert isinstance(arg, str)
+    return len(arg) > 1 and arg[0] == '$'
+
+
 def nodes(*args):
     """
     Create a list of nodes based on nodes created for each arg in *args.
@@ -266,7 +353,8 @@ def nodes(*args):
         * Any subclass of Node is added as is
         * A Path object is converted into a :class:`wasp.node.FileNode(path)`
         * A string is converted to a :class:`wasp.node.SymbolicNode(path)` if it
-            starts with a ':'. Otherwise it is converted into a :class:`wasp.node.FileNode(path)`
+            starts with a ':', to a :class:`wasp.node.EnvNode(name)` if it starts with a '$'.
+            Otherwise it is converted into a :class:`wasp.node.FileNode(path)`
         * For a :class:`wasp.task.Task` or :class:`wasp.task.TaskGroup` object the
             target nodes are added.
 
@@ -294,7 +382,8 @@ def node(arg=None):
         * Any subclass of Node is returned as is
         * A Path object is converted into a :class:`wasp.node.FileNode(path)`
         * A string is converted to a :class:`wasp.node.SymbolicNode(path)` if it
-            starts with a ':'. Otherwise it is converted into a :class:`wasp.node.FileNode(path)`
+            starts with a ':', to a :class:`wasp.node.EnvNode(name)` if it starts with a '$'.
+            Otherwise it is converted into a :class:`wasp.node.FileNode(path)`
         * For a :class:`wasp.task.Task` object the first target node is returned.
     """
     from .fs import Path
@@ -304,6 +393,8 @@ def node(arg=None):
     elif isinstance(arg, str):
         if is_symbolic_node_string(arg):
             return SymbolicNode(arg)
+        elif is_env_node_string(arg):
+            return EnvNode(arg)
         else:
             return FileNode(arg)
     elif isinstance(arg, Path):
@@ -0,0 +1,289 @@
+"""
+Fast path for invocations of ``wasp`` in which nothing has to be done.
+
+If all tasks of a successful invocation were up-to-date, a manifest is stored in the
+build directory (see :data:`MANIFEST_FILE`). It contains the command line, the values
+of the relevant environment variables and the ``stat()`` results of all files which were
+involved: the build scripts and configuration files, the sources and targets of all
+tasks (and the directories containing them, s.t. new files are noticed), the
+directories scanned by :class:`wasp.fs.GlobNode` objects and the files of the cache.
+Since the cache is written by every other invocation of ``wasp``, the manifest is
+invalidated as soon as ``wasp`` runs without the fast path.
+
+The environment variables in the manifest are the ones read through ``ctx.env`` (e.g. by
+:func:`wasp.argument.Argument.retrieve_all`), the ones used by :class:`wasp.node.EnvNode`
+objects and :data:`WATCHED_ENV`. If the whole environment was read, all variables are
+recorded.
+
+The ``wasp`` script checks the manifest using :func:`up_to_date` before importing wasp.
+If the command line is the same and none of the files has changed, it exits immediately
+without loading the build scripts. Thus, this module is loaded by the launchers on its own
+(without the ``wasp`` package) and must only import from the standard library at module level.
+
+No manifest is stored if a requested command did not create any tasks (since its
+handler may have side effects, e.g. ``clear-cache``) or if a task uses a node which
+cannot be checked in this way. Build scripts which read other files while they are
+loaded can register them using :func:`watch`.
+"""
+
+import marshal
+import os
+import sys
+
+
+MANIFEST_FILE = 'noop.manifest'
+"""
+Name of the file in the build directory in which the manifest is stored. It is
+written using :mod:`marshal`, which is faster to load than json and does not
+require importing any module.
+"""
+
+MANIFEST_VERSION = 1
+
+WATCHED_ENV = ['PATH', 'BUILDDIR']
+"""
+Environment variables which are always part of the manifest, in addition to
+the variables starting with :data:`WATCHED_ENV_PREFIX`.
+"""
+
+WATCHED_ENV_PREFIX = 'WASP_'
+
+PARALLEL_STAT_THRESHOLD = 512
+"""
+Minimum number of files for which the ``stat()`` calls are distributed to multiple threads.
+"""
+
+
+def stat(path):
+    """
+    Returns ``[st_mtime_ns, st_size]`` of ``path`` or None if it does not exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def stat_all(paths):
+    """
+    Returns the results of :func:`stat` for all ``paths``. Large numbers of
+    files are checked using multiple threads.
+    """
+    if len(paths) < PARALLEL_STAT_THRESHOLD:
+        return [stat(p) for p in paths]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as pool:
+        return list(pool.map(stat, paths, chunksize=128))
+
+
+def _environment(names):
+    if names is None:
+        return dict(os.environ)
+    names = set(names)
+    names.update(k for k in os.environ.keys() if k.startswith(WATCHED_ENV_PREFIX))
+    return {name: os.environ.get(name) for name in names}
+
+
+def up_to_date(builddir, argv):
+    """
+    Checks the manifest in ``builddir``.
+
+    :param argv: The command line arguments.
+    :return: The message to be printed if nothing has to be done, otherwise None.
+    """
+    try:
+        with open(os.path.join(builddir, MANIFEST_FILE), 'rb') as f:
+            manifest = marshal.load(f)
+    except (OSError, ValueError, EOFError, TypeError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+        return None
+    env_names = None if manifest.get('env_all', False) else manifest['env'].keys()
+    if manifest['argv'] != argv or _environment(env_names) != manifest['env']:
+        return None
+    paths = [x[0] for x in manifest['files']]
+    if stat_all(paths) != [x[1] for x in manifest['files']]:
+        return None
+    return manifest['message']
+
+
+def _script_files(directories):
+    from .main import FILE_NAMES
+    from .config import CONFIG_FILE_NAMES
+    ret = set(CONFIG_FILE_NAMES)
+    for d in directories:
+        ret.update(os.path.join(d, fname) for fname in FILE_NAMES)
+    return ret
+
+
+def _module_files(topdir):
+    """
+    Returns the files of the loaded modules of wasp and of the project (e.g. tools).
+    """
+    import wasp
+    wasp_dir = os.path.dirname(os.path.abspath(wasp.__file__))
+    ret = set()
+    for module in list(sys.modules.values()):
+        fpath = getattr(module, '__file__', None)
+        if fpath is None:
+            continue
+        fpath = os.path.abspath(fpath)
+        if fpath.startswith(topdir + os.sep) or os.path.dirname(fpath) == wasp_dir:
+            if os.path.isfile(fpath):
+                ret.add(fpath)
+    if len(sys.argv) > 0 and os.path.isfile(sys.argv[0]):
+        # the wasp script itself
+        ret.add(os.path.abspath(sys.argv[0]))
+    return ret
+
+
+class Manifest(object):
+    """
+    Collects the information for the manifest during an invocation of ``wasp``.
+    """
+    def __init__(self):
+        self._files = set()
+        self._env = set(WATCHED_ENV)
+        self._tasks = []
+        self._commands = {}
+        self._requested = []
+        self._valid = True
+
+    def reset(self):
+        """
+        Resets the state which belongs to a single invocation of ``wasp``, s.t. the
+        manifest can be reused for further commands (see :mod:`wasp.server`). The watched
+        files and environment variables are kept, since they are registered while the
+        build scripts are loaded or by memoized functions, which are not called again.
+        """
+        self._tasks = []
+        self._commands = {}
+        self._requested = []
+        self._valid = True
+
+    @property
+    def files(self):
+        """
+        Returns the set of files and directories registered using :meth:`watch`.
+        """
+        return set(self._files)
+
+    def watch(self, *paths):
+        """
+        Adds files or directories to the manifest.
+        """
+        self._files.update(paths)
+
+    def watch_env(self, *names):
+        """
+        Adds environment variables to the manifest.
+        """
+        self._env.update(names)
+
+    def track(self, task):
+        """
+        Adds the nodes of ``task`` to the manifest. Called for all
+        tasks which are inserted into a :class:`wasp.execution.TaskGraph`.
+        """
+        self._tasks.append(task)
+
+    def invalidate(self):
+        """
+        Prevents storing the manifest, e.g. because a task has been executed.
+        """
+        self._valid = False
+
+    def executed(self, name, tasks):
+        """
+        Records that the command ``name`` has created ``tasks``.
+        """
+        self._commands[name] = self._commands.get(name, 0) + len(tasks)
+
+    def requested(self, commands):
+        """
+        Sets the commands which have been given on the command line.
+        """
+        self._requested = list(commands)
+
+    def _collect(self, topdir, builddir):
+        """
+        Returns the set of watched files or None if a node cannot be watched.
+        """
+        from . import log
+        from .fs import GlobNode, scan_tree
+        from .node import FileNode, SymbolicNode, EnvNode
+        files = set(self._files)
+        for task in self._tasks:
+            for n in list(task.sources) + list(task.targets):
+                if isinstance(n, FileNode):
+                    files.add(n.path)
+                    dirname = os.path.dirname(n.path) or '.'
+                    # wasp itself writes to the build directory
+                    if os.path.abspath(dirname) != builddir:
+                        files.add(dirname)
+                elif isinstance(n, GlobNode):
+                    for reldir, _ in scan_tree(n._path, recursive=n._recursive):
+                        files.add(os.path.join(n._path, reldir))
+                elif isinstance(n, EnvNode):
+                    self._env.add(n.key[1:])
+                elif not isinstance(n, SymbolicNode):
+                    log.debug(log.format_info('No-op manifest not stored: `{0}` cannot be watched.'.format(n.key)))
+                    return None
+        files.update(_module_files(topdir))
+        return files
+
+    def save(self, builddir, directories, cache_files, success):
+        """
+        Stores the manifest in ``builddir`` if all tasks were up-to-date.
+        Otherwise an existing manifest is removed.
+
+        :param directories: The directories containing build scripts.
+        :param cache_files: The files of the cache, which must have been saved before.
+        :param success: True if all commands have succeeded.
+        """
+        from . import log, ctx
+        fpath = os.path.join(builddir, MANIFEST_FILE)
+        files = None
+        if success and self._valid and len(self._requested) > 0 \
+                and all(self._commands.get(name, 0) > 0 for name in self._requested):
+            files = self._collect(os.path.abspath('.'), os.path.abspath(builddir))
+        if files is None:
+            if os.path.exists(fpath):
+                os.remove(fpath)
+            return
+        files.update(_script_files(directories))
+        files.update(cache_files)
+        files = sorted(set(os.path.relpath(f) if os.path.isabs(f) else os.path.normpath(f) for f in files))
+        message = ''
+        if log.verbosity >= log.INFO:
+            message = str(log.format_success('Up to date: {0}'.format(', '.join(self._requested))))
+        env_names = ctx.env.read
+        if env_names is not None:
+            env_names = env_names | self._env
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'argv': sys.argv[1:],
+            'env': _environment(env_names),
+            'env_all': env_names is None,
+            'files': [[f, s] for f, s in zip(files, stat_all(files))],
+            'message': message
+        }
+        tmp = fpath + '.tmp'
+        with open(tmp, 'wb') as f:
+            marshal.dump(manifest, f)
+        os.replace(tmp, fpath)
+
+
+manifest = Manifest()
+"""
+The :class:`Manifest` of the current invocation.
+"""
+
+
+def watch(*paths):
+    """
+    Registers files which are read by the build scripts, s.t. the fast path for
+    up-to-date builds is not taken if one of them changes (see :mod:`wasp.noop`).
+    """
+    manifest.watch(*paths)
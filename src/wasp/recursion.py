@@ -0,0 +1,340 @@
+"""
+Lazy loading of the build scripts of the directories registered with :func:`wasp.recurse`.
+
+Each time all build scripts have been loaded, an index of the directories is stored in
+the build directory (see :data:`RECURSION_FILE`). For each directory, it records the
+directory which registered it, the commands declared by its build scripts and whether
+they register anything besides commands (e.g. options, ``init()`` hooks or tools).
+Furthermore, the targets of the tasks are recorded together with the directory which
+declared the command that created them and the sources of the tasks.
+
+If ``wasp`` is invoked for specific targets (``--target``) or for commands which are
+only declared in some directories, only the following directories are loaded:
+
+ * the directories whose commands create the tasks required for producing the targets,
+ * the directories declaring the requested commands for which no target is given,
+ * all directories which register anything besides commands,
+ * the parents of all of these directories.
+
+All build scripts are loaded if the index does not exist, if a build script has changed
+since the index was stored, if a target is unknown, if a command is given which is not
+declared by a recursed directory (e.g. ``clean``), if a directory is registered which
+is not contained in the index or if ``wasp`` runs as server.
+Note that commands executed as dependencies of the requested commands (e.g. ``configure``)
+only run the handlers of the loaded directories.
+"""
+
+import json
+import os
+from contextlib import contextmanager
+from itertools import count
+
+from . import decorators
+from .node import node
+from .task import Task, TaskGroup
+from .tools import proxies as tool_proxies
+
+
+RECURSION_FILE = 'recursion.json'
+"""
+Name of the file in the build directory in which the index is stored.
+"""
+
+RECURSION_VERSION = 1
+
+TOPDIR = '.'
+
+_revisions = count()
+
+
+def directory_key(path):
+    """
+    Returns the normalized path of a directory relative to the top directory, which
+    is used to identify the directory in the index.
+    """
+    if os.path.isabs(path):
+        path = os.path.relpath(path)
+    return os.path.normpath(path).replace('\\', '/')
+
+
+def _stat_files(directory):
+    from .main import FILE_NAMES
+    ret = {}
+    for fname in FILE_NAMES:
+        try:
+            st = os.stat(os.path.join(directory, fname))
+        except OSError:
+            continue
+        ret[fname] = [st.st_mtime_ns, st.st_size]
+    return ret
+
+
+def _registrations():
+    """
+    Returns a snapshot of everything registered by build scripts except for commands.
+    """
+    ret = {key: len(value) for key, value in decorators._other.items()
+           if key != 'commands' and len(value) > 0}
+    ret['metadata'] = id(decorators.metadata)
+    ret['tools'] = len(tool_proxies)
+    return ret
+
+
+def _flatten(tasks):
+    if isinstance(tasks, Task):
+        return [tasks]
+    if isinstance(tasks, TaskGroup):
+        tasks = tasks.tasks
+    elif isinstance(tasks, dict):
+        tasks = tasks.values()
+    ret = []
+    for task in tasks:
+        ret.extend(_flatten(task))
+    return ret
+
+
+class RecursionIndex(object):
+    """
+    Records which directory declares which commands and targets and selects the directories
+    required for an invocation of ``wasp`` (see :mod:`wasp.recursion`).
+    """
+
+    def __init__(self):
+        self._path = None
+        self._directories = {}
+        self._targets = {}
+        self._loaded = {}
+        self._owners = {}
+        self._task_owners = {}
+        self._changed = False
+        self._complete = True
+        self._revision = next(_revisions)
+
+    def load(self, builddir):
+        """
+        Loads the index stored in ``builddir``.
+        """
+        self._path = os.path.join(builddir, RECURSION_FILE)
+        try:
+            with open(self._path, 'r') as f:
+                d = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(d, dict) or d.get('version') != RECURSION_VERSION:
+            return
+        self._directories = d['directories']
+        self._targets = d['targets']
+        self._revision = next(_revisions)
+
+    def save(self):
+        """
+        Stores the index in the build directory, if it has changed.
+        """
+        if not self._changed or self._path is None:
+            return
+        d = {'version': RECURSION_VERSION, 'directories': self._directories, 'targets': self._targets}
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(d, f)
+        os.replace(tmp, self._path)
+        self._changed = False
+
+    @property
+    def directories(self):
+        """
+        Returns the keys of all known directories, i.e. the recorded and the loaded ones.
+        """
+        return set(self._directories.keys()) | set(self._loaded.keys())
+
+    @property
+    def revision(self):
+        """
+        Returns a number which changes whenever :attr:`directories` changes.
+        """
+        return self._revision
+
+    @property
+    def complete(self):
+        """
+        Returns False if only the build scripts of some directories have been loaded.
+        """
+        return self._complete
+
+    def known(self, directory):
+        """
+        Returns True if ``directory`` has been recorded in the index.
+        """
+        return directory in self._directories
+
+    @contextmanager
+    def loading(self, directory, parent):
+        """
+        Context manager which records what is registered while the build scripts
+        of ``directory`` are loaded.
+
+        :param directory: Key of the directory (see :func:`directory_key`).
+        :param parent: Key of the directory which registered ``directory`` or None.
+        """
+        ncommands = len(decorators.commands)
+        registrations = _registrations()
+        yield
+        declared = decorators.commands[ncommands:]
+        commands = {}
+        for com in declared:
+            self._owners[com] = directory
+            commands.setdefault(com.name, set()).update(com.depends)
+        self._loaded[directory] = {
+            'parent': parent,
+            'files': _stat_files(directory),
+            'commands': {name: sorted(depends) for name, depends in commands.items()},
+            'isolated': registrations == _registrations()
+        }
+        self._revision = next(_revisions)
+
+    def loaded(self, complete):
+        """
+        Must be called after the build scripts have been loaded.
+
+        :param complete: True if the build scripts of all directories have been loaded.
+        """
+        self._complete = complete
+        if not complete:
+            return
+        if self._loaded != self._directories:
+            self._directories = self._loaded
+            self._changed = True
+            self._revision = next(_revisions)
+        # forget about targets of directories which no longer exist
+        stale = [key for key, entry in self._targets.items()
+                 if any(d not in self._directories for d in entry['dirs'])]
+        for key in stale:
+            del self._targets[key]
+            self._changed = True
+
+    def own(self, command, tasks):
+        """
+        Marks ``tasks`` as created by ``command``.
+        """
+        directory = self._owners.get(command)
+        if directory is None:
+            return
+        for task in _flatten(tasks):
+            self._task_owners[task] = directory
+
+    def record(self, tasks):
+        """
+        Records the targets and sources of ``tasks``, which are about to be executed.
+        """
+        for task in _flatten(tasks):
+            directory = self._task_owners.pop(task, None)
+            entry = {'dirs': [] if directory is None else [directory],
+                     'sources': sorted(set(n.key for n in task.sources))}
+            for target in task.targets:
+                if self._targets.get(target.key) != entry:
+                    self._targets[target.key] = entry
+                    self._changed = True
+
+    def _up_to_date(self):
+        return all(_stat_files(d) == entry['files'] for d, entry in self._directories.items())
+
+    def _requests(self, argv, commands):
+        """
+        Returns a list of ``[command, target]`` pairs given on the command line or
+        None if the command line cannot be handled.
+        """
+        recursed = set()
+        for d, entry in self._directories.items():
+            if d != TOPDIR:
+                recursed.update(entry['commands'].keys())
+        ret = []
+        current = None
+        args = iter(argv)
+        for arg in args:
+            if arg in recursed:
+                current = [arg, None]
+                ret.append(current)
+                continue
+            if arg in commands:
+                # declared by wasp itself or by the top-level build scripts only
+                return None
+            if arg == '-t' or arg == '--target':
+                target = next(args, None)
+            elif arg.startswith('--target='):
+                target = arg[len('--target='):]
+            elif arg.startswith('-t') and not arg.startswith('--'):
+                target = arg[2:]
+            else:
+                continue
+            if current is None or not target:
+                return None
+            current[1] = target
+        return ret
+
+    def _declaring(self, command):
+        ret = set()
+        names = [command]
+        seen = set()
+        while names:
+            name = names.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            for d, entry in self._directories.items():
+                if name in entry['commands']:
+                    ret.add(d)
+                    names.extend(entry['commands'][name])
+        return ret
+
+    def _producing(self, target):
+        key = node(target).key
+        if key not in self._targets:
+            return None
+        ret = set()
+        keys = [key]
+        seen = set(keys)
+        while keys:
+            entry = self._targets.get(keys.pop())
+            if entry is None:
+                continue
+            ret.update(entry['dirs'])
+            for source in entry['sources']:
+                if source not in seen:
+                    seen.add(source)
+                    keys.append(source)
+        return ret
+
+    def select(self, argv, commands):
+        """
+        Selects the directories which must be loaded for running the commands given in ``argv``.
+
+        :param argv: The command line arguments.
+        :param commands: Names of the commands which have been registered so far, i.e.
+            by wasp itself and by the top-level build scripts.
+        :return: A set of directory keys or None if all directories must be loaded.
+        """
+        if len(self._directories) == 0 or not self._up_to_date():
+            return None
+        requests = self._requests(argv, commands)
+        if not requests:
+            return None
+        selected = set()
+        for command, target in requests:
+            dirs = self._declaring(command) if target is None else self._producing(target)
+            if dirs is None or any(d not in self._directories for d in dirs):
+                return None
+            selected.update(dirs)
+        selected.update(d for d, entry in self._directories.items() if not entry['isolated'])
+        for d in list(selected):
+            parent = self._directories[d]['parent']
+            while parent is not None and parent not in selected:
+                selected.add(parent)
+                parent = self._directories[parent]['parent']
+        if selected.issuperset(self._directories.keys()):
+            return None
+        return selected
+
+
+index = RecursionIndex()
+"""
+The :class:`RecursionIndex` of the current invocation.
+"""
@@ -0,0 +1,329 @@
+"""
+Implements ``wasp --server``, which keeps the interpreter, the loaded build scripts and the
+in-memory cache alive and executes the commands of subsequent invocations of ``wasp``.
+
+The server listens on a unix socket in the build directory (see :data:`SERVER_SOCKET`).
+The ``wasp`` script forwards its command line arguments and environment to the server if
+the socket exists and streams the output back. The protocol consists of json objects
+separated by newlines. The client sends ``{"argv": [...], "env": {...}, "tty": [bool, bool]}``
+and the server answers with any number of ``{"stdout": str}`` and ``{"stderr": str}`` objects
+followed by either ``{"exit": int}`` or ``{"restart": true}``. The latter is sent if the
+build scripts, the configuration files, the loaded tools and extensions, wasp itself or the
+files registered using :func:`wasp.noop.watch` have changed. In that case, the server
+replaces itself with a new process and the client sends its request again.
+While a request is handled, the output of child processes which write to the ``stdout``
+or ``stderr`` of the server is forwarded to the client as well.
+"""
+
+import codecs
+import io
+import json
+import locale
+import os
+import socket
+import sys
+import threading
+import traceback
+
+from . import ctx, log, FatalError, osinfo, recursion
+from .config import CONFIG_FILE_NAMES
+from .shell import clear_env_cache, READ_SIZE
+from .noop import manifest as noop_manifest, _module_files
+from .main import load, initialize, execute_commands, retrieve_verbosity, retrieve_pretty_printing, \
+    retrieve_grouped_output, FILE_NAMES
+
+
+SERVER_SOCKET = 'wasp.sock'
+"""
+Name of the unix socket in the build directory on which the server listens.
+"""
+
+SERVER_IDLE_TIMEOUT = 3 * 3600
+"""
+Time in seconds after which an idle server exits.
+"""
+
+OUTPUT_TIMEOUT = 1
+"""
+Time in seconds the server waits for the output of child processes which still
+run after a request has been handled (e.g. processes started in the background).
+"""
+
+
+class _StreamWriter(io.TextIOBase):
+    """
+    Replaces ``sys.stdout`` or ``sys.stderr`` while a request is handled and forwards
+    everything written to the client. If the client disconnects, the output is dropped.
+    """
+    def __init__(self, connection, name, tty):
+        super().__init__()
+        self._connection = connection
+        self._name = name
+        self._tty = tty
+
+    @property
+    def encoding(self):
+        return 'UTF-8'
+
+    def isatty(self):
+        return self._tty
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        self._connection.send({self._name: s})
+        return len(s)
+
+
+class _OutputForwarder(object):
+    """
+    Context manager which redirects the file descriptor ``fd`` of the server to a pipe
+    while a request is handled, s.t. the output of child processes inheriting it (e.g.
+    shell commands whose output is not captured) is forwarded to the client as well.
+    The output is sent as soon as it has been read from the pipe.
+    """
+    def __init__(self, connection, name, fd):
+        self._connection = connection
+        self._name = name
+        self._fd = fd
+        self._saved = None
+        self._thread = None
+
+    def __enter__(self):
+        read_fd, write_fd = os.pipe()
+        self._saved = os.dup(self._fd)
+        os.dup2(write_fd, self._fd)
+        os.close(write_fd)
+        self._thread = threading.Thread(target=self._forward, args=(read_fd,), daemon=True)
+        self._thread.start()
+        return self
+
+    def _forward(self, read_fd):
+        decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors='replace')
+        try:
+            while True:
+                data = os.read(read_fd, READ_SIZE)
+                text = decoder.decode(data, final=not data)
+                if text != '':
+                    self._connection.send({self._name: text})
+                if not data:
+                    return
+        finally:
+            os.close(read_fd)
+
+    def __exit__(self, *args):
+        os.dup2(self._saved, self._fd)
+        os.close(self._saved)
+        # the pipe is closed as soon as all child processes writing to it have exited
+        self._thread.join(OUTPUT_TIMEOUT)
+
+
+class _Connection(object):
+    """
+    Connection to a client. Sending messages is thread-safe, since tasks print
+    their output from multiple threads.
+    """
+    def __init__(self, sock):
+        self._sock = sock
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def receive(self):
+        with self._sock.makefile('rb') as f:
+            line = f.readline()
+        if not line:
+            return None
+        return json.loads(line.decode('UTF-8'))
+
+    def send(self, msg):
+        data = (json.dumps(msg) + '\n').encode('UTF-8')
+        with self._lock:
+            if self._closed:
+                return
+            try:
+                self._sock.sendall(data)
+            except OSError:
+                # the client has gone away
+                self._closed = True
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self._sock.close()
+
+
+def _stat(fpath):
+    try:
+        st = os.stat(fpath)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class Server(object):
+    """
+    Serves the requests of ``wasp`` invocations after the build scripts have been loaded
+    and the context has been initialized (see :func:`wasp.main.load`).
+    Requests are handled one after another, since they share the global context.
+
+    :param topdir: The top directory of the project.
+    :param loaded_files: The build scripts which have been loaded.
+    """
+    def __init__(self, topdir, loaded_files):
+        self._topdir = topdir
+        self._path = os.path.relpath(ctx.builddir.join(SERVER_SOCKET).path, topdir)
+        # if one of these files changes, the server is restarted
+        watched = set(os.path.abspath(f) for f in loaded_files)
+        for dirname in set(os.path.dirname(f) for f in watched):
+            watched.update(os.path.join(dirname, fname) for fname in FILE_NAMES)
+        watched.update(os.path.join(topdir, fname) for fname in CONFIG_FILE_NAMES)
+        # tools, extensions and wasp itself as well as the files registered by the build scripts
+        watched.update(_module_files(os.path.abspath(topdir)))
+        watched.update(os.path.abspath(f) for f in noop_manifest.files)
+        self._watched = {f: _stat(f) for f in watched}
+        self._arguments = dict(ctx.arguments)
+        self._environ = dict(os.environ)
+        self._argv = list(sys.argv)
+        self._cache_stamp = self._stamp_cache()
+        self._sock = None
+
+    def _stamp_cache(self):
+        return [_stat(f) for f in ctx.cache.storage.files]
+
+    def _scripts_changed(self):
+        return any(_stat(f) != stamp for f, stamp in self._watched.items())
+
+    def _bind(self):
+        if os.path.exists(self._path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self._path)
+                raise FatalError('A wasp server is already running on `{0}`.'.format(self._path))
+            except ConnectionRefusedError:
+                # stale socket of a server which has been killed
+                os.remove(self._path)
+            finally:
+                probe.close()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self._path)
+        self._sock.listen(8)
+        self._sock.settimeout(SERVER_IDLE_TIMEOUT)
+
+    def _unbind(self):
+        if self._sock is None:
+            return
+        self._sock.close()
+        self._sock = None
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+    def serve_forever(self):
+        """
+        Handles requests until the server is interrupted or idle for
+        :data:`SERVER_IDLE_TIMEOUT` seconds.
+        """
+        self._bind()
+        log.info(log.format_info('Server listening on `{0}`.'.format(self._path)))
+        try:
+            while True:
+                try:
+                    sock, _ = self._sock.accept()
+                except socket.timeout:
+                    log.info(log.format_info('Server has been idle, exiting.'))
+                    return True
+                sock.settimeout(None)
+                connection = _Connection(sock)
+                try:
+                    restart = self._handle(connection)
+                finally:
+                    connection.close()
+                if restart:
+                    self._restart()
+        except KeyboardInterrupt:
+            return True
+        finally:
+            self._unbind()
+
+    def _restart(self):
+        log.info(log.format_info('Build scripts have changed, restarting server.'))
+        os.environ.clear()
+        os.environ.update(self._environ)
+        argv = getattr(sys, 'orig_argv', [sys.executable] + self._argv)
+        os.execv(sys.executable, argv)
+
+    def _handle(self, connection):
+        request = connection.receive()
+        if request is None:
+            return False
+        if self._scripts_changed():
+            # stop listening first, s.t. the client does not reconnect to this process
+            self._unbind()
+            connection.send({'restart': True})
+            return True
+        if self._cache_stamp != self._stamp_cache():
+            # the cache has been written by another process
+            ctx.load()
+        tty = request.get('tty', [False, False])
+        stdout, stderr, argv = sys.stdout, sys.stderr, sys.argv
+        sys.stdout = _StreamWriter(connection, 'stdout', tty[0])
+        sys.stderr = _StreamWriter(connection, 'stderr', tty[1])
+        sys.argv = argv[:1] + request['argv']
+        os.environ.clear()
+        os.environ.update(request['env'])
+        clear_env_cache()
+        exit_code = 1
+        # child processes write to the file descriptors of the server
+        with _OutputForwarder(connection, 'stdout', 1), _OutputForwarder(connection, 'stderr', 2):
+            try:
+                ctx.env.load_from_env()
+                ctx.reset()
+                noop_manifest.reset()
+                ctx.arguments.clear()
+                ctx.arguments.update(self._arguments)
+                log.configure(verbosity=retrieve_verbosity(), pretty=retrieve_pretty_printing(),
+                              grouped=retrieve_grouped_output(ctx.config))
+                if ctx.config.verbosity is not None and log.verbosity == log.DEFAULT:
+                    log.configure(verbosity=ctx.config.verbosity, pretty=ctx.config.pretty)
+                exit_code = 0 if execute_commands() else 1
+            except SystemExit as e:
+                # e.g. argparse exits if invalid options are given or --help is passed
+                exit_code = e.code if isinstance(e.code, int) else 1
+            except FatalError as e:
+                e.print()
+            except Exception as e:
+                traceback.print_exception(None, e, e.__traceback__)
+            finally:
+                ctx.save()
+                recursion.index.save()
+                self._cache_stamp = self._stamp_cache()
+                sys.stdout, sys.stderr, sys.argv = stdout, stderr, argv
+                os.environ.clear()
+                os.environ.update(self._environ)
+        connection.send({'exit': exit_code})
+        return False
+
+
+def serve(topdir):
+    """
+    Loads the build scripts in ``topdir`` and serves the requests of subsequent
+    invocations of ``wasp``.
+
+    :return: True if the server exited normally, False otherwise.
+    """
+    if osinfo.windows:
+        log.fatal('`--server` is not supported on windows.')
+        return False
+    try:
+        loaded_files = load(topdir)
+        if loaded_files is None:
+            log.fatal('No build file found. Exiting.')
+            return True
+        initialize(loaded_files)
+        return Server(topdir, loaded_files).serve_forever()
+    except FatalError as e:
+        e.print()
+        return False
+    except Exception as e:
+        traceback.print_exception(None, e, e.__traceback__)
+        return False
@@ -1,21 +1,62 @@
+import codecs
+import locale
+import mmap
 import os
+import re
+import selectors
+import signal
 import sys
-from threading import Thread
+import threading
+from io import IncrementalNewlineDecoder
 
-from .task import Task
+from .task import Task, TaskFailedError
 from .node import FileNode
 from .argument import find_argumentkeys_in_string
 from .logging import LogStr
-from .fs import Directory, top_dir, Path
+from .fs import Directory, top_dir, Path, relocatable_path
 from . import ctx, osinfo, log
-from .util import UnusedArgFormatter
+from .util import UnusedArgFormatter, checksum
 
+from collections import deque
 from collections.abc import Iterable
-from subprocess import Popen, PIPE, call
+from subprocess import Popen, PIPE, DEVNULL, TimeoutExpired, call
 import shlex
-from time import sleep
+from time import monotonic
+
+OUTPUT_LIMIT = 256 * 1024
+"""
+Default number of characters of the output of a shell command kept in
+memory per stream (see :class:`ProcessOut`).
+"""
+
+LOG_DIR = 'logs'
+"""
+Directory in the build directory containing the output of shell commands which
+exceeded :data:`OUTPUT_LIMIT`.
+"""
+
+READ_SIZE = 65536
+"""
+Maximum number of bytes read from the output of a process at once.
+"""
+
+COMMAND_NOT_FOUND = 127
+"""
+Exit code returned if a command given as list of arguments cannot be executed.
+"""
+
+SINGLE_KEY_RE = re.compile(r'^\{(?P<key>\w+)\}$')
+
+_env_cache = {}
+
+
+def clear_env_cache():
+    """
+    Clears the environments created for shell tasks, which must be called
+    if ``os.environ`` changes (e.g. between requests handled by the server).
+    """
+    _env_cache.clear()
 
-POLL_TIMEOUT = 0.05  # s
 
 INVALID_ENV_ARGUMENT = 'Argument `env` for shell must be in the format of ' \
                        '{"name": "value"} or {"name": ["list", "of", "values"]}'
@@ -26,13 +67,19 @@ class ShellTask(Task):
     Task for running commands on the shell. It provides the following features:
 
         * Setting a command (using the ``cmd`` field) and injecting source and target values into it.
+        * Running the command without a shell if it is given as a list of arguments.
         * Automatic formatting of the command to be executed.
         * Setting the working directory from which the command should be executed.
         * Specially formatted logging (depending on whether pretty printing is activated)
+        * Limiting the run time of the command using the ``timeout`` argument (in seconds,
+          only if pretty printing is activated)
+        * Printing the output line by line as soon as it is received (unless ``--grouped``
+          is given) and failing as soon as a line matches the regular expression given
+          as ``fail_pattern`` argument (only if pretty printing is activated)
 
     :param sources: Source nodes consumed by the task.
     :param targets: Target nodes produced by the task.
-    :param cmd: Command string. May also be set by overriding the ``cmd`` attribute.
+    :param cmd: Command string or list of arguments. May also be set by overriding the ``cmd`` attribute.
     :param always: Determines whether the task should be executed regardless of whether targets
         or sources have changed.
     :param cwd: Set the working directory from which the shell command should be run.
@@ -48,6 +95,7 @@ class ShellTask(Task):
         self._commandstring = None
         super().__init__(sources=sources, targets=targets, always=always)
         self._pretty = pretty
+        self._cacheable = True
 
     @property
     def commandstring(self):
@@ -64,6 +112,18 @@ class ShellTask(Task):
         """
         return self._out
 
+    @property
+    def log_path(self):
+        """
+        Returns the path of the file in ``<builddir>/logs`` to which the complete output
+        of the shell command is written if it is too large to be kept in memory.
+        Use ``self.out.log`` to check whether the file has been written.
+        """
+        if ctx.builddir is None or self._commandstring is None:
+            return None
+        name = checksum('{0}:{1}'.format(self._cwd, self._commandstring).encode('UTF-8'))
+        return ctx.builddir.join(LOG_DIR, name + '.log').path
+
     @property
     def cwd(self):
         """
@@ -74,10 +134,52 @@ class ShellTask(Task):
     @property
     def cmd(self):
         """
-        Returns the shell command to be executed.
+        Returns the command to be executed. If it is a string, it is executed by the shell.
+        If it is a list of arguments, the process is spawned directly, which avoids
+        starting a shell for each command. Arguments consisting of a single key
+        (e.g. ``'{src}'``) are replaced by all values of the key (see :func:`_process_argv`),
+        other keys are replaced by the values joined with spaces.
         """
         return self._cmd
 
+    def fingerprint(self):
+        """
+        Extends :func:`wasp.task.Task.fingerprint` with the command template
+        and the working directory.
+        """
+        data = '{0}:{1}:{2}'.format(super().fingerprint(), self.cmd, relocatable_path(self._cwd))
+        return checksum(data.encode('UTF-8'))
+
+    def cached_output(self):
+        """
+        Extends :func:`wasp.task.Task.cached_output` with the command string
+        and the output of the shell command.
+        """
+        ret = super().cached_output()
+        ret['commandstring'] = self._commandstring
+        if self._out is not None:
+            ret['stdout'] = self._out.stdout
+            ret['stderr'] = self._out.stderr
+        return ret
+
+    def restore_output(self, output):
+        """
+        Restores the command string and replays the output which was
+        printed when the shell command was run.
+        """
+        super().restore_output(output)
+        self._commandstring = output.get('commandstring')
+        if 'stdout' not in output:
+            return
+        self._out = ProcessOut()
+        if output['stdout'] != '':
+            self._out.write(output['stdout'])
+        if output['stderr'] != '':
+            self._out.write(output['stderr'], stdout=False)
+        self._out.finished()
+        if self._pretty:
+            self.printer.print(stdout=self._out.stdout, stderr=self._out.stderr, exit_code=0)
+
     def _finished(self, exit_code, out, err):
         """
         Called when the shell command has finished running. May be overridden
@@ -95,18 +197,8 @@ class ShellTask(Task):
         By default, this function injects 'SRC' with a list of all sources and 'TGT' with
         a list of all targets. Additionally each used argument is accessible by its key as well.
         """
-        src_list = []
-        for s in self.sources:
-            if isinstance(s, FileNode):
-                src_path = s.to_file().relative(self._cwd, skip_if_abs=True).path
-                src_list.append(src_path)
-        tgt_list = []
-        for t in self.targets:
-            if isinstance(t, FileNode):
-                tgt_path = t.to_file().relative(self._cwd, skip_if_abs=True).path
-                tgt_list.append(tgt_path)
-        src_str = ' '.join([quote(x) for x in src_list])
-        tgt_str = ' '.join([quote(x) for x in tgt_list])
+        src_str = ' '.join([quote(x) for x in self._file_paths(self.sources)])
+        tgt_str = ' '.join([quote(x) for x in self._file_paths(self.targets)])
         kw = {'src': src_str, 'tgt': tgt_str}
         for key, arg in self.arguments.items():
             unquoted = None
@@ -129,19 +221,68 @@ class ShellTask(Task):
                 kw[key.lower() + '_noquote'] = unquoted
         return kw
 
+    def _file_paths(self, nodes):
+        """
+        Returns the paths of the file nodes in ``nodes`` relative to the working directory.
+        """
+        return [n.to_file().relative(self._cwd, skip_if_abs=True).path for n in nodes if isinstance(n, FileNode)]
+
+    def _process_argv(self):
+        """
+        Creates a dict of {'key': ['list', 'of', 'values']} to be used for formatting
+        a command given as list of arguments. Equivalent to ``self._process_args()``,
+        except that the values are neither quoted nor joined. Empty values are dropped.
+        """
+        kw = {'src': self._file_paths(self.sources), 'tgt': self._file_paths(self.targets),
+              'builddir': [str(ctx.builddir)], 'topdir': [str(ctx.topdir)]}
+        for key, arg in self.arguments.items():
+            if isinstance(arg.value, Path):
+                value = [arg.value.path]
+            elif arg.type == str:
+                value = [arg.value]
+            elif issubclass(arg.type, Iterable):
+                if not all(isinstance(x, str) for x in arg.value):
+                    continue
+                value = list(arg.value)
+            else:
+                continue
+            kw[key.replace('-', '_').lower()] = [x for x in value if x != '']
+        return kw
+
     def require_all(self):
         """
         Automatically calls ``self.require()`` on all keys in ``self.cmd``.
         """
-        for argname in find_argumentkeys_in_string(self.cmd):
-            self.require(argname)
+        cmd = [self.cmd] if isinstance(self.cmd, str) else self.cmd
+        for item in cmd:
+            for argname in find_argumentkeys_in_string(item):
+                self.require(argname)
         return self
 
+    def _format_argv(self):
+        """
+        Formats ``self.cmd`` given as list of arguments by calling ``self._process_argv()``.
+        """
+        kw = self._process_argv()
+        joined = None
+        ret = []
+        for item in self.cmd:
+            m = SINGLE_KEY_RE.match(item)
+            if m is not None:
+                ret.extend(kw.get(m.group('key'), []))
+                continue
+            if joined is None:
+                joined = {k: ' '.join(v) for k, v in kw.items()}
+            ret.append(UnusedArgFormatter().format(item, **joined))
+        return ret
+
     def _format_cmd(self):
         """
         Formats ``self.cmd`` into an executable string by calling
         ``self._prcess_args()``.
         """
+        if not isinstance(self.cmd, str):
+            return ' '.join(quote(x) for x in self._format_argv())
         kw = self._process_args()
         s = UnusedArgFormatter().format(self.cmd, **kw)
         post_format_repl = {
@@ -151,14 +292,24 @@ class ShellTask(Task):
         return UnusedArgFormatter().format(s, **post_format_repl)
 
     def _make_env(self):
+        """
+        Returns the environment of the process or None for inheriting the environment
+        of ``wasp``. The environment is only created once for each distinct combination
+        of the ``env`` and ``clearenv`` arguments (see :func:`clear_env_cache`).
+        """
         envarg = self.arguments.value('env', default=None)
         if envarg is None:
-            return os.environ
-        if self.arguments.value('clearenv', False):
+            return None
+        assert isinstance(envarg, dict), INVALID_ENV_ARGUMENT
+        clearenv = bool(self.arguments.value('clearenv', False))
+        key = (clearenv, tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in envarg.items())))
+        env = _env_cache.get(key)
+        if env is not None:
+            return env
+        if clearenv:
             env = {}
         else:
-            env = dict(os.environ.copy().items())
-        assert isinstance(envarg, dict), INVALID_ENV_ARGUMENT
+            env = dict(os.environ)
         for k, v in envarg.items():
             assert isinstance(k, str) and (isinstance(v, list) or isinstance(v, str)), INVALID_ENV_ARGUMENT
             if isinstance(v, list):
@@ -168,21 +319,42 @@ class ShellTask(Task):
                 # #and windows is case insensitive
                 k = k.upper()
             env[k] = v
+        _env_cache[key] = env
         return env
 
     def _run(self):
         """
         Formats, executes the shell command and postprocesses its output.
         """
-        self._commandstring = self._format_cmd()
+        if isinstance(self.cmd, str):
+            cmd = self._commandstring = self._format_cmd()
+        else:
+            cmd = self._format_argv()
+            self._commandstring = ' '.join(quote(x) for x in cmd)
         if self._pretty:
-            exit_code, out = run(self._commandstring, cwd=self._cwd, env=self._make_env())
+            # with a lower verbosity, the output is only printed if the command fails
+            stream = not self.log.grouped and self.log.verbosity >= self.log.WARN
+            exit_code, out = run(cmd, timeout=self.arguments.value('timeout', None),
+                                 cwd=self._cwd, env=self._make_env(), log=self.log_path,
+                                 on_line=self.printer.line if stream else None,
+                                 fail_pattern=self.arguments.value('fail_pattern', None))
             self._out = out
             self._finished(exit_code, out.stdout, out.stderr)
-            self.printer.print(stdout=out.stdout, stderr=out.stderr,
-                               exit_code=exit_code)
+            if stream:
+                # the output has already been printed
+                self.printer.print(exit_code=exit_code)
+            else:
+                self.printer.print(stdout=out.stdout, stderr=out.stderr,
+                                   exit_code=exit_code)
         else:
-            exit_code = call(self._commandstring, cwd=self._cwd, env=self._make_env(), shell=True)
+            if self.arguments.value('fail_pattern', None) is not None:
+                raise TaskFailedError('Argument `fail_pattern` requires the output of '
+                                      'the command to be captured, i.e. pretty=True.')
+            timeout = self.arguments.value('timeout', None)
+            exit_code = run_attached(cmd, timeout=timeout, cwd=self._cwd, env=self._make_env())
+            if exit_code is None:
+                self.log.fatal(self.log.format_fail(self._commandstring,
+                                                    'Process killed: timeout of {0}s expired.'.format(timeout)))
             self._finished(exit_code, None, None)
 
     def use_arg(self, arg):
@@ -232,10 +404,43 @@ class ShellTaskPrinter(object):
 
     def __init__(self, task):
         self._task = task
+        self._prefix = None
+
+    @property
+    def prefix(self):
+        """
+        Returns the string identifying the task in each line of its output if the output
+        is printed as soon as it is received. By default, the name of the first target
+        file or the name of the executable.
+        """
+        if self._prefix is None:
+            t = self._task
+            files = [n for n in t.targets if isinstance(n, FileNode)]
+            if len(files) > 0:
+                self._prefix = files[0].to_file().basename
+            else:
+                words = (t.commandstring or '').split()
+                self._prefix = os.path.basename(words[0]) if len(words) > 0 else ''
+        return self._prefix
+
+    def line(self, line, stdout=True):
+        """
+        Called for each line of the output of the shell command as soon as it has
+        been received, unless the output is grouped (see ``--grouped``).
+
+        :param line: The line without line ending.
+        :param stdout: True if the line was printed to ``stdout``, False for ``stderr``.
+        """
+        log = self._task.log
+        if stdout:
+            log.info(log.color('[{0}]  '.format(self.prefix), fg='cyan') + line)
+        else:
+            log.warn(log.color('[{0}]  '.format(self.prefix), fg='magenta') + line)
 
     def print(self, stdout='', stderr='', exit_code=0):
         """
-        Called after the execution of the shell task has finished.
+        Called after the execution of the shell task has finished. If the output
+        has been printed line by line, ``stdout`` and ``stderr`` are empty.
 
         :param stdout: The string which was printed to ``stdout``.
         :param stderr: The string which was printed to ``stderr``.
@@ -269,19 +474,85 @@ def shell(cmd, sources=None, targets=None, always=False, cwd=None, pretty=True):
     return ShellTask(sources=sources, targets=targets, cmd=cmd, always=always, cwd=cwd, pretty=pretty)
 
 
+class _OutputBuffer(object):
+    """
+    Keeps the first and the last lines written to it, each part being limited
+    to ``size`` characters. Lines in between are dropped and counted. If ``size``
+    is None, all lines are kept.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._head = []
+        self._head_size = 0
+        self._tail = deque()
+        self._tail_size = 0
+        self.omitted = 0
+
+    def full(self, length):
+        """
+        Returns True if lines must be dropped for storing a line with ``length`` characters.
+        """
+        if self._size is None:
+            return False
+        return self._head_size + self._tail_size + length > 2 * self._size
+
+    def append(self, msg, tp):
+        if self._size is None:
+            self._head.append((msg, tp))
+            return
+        if len(msg) > self._size:
+            msg = msg[:self._size] + ' [...]'
+        length = len(msg) + 1
+        if len(self._tail) == 0 and self._head_size + length <= self._size:
+            self._head.append((msg, tp))
+            self._head_size += length
+            return
+        self._tail.append((msg, tp))
+        self._tail_size += length
+        while self._tail_size > self._size and len(self._tail) > 1:
+            dropped, _ = self._tail.popleft()
+            self._tail_size -= len(dropped) + 1
+            self.omitted += 1
+
+    def lines(self, marker):
+        """
+        Returns the stored lines. If lines have been dropped, ``marker``
+        is formatted with their number and inserted in their place.
+        """
+        ret = [msg for msg, _ in self._head]
+        if self.omitted > 0:
+            ret.append(marker.format(self.omitted))
+        ret.extend(msg for msg, _ in self._tail)
+        return ret
+
+
 class ProcessOut(object):
     """
     Storage object for returning the ouptput (stdout and stderr) of
     a task.
+
+    If ``log`` is given, only the first and the last lines of the output are kept in
+    memory, at most ``limit`` characters for ``stdout``, ``stderr`` and the merged output
+    each. The complete output is written to ``log`` as soon as the limit is exceeded.
+    It can be read using :func:`map_log`. Otherwise, the complete output is kept in memory.
+
+    :param limit: Maximum number of characters kept in memory per stream if ``log`` is given.
+    :param log: Path of the file to which the complete output is written if it
+        exceeds ``limit``, or None.
     """
     ERR = 1
     OUT = 0
-
-    def __init__(self):
-        self._out = []
-        self._stdout_cache = None
-        self._stderr_cache = None
-        self._merged_cache = None
+    MERGED = None
+
+    def __init__(self, limit=OUTPUT_LIMIT, log=None):
+        self._limit = limit
+        # without a log, dropped lines could not be recovered
+        size = limit // 2 if log is not None else None
+        self._buffers = {tp: _OutputBuffer(size) for tp in (self.OUT, self.ERR, self.MERGED)}
+        self._log = log
+        self._log_file = None
+        self._cache = {}
         self._finished = False
 
     def write(self, msg, stdout=True):
@@ -291,84 +562,310 @@ class ProcessOut(object):
         :param msg: Message as str.
         :param stdout: True if the message belongs to stdout, False otherwise (stderr).
         """
-        if stdout:
-            self._out.append((msg, self.OUT))
-        else:
-            self._out.append((msg, self.ERR))
+        tp = self.OUT if stdout else self.ERR
+        merged = self._buffers[self.MERGED]
+        if self._log is not None and self._log_file is None \
+                and (merged.full(len(msg) + 1) or len(msg) > self._limit // 2):
+            self._spill()
+        if self._log_file is not None:
+            self._log_file.write(msg + '\n')
+        self._buffers[tp].append(msg, tp)
+        merged.append(msg, tp)
+
+    def _spill(self):
+        # nothing has been dropped so far, thus the merged buffer contains the complete output
+        os.makedirs(os.path.dirname(os.path.abspath(self._log)), exist_ok=True)
+        self._log_file = open(self._log, 'w', encoding='UTF-8', errors='replace', newline='\n')
+        for msg in self._buffers[self.MERGED].lines(''):
+            self._log_file.write(msg + '\n')
 
     def finished(self):
         """
         Called if the shell process has finished executing.
         """
         self._finished = True
+        if self._log_file is not None:
+            self._log_file.close()
+
+    @property
+    def log(self):
+        """
+        Returns the path of the file containing the complete output or None
+        if the output has not exceeded the limit.
+        """
+        return self._log if self._log_file is not None else None
+
+    def map_log(self):
+        """
+        Returns a read-only memory-mapped view (:class:`mmap.mmap`) of the file
+        containing the complete output (see :attr:`log`) or None if it does not exist.
+        The caller must close the returned object.
+        """
+        if self.log is None:
+            return None
+        with open(self.log, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def truncated(self):
+        """
+        True if lines of the output have been dropped from memory.
+        """
+        return self._buffers[self.MERGED].omitted > 0
+
+    def _joined(self, tp):
+        if self._finished and tp in self._cache:
+            return self._cache[tp]
+        marker = '[... {0} lines omitted]'
+        if self.log is not None:
+            marker = '[... {0} lines omitted, see ' + self.log.replace('{', '{{').replace('}', '}}') + ']'
+        ret = '\n'.join(self._buffers[tp].lines(marker))
+        self._cache[tp] = ret
+        return ret
 
     @property
     def stdout(self):
         """
         Returnt the ``stdout`` output of the process as string.
         """
-        if self._finished and self._stdout_cache is not None:
-            return self._stdout_cache
-        self._stdout_cache = '\n'.join(filter(lambda x: x is not None, [x if tp == self.OUT else None for x, tp in self._out]))
-        return self._stdout_cache
+        return self._joined(self.OUT)
 
     @property
     def stderr(self):
         """
         Returnt the ``stderr`` output of the process as string.
         """
-        if self._finished and self._stderr_cache is not None:
-            return self._stderr_cache
-        self._stderr_cache = '\n'.join(filter(lambda x: x is not None, [x if tp == self.ERR else None for x, tp in self._out]))
-        return self._stderr_cache
+        return self._joined(self.ERR)
 
     @property
     def merged(self):
         """
         Return the ``stdout`` and ``stderr`` output of the process merged into one string.
         """
-        if self._finished and self._merged_cache is not None:
-            return self._merged_cache
-        self._merged_cache = '\n'.join(x for x, tp in self._out)
-        return self._merged_cache
+        return self._joined(self.MERGED)
+
 
+class _LineReader(object):
+    """
+    Decodes the output of a process incrementally and writes complete lines to a
+    :class:`ProcessOut` object. Line endings are translated as in text mode.
+    Each line is passed to ``on_line`` and checked against ``fail_pattern`` (see :func:`run`).
+    """
 
-def run(cmd, timeout=100, cwd=None, env=None):
+    def __init__(self, out, stdout, on_line=None, fail_pattern=None):
+        decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors='replace')
+        self._decoder = IncrementalNewlineDecoder(decoder, translate=True)
+        self._out = out
+        self._stdout = stdout
+        self._on_line = on_line
+        self._fail_pattern = fail_pattern
+        self._pending = ''
+        self.matched = False
+
+    def write(self, line):
+        self._out.write(line, stdout=self._stdout)
+        if self._on_line is not None:
+            self._on_line(line, self._stdout)
+        if self._fail_pattern is not None and self._fail_pattern.search(line) is not None:
+            self.matched = True
+
+    def feed(self, data, final=False):
+        lines = (self._pending + self._decoder.decode(data, final=final)).split('\n')
+        self._pending = lines.pop()
+        for line in lines:
+            self.write(line)
+        if final and self._pending != '':
+            self.write(self._pending)
+            self._pending = ''
+
+
+def _capture(process, readers, deadline):
+    """
+    Reads ``stdout`` and ``stderr`` of ``process`` until both are closed, without
+    polling. Returns False if ``deadline`` expired or a line matched the fail
+    pattern before.
+    """
+    if osinfo.windows:
+        # pipes cannot be used with selectors on windows, thus the output is
+        # only available once the process has finished
+        try:
+            stdout, stderr = process.communicate(timeout=None if deadline is None else max(0, deadline - monotonic()))
+        except TimeoutExpired:
+            return False
+        readers[process.stdout].feed(stdout, final=True)
+        readers[process.stderr].feed(stderr, final=True)
+        return not any(reader.matched for reader in readers.values())
+    with selectors.DefaultSelector() as selector:
+        for f in readers.keys():
+            selector.register(f, selectors.EVENT_READ)
+        while len(selector.get_map()) > 0:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    return False
+            for key, _ in selector.select(timeout):
+                data = os.read(key.fd, READ_SIZE)
+                reader = readers[key.fileobj]
+                reader.feed(data, final=len(data) == 0)
+                if reader.matched:
+                    return False
+                if len(data) == 0:
+                    selector.unregister(key.fileobj)
+    return True
+
+
+_processes = set()
+_processes_lock = threading.Lock()
+
+
+def _popen(cmd, session=True, **kw):
+    """
+    Spawns ``cmd``. If ``session`` is True, the process is started in a new session
+    (on posix systems), s.t. it can be killed together with all its children (see :func:`_kill`).
     """
-    Executes a command ``cmd`` with the given ``timeout``.
+    # without a shell, the process is spawned using vfork() (or posix_spawn() if possible)
+    process = Popen(cmd, shell=isinstance(cmd, str), start_new_session=session and not osinfo.windows, **kw)
+    if session:
+        with _processes_lock:
+            _processes.add(process)
+    return process
+
+
+def _kill(process):
+    """
+    Kills ``process`` and all processes it has started.
+    """
+    with _processes_lock:
+        session = process in _processes
+    if not session:
+        process.kill()
+        return
+    if osinfo.windows:
+        try:
+            call(['taskkill', '/F', '/T', '/PID', str(process.pid)], stdout=DEVNULL, stderr=DEVNULL)
+        except OSError:
+            pass
+        process.kill()
+        return
+    try:
+        # the process has not been waited for, thus its id cannot have been reused
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
 
-    :param cmd: The command to be executed.
-    :param timeout: The maximum time the command can take before it is interrupted.
+
+def _wait(process):
+    exit_code = process.wait()
+    with _processes_lock:
+        _processes.discard(process)
+    return exit_code
+
+
+def interrupt_processes():
+    """
+    Sends ``SIGINT`` to the process groups of all running commands. Since commands are
+    run in separate sessions, they are not interrupted by the terminal if ``wasp`` is interrupted.
+    """
+    if osinfo.windows:
+        # the processes share the console of wasp and are interrupted as well
+        return
+    with _processes_lock:
+        processes = list(_processes)
+    for process in processes:
+        if process.returncode is not None:
+            continue
+        try:
+            os.killpg(process.pid, signal.SIGINT)
+        except OSError:
+            pass
+
+
+def run_attached(cmd, timeout=None, cwd=None, env=None):
+    """
+    Executes a command ``cmd`` without capturing its output, i.e. the command may
+    interact with the terminal. If a ``timeout`` is given, the command is run in
+    a new session and killed together with its children once the timeout expires.
+
+    :return: The exit code of the process or None if it has been killed.
+    """
+    process = _popen(cmd, session=timeout is not None, cwd=cwd, env=env)
+    try:
+        process.wait(timeout=timeout)
+    except TimeoutExpired:
+        _kill(process)
+        _wait(process)
+        return None
+    except BaseException:
+        _kill(process)
+        _wait(process)
+        raise
+    return _wait(process)
+
+
+def run(cmd, timeout=None, cwd=None, env=None, log=None, on_line=None, fail_pattern=None):
+    """
+    Executes a command ``cmd`` with the given ``timeout``. The output is captured
+    as soon as it is written and the function returns as soon as the process has
+    exited and closed its output.
+
+    :param cmd: The command to be executed, either as string which is executed by
+        the shell or as list of arguments, which is spawned directly.
+    :param timeout: The maximum time in seconds the command can take before it is
+        killed or None for no limit.
     :param cwd: The working directory from which the command should be executed.
-    :return: Tuple of ``exit_code`` and :class:`ProcessOut`.
+    :param env: The environment variables of the process or None for inheriting them.
+    :param log: File to which the complete output is written if it is too large
+        to be kept in memory (see :class:`ProcessOut`). If None, the complete output
+        is kept in memory.
+    :param on_line: Function called as ``on_line(line, stdout)`` for each line of
+        the output as soon as it has been received, e.g. for printing it.
+    :param fail_pattern: Regular expression (as string or compiled). If a line of the
+        output matches, the process is killed.
+
+    The process is started in a new session and if it is killed, all processes
+    it has started are killed as well.
+
+    :return: Tuple of ``exit_code`` and :class:`ProcessOut`. ``exit_code`` is None
+        if the process has been killed because the timeout expired or because
+        its output matched ``fail_pattern``.
     """
-    exit_code = None
-    out = ProcessOut()
+    out = ProcessOut(log=log)
+    deadline = None if timeout is None else monotonic() + timeout
+    if isinstance(fail_pattern, str):
+        fail_pattern = re.compile(fail_pattern)
+    stderr = _LineReader(out, False, on_line=on_line)
     try:
-        process = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True, cwd=cwd, universal_newlines=True, env=env)
-
-        def read_stdout():
-            while process.poll() is None:
-                sleep(POLL_TIMEOUT)
-                for line in process.stdout:
-                    out.write(line.strip('\n'), stdout=True)
-
-        def read_stderr():
-            while process.poll() is None:
-                sleep(POLL_TIMEOUT)
-                for line in process.stderr:
-                    out.write(line.strip('\n'), stdout=False)
-
-        stdout_thread = Thread(target=read_stdout)
-        stdout_thread.start()
-        stderr_thread = Thread(target=read_stderr)
-        stderr_thread.start()
-        stdout_thread.join()
-        stderr_thread.join()
+        process = _popen(cmd, stdout=PIPE, stderr=PIPE, cwd=cwd, env=env)
+    except OSError as e:
+        if isinstance(cmd, str):
+            raise
+        # equivalent to the shell failing to execute the command
+        stderr.write(str(e))
+        out.finished()
+        return COMMAND_NOT_FOUND, out
+    readers = {process.stdout: _LineReader(out, True, on_line=on_line, fail_pattern=fail_pattern),
+               process.stderr: _LineReader(out, False, on_line=on_line, fail_pattern=fail_pattern)}
+    try:
+        try:
+            completed = _capture(process, readers, deadline)
+        except BaseException:
+            _kill(process)
+            _wait(process)
+            raise
+        if not completed:
+            _kill(process)
+        exit_code = _wait(process)
+        if any(reader.matched for reader in readers.values()):
+            exit_code = None
+            stderr.write('Process failed: output matched `{0}`.'.format(fail_pattern.pattern))
+        elif not completed:
+            exit_code = None
+            stderr.write('Process killed: timeout of {0}s expired.'.format(timeout))
+    finally:
+        process.stdout.close()
+        process.stderr.close()
         out.finished()
-        exit_code = process.returncode
-    except TimeoutError:
-        pass
     return exit_code, out
 
 
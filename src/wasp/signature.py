@@ -1,7 +1,32 @@
-from .util import Serializable, checksum, json_checksum, lock
+from .util import Serializable, checksum, json_checksum, StripedLock
 from uuid import uuid4 as generate_uuid
 from . import factory
 import os
+import threading
+
+
+_refresh_locks = StripedLock()
+"""
+Locks protecting the update of the values of signatures in ``Signature.refresh()``.
+"""
+
+
+SIGNATUREDB_PREFIX = 'signaturedb/'
+"""
+The signatures of each namespace are stored in the cache prefix ``SIGNATUREDB_PREFIX + ns``,
+which is sharded by subproject (see :func:`wasp.cache.cache_shard`).
+"""
+
+SIGNATURE_RUNS_PREFIX = 'signature-runs/'
+"""
+For each namespace, the cache prefix ``SIGNATURE_RUNS_PREFIX + ns`` records the run
+in which a signature was last used. This allows finding stale signatures and outputs.
+"""
+
+RUN_COUNTS_PREFIX = 'run-counts'
+"""
+The cache prefix storing the number of complete runs of each namespace.
+"""
 
 
 def _get_ns(ns):
@@ -15,28 +40,47 @@ class SignatureProvider(object):
     """
     Storage class for :class:`Signature` objects, which stores
     the current values of the signatures.
+
+    Reading signatures does not acquire any lock. Modifications are
+    protected by a :class:`wasp.util.StripedLock` (selected based on the
+    key of the signature), such that threads finishing tasks concurrently
+    only contend if they happen to access the same stripe.
     """
 
     def __init__(self):
         self._d = {}
+        self._ns_lock = threading.Lock()
+        self._locks = StripedLock()
+        self._partial = set()
+
+    def mark_partial(self, ns=None):
+        """
+        Marks the run of namespace ``ns`` as partial, i.e. not all tasks were executed
+        (e.g. because only a specific target was requested). Partial runs are not counted
+        (see :data:`RUN_COUNTS_PREFIX`), s.t. the outputs which were not used are not
+        regarded as stale by the ``gc`` command.
+        """
+        self._partial.add(_get_ns(ns))
+
+    def _namespace(self, ns):
+        ns = _get_ns(ns)
+        d = self._d.get(ns)
+        if d is not None:
+            return d
+        with self._ns_lock:
+            return self._d.setdefault(ns, {})
 
-    @lock
     def add(self, signature, ns=None):
         """
         Adds a :class:`Signature` object to the storage.
         """
-        ns = _get_ns(ns)
-        if ns not in self._d:
-            self._d[ns] = {}
-        self._d[ns][signature.key] = signature
+        d = self._namespace(ns)
+        with self._locks(signature.key):
+            d[signature.key] = signature
 
     def get_signatures(self, ns=None):
-        ns = _get_ns(ns)
-        if ns not in self._d:
-            self._d[ns] = {}
-        return self._d[ns]
+        return self._namespace(ns)
 
-    @lock
     def get(self, key, default=None, ns=None):
         """
         Returns a :class:`Signature` object based on ``key`` or ``default`` if the
@@ -47,58 +91,85 @@ class SignatureProvider(object):
         :param ns: The namespace where the search should be conducted.
         :return: :class:`Signature` object or ``default``.
         """
-        ns = _get_ns(ns)
-        if ns not in self._d:
-            self._d[ns] = {}
-        return self._d[ns].get(key, default)
+        return self._namespace(ns).get(key, default)
+
+    def get_or_add(self, key, factory_fun, ns=None):
+        """
+        Returns the :class:`Signature` object with the given ``key``. If it does
+        not exist yet, it is created by calling ``factory_fun()`` and added to
+        the storage. It is guaranteed that only one signature object is created
+        per key, even if this function is called concurrently.
+        """
+        d = self._namespace(ns)
+        ret = d.get(key)
+        if ret is not None:
+            return ret
+        with self._locks(key):
+            ret = d.get(key)
+            if ret is None:
+                ret = factory_fun()
+                d[key] = ret
+        return ret
 
-    @lock
     def update(self, signature, ns=None):
         """
         Updates the signature with the new signature.
         """
-        ns = _get_ns(ns)
-        if ns not in self._d:
-            self._d[ns] = {}
-        self._d[ns][signature.key] = signature
+        self.add(signature, ns=ns)
 
     def save(self, cache):
         """
-        Saves this object to ``cache``.
-        """
-        newd = {}
-        for ns, signatures in self._d.items():
-            curd = {}
-            for key, signature in signatures.items():
-                curd[key] = signature
-            newd[ns] = curd
-        cache.prefix('signaturedb').update(newd)
+        Saves this object to ``cache``. Additionally, the run in which the
+        signatures were used is recorded (see :data:`SIGNATURE_RUNS_PREFIX`).
+        The signatures used by partial runs are recorded as used in the last
+        complete run (see :meth:`SignatureProvider.mark_partial`).
+        """
+        from .fs import relocatable_path
+        from .cache import cache_shard, shard_prefix
+        run_counts = cache.prefix(RUN_COUNTS_PREFIX)
+        for ns, signatures in list(self._d.items()):
+            shards = {}
+            for key, sig in list(signatures.items()):
+                shards.setdefault(cache_shard(key), {})[relocatable_path(key)] = sig
+            run = run_counts.get(ns, 0)
+            if ns not in self._partial:
+                run += 1
+                run_counts[ns] = run
+            for shard, newd in shards.items():
+                cache.prefix(shard_prefix(SIGNATUREDB_PREFIX + ns, shard)).update(newd)
+                cache.prefix(shard_prefix(SIGNATURE_RUNS_PREFIX + ns, shard)).update({key: run for key in newd.keys()})
+
+    def journal(self, cache, signature, ns=None):
+        """
+        Records ``signature`` in the journal of ``cache`` (see :meth:`wasp.cache.Cache.journal`),
+        s.t. it is restored as produced signature if ``wasp`` is interrupted before
+        the cache is saved.
+        """
+        from .fs import relocatable_path
+        from .cache import cache_shard, shard_prefix
+        prefix = shard_prefix(SIGNATUREDB_PREFIX + _get_ns(ns), cache_shard(signature.key))
+        cache.journal(prefix, relocatable_path(signature.key), signature)
 
-    @lock
     def invalidate_signature(self, key, ns=None):
         """
         Invalidates a signature with ``key`` in the given namespace ``ns``.
         The signature will be refreshed automatically when its value is
         queried next.
         """
-        ns = _get_ns(ns)
         if isinstance(key, Signature):
             key = key.key
         assert isinstance(key, str), 'The key must be given as either a subclass of signature or str'
-        if ns not in self._d:
-            self._d[ns] = {}
-        signature = self._d[ns].get(key)
+        signature = self._namespace(ns).get(key)
         if signature is None:
             return  # signature never read thus invalid
         signature.invalidate()
 
-    @lock
     def invalidate_all(self):
         """
         Invalidates all signatures in all namespaces.
         """
-        for nsv in self._d.values():
-            for sig in nsv.values():
+        for nsv in list(self._d.values()):
+            for sig in list(nsv.values()):
                 sig.invalidate()
 
     @property
@@ -112,60 +183,104 @@ class SignatureProvider(object):
 class ProducedSignatures(object):
     """
     Storage object which provides access to signatures that
-    were already produced by some task.
+    were already produced by some task. The signatures of each namespace
+    and subproject (see :func:`wasp.cache.cache_shard`) are only loaded
+    from the cache once they are accessed.
+    Reading signatures does not acquire any lock, see :class:`SignatureProvider`.
     """
     def __init__(self):
         self._signaturedb = {}
+        self._cache = None
+        self._ns_lock = threading.Lock()
+        self._locks = StripedLock()
 
     def load(self, cache):
         """
-        Loads the object from the ``cache``.
+        Loads the object from the ``cache``. The signatures of a namespace
+        are only read from the cache once the namespace is accessed.
         """
-        # copy the dict, so that the cache can be written to
-        self._signaturedb = dict(cache.prefix('signaturedb'))
+        self._signaturedb = {}
+        self._cache = cache
+
+    def _shard(self, ns, shard):
+        d = self._signaturedb.get((ns, shard))
+        if d is not None:
+            return d
+        from .cache import shard_prefix
+        with self._ns_lock:
+            d = self._signaturedb.get((ns, shard))
+            if d is not None:
+                return d
+            d = {}
+            prefix = shard_prefix(SIGNATUREDB_PREFIX + ns, shard)
+            if self._cache is not None and prefix in self._cache:
+                # copy the dict, so that the cache can be written to.
+                # the signatures are re-keyed, since the keys of file signatures
+                # are stored relative to symbolic roots (see wasp.fs.relocatable_path)
+                d = {sig.key: sig for sig in self._cache.prefix(prefix).values()}
+            self._signaturedb[(ns, shard)] = d
+            return d
+
+    def _namespace(self, ns, key):
+        from .cache import cache_shard
+        return self._shard(_get_ns(ns), cache_shard(key))
 
     def get_signatures(self, ns=None):
+        """
+        Returns a dict of all signatures of the namespace ``ns``.
+        This loads the signatures of all subprojects.
+        """
+        from .cache import split_shard
         ns = _get_ns(ns)
-        if ns not in self._signaturedb:
-            self._signaturedb[ns] = {}
-        return self._signaturedb[ns]
+        shards = set(shard for (signature_ns, shard) in self._signaturedb.keys() if signature_ns == ns)
+        if self._cache is not None:
+            for prefix in self._cache.prefixes():
+                name, shard = split_shard(prefix)
+                if name == SIGNATUREDB_PREFIX + ns:
+                    shards.add(shard)
+        ret = {}
+        for shard in shards:
+            ret.update(self._shard(ns, shard))
+        return ret
 
     def clear(self):
         """
         Clears all signatures of this object.
         """
         self._signaturedb.clear()
+        self._cache = None
 
-    @lock
     def get(self, key, ns=None):
         """
         Returns a :class:`Signature` object based on ``key``. If
         ``key`` does not exist in self, an empty signature is returned.
         """
-        ns = _get_ns(ns)
-        if ns not in self._signaturedb:
-            self._signaturedb[ns] = {}
-        ret = self._signaturedb[ns].get(key)
+        ret = self._namespace(ns, key).get(key)
         if ret is None:
             return Signature()
         return ret
 
-    @lock
     def update(self, signature, ns=None):
         """
         Updates the signature with the new signature.
         """
-        ns = _get_ns(ns)
-        if ns not in self._signaturedb:
-            self._signaturedb[ns] = {}
-        self._signaturedb[ns][signature.key] = signature
+        d = self._namespace(ns, signature.key)
+        with self._locks(signature.key):
+            d[signature.key] = signature
 
     @property
     def namespaces(self):
         """
         Returns a list of namespaces.
         """
-        return self._signaturedb.keys()
+        from .cache import split_shard
+        ret = set(ns for (ns, _) in self._signaturedb.keys())
+        if self._cache is not None:
+            for prefix in self._cache.prefixes():
+                name, _ = split_shard(prefix)
+                if name.startswith(SIGNATUREDB_PREFIX):
+                    ret.add(name[len(SIGNATUREDB_PREFIX):])
+        return list(ret)
 
 
 class Signature(Serializable):
@@ -266,23 +381,29 @@ class FileSignature(Signature):
         super().__init__(value, valid=valid, key=path)
 
     def to_json(self):
+        from .fs import relocatable_path
         d = super().to_json()
-        d['path'] = self.path
+        d['path'] = relocatable_path(self.path)
+        d['key'] = relocatable_path(self.key)
         return d
 
     @classmethod
     def from_json(cls, d):
-        return cls(d['path'], value=d['value'], valid=d['valid'])
+        from .fs import expand_path
+        return cls(expand_path(d['path']), value=d['value'], valid=d['valid'])
 
-    @lock
     def refresh(self, value=None):
-        if value is not None:
+        if value is None:
+            # hash the file without holding a lock, s.t. multiple
+            # threads can hash files at the same time
+            value = self._compute()
+        with _refresh_locks(self.key):
             self._value = value
             self._valid = True
-            return value
+        return value
+
+    def _compute(self):
         if not os.path.exists(self.path):
-            self._valid = True
-            self._value = None
             return None
         if os.path.isdir(self.path):
             # TODO: think about this.... maybe use all the content?!
@@ -290,10 +411,7 @@ class FileSignature(Signature):
             raise RuntimeError('FileSignature cannot be a directory: `{}`'.format(self.path))
         with open(self.path, 'rb') as f:
             data = f.read()
-        value = checksum(data)
-        self._value = value
-        self._valid = True
-        return value
+        return checksum(data)
 
     def clone(self):
         return FileSignature(self.path, value=self.value, valid=self.valid)
@@ -328,23 +446,21 @@ class CacheSignature(Signature):
         return cls(d['key'], cache_key=d['key'], prefix=d['prefix']
                    , value=d['value'], valid=d['valid'])
 
-    @lock
     def refresh(self, value=None):
         if value is not None:
-            self._value = value
+            with _refresh_locks(self.key):
+                self._value = value
             return value
         if self._cache is None:
             from wasp import ctx
             self._cache = ctx.cache.prefix(self._prefix)
         data = self._cache.get(self._cache_key, None)
-        if data is None:
+        if data is not None:
+            jsonarr = factory.to_json(data)
+            value = str(json_checksum(jsonarr))
+        with _refresh_locks(self.key):
+            self._value = value
             self._valid = True
-            self._value = None
-            return None
-        jsonarr = factory.to_json(data)
-        value = str(json_checksum(jsonarr))
-        self._value = value
-        self._valid = True
         return value
 
     def clone(self):
@@ -356,6 +472,114 @@ class CacheSignature(Signature):
 factory.register(CacheSignature)
 
 
+ENV_UNSET = 'unset'
+"""
+Signature value of an :class:`EnvSignature` if the environment variable is not set.
+"""
+
+
+class EnvSignature(Signature):
+    """
+    Signature of an environment variable, to be used with :class:`wasp.node.EnvNode`.
+    The value is a checksum of the value of the variable in ``ctx.env``, such that
+    the values of the variables are not stored in the cache.
+
+    :param key: Key for identifying the signature.
+    :param varname: Name of the environment variable.
+    """
+    def __init__(self, key, varname=None, value=None, valid=False):
+        super().__init__(value, valid=valid, key=key)
+        if varname is None:
+            varname = key[1:]
+        self._varname = varname
+
+    @property
+    def varname(self):
+        """
+        Returns the name of the environment variable.
+        """
+        return self._varname
+
+    def to_json(self):
+        d = super().to_json()
+        d['varname'] = self._varname
+        return d
+
+    @classmethod
+    def from_json(cls, d):
+        return cls(d['key'], varname=d['varname'], value=d['value'], valid=d['valid'])
+
+    def refresh(self, value=None):
+        if value is None:
+            from wasp import ctx
+            envvalue = ctx.env.get(self._varname)
+            if envvalue is None:
+                value = ENV_UNSET
+            else:
+                value = checksum(envvalue.encode('UTF-8'))
+        with _refresh_locks(self.key):
+            self._value = value
+            self._valid = True
+        return value
+
+    def clone(self):
+        return EnvSignature(self.key, varname=self._varname, value=self.value, valid=self.valid)
+
+
+factory.register(EnvSignature)
+
+
+class GlobSignature(Signature):
+    """
+    Signature of a directory listing, to be used with :class:`wasp.fs.GlobNode`.
+    The value is computed from the modification times of all scanned directories,
+    thus, it changes if files are added, removed or renamed but not if the contents
+    of the files change.
+
+    :param key: Key for identifying the signature.
+    :param path: Path of the directory to be scanned.
+    :param recursive: Determines whether subdirectories are scanned as well.
+    """
+    def __init__(self, key, path=None, recursive=True, value=None, valid=False):
+        super().__init__(value, valid=valid, key=key)
+        self._path = path
+        self._recursive = recursive
+
+    def to_json(self):
+        from .fs import relocatable_path
+        d = super().to_json()
+        d['path'] = relocatable_path(self._path)
+        d['recursive'] = self._recursive
+        return d
+
+    @classmethod
+    def from_json(cls, d):
+        from .fs import expand_path
+        return cls(d['key'], path=expand_path(d['path']), recursive=d['recursive'],
+                   value=d['value'], valid=d['valid'])
+
+    def refresh(self, value=None):
+        if value is None:
+            from .fs import scan_tree
+            listing = scan_tree(self._path, recursive=self._recursive)
+            if not listing:
+                value = None
+            else:
+                stamps = ';'.join('{0}:{1}'.format(reldir, entry['mtime']) for reldir, entry in listing)
+                value = checksum(stamps.encode('UTF-8'))
+        with _refresh_locks(self.key):
+            self._value = value
+            self._valid = True
+        return value
+
+    def clone(self):
+        return GlobSignature(self.key, path=self._path, recursive=self._recursive,
+                             value=self.value, valid=self.valid)
+
+
+factory.register(GlobSignature)
+
+
 class UnchangedSignature(Signature):
     """
     A dummy signature which never changes (i.e. comparing it
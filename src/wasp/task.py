@@ -1,10 +1,13 @@
-from .node import nodes, is_symbolic_node_string, SymbolicNode, node, Node
-from .util import CallableList, is_iterable
+from .node import nodes, is_symbolic_node_string, is_env_node_string, SymbolicNode, EnvNode, node, Node
+from .util import CallableList, is_iterable, checksum
 from .argument import Argument, ArgumentCollection
 from .commands import Command
-from . import decorators
+from . import decorators, factory
 
 from functools import reduce
+from types import CodeType
+import json
+import marshal
 import operator
 
 
@@ -16,6 +19,27 @@ class TaskFailedError(Exception):
     pass
 
 
+def _code_data(code):
+    """
+    Returns the bytecode, constants and names of ``code``, without the file name
+    and line numbers, s.t. the data does not depend on the location of the file.
+    """
+    consts = tuple(_code_data(c) if isinstance(c, CodeType) else c for c in code.co_consts)
+    return code.co_code, consts, code.co_names, code.co_varnames
+
+
+def _fingerprint_object(obj):
+    """
+    Returns a json serializable representation of ``obj`` for :func:`Task.fingerprint`.
+    """
+    f = getattr(obj, '__func__', obj)
+    code = getattr(f, '__code__', None)
+    if isinstance(code, CodeType):
+        return '{0}:{1}'.format(getattr(f, '__qualname__', type(obj).__name__),
+                                checksum(marshal.dumps(_code_data(code))))
+    return type(obj).__name__
+
+
 class Task(object):
     """
     ``Tasks`` are the central unit of execution of ``wasp``. A build process is formulated as
@@ -47,10 +71,10 @@ class Task(object):
             target nodes are still up-to-date)
 
     Arguments may be passed to a task during creation time or they can be passed using
-    SymbolicNodes during execution time. It is important to note, that whether a task
-    is executed only depends on the signatures of its source and target nodes and not on
-    the arguments passed to it during creation time. Thus, if an argument can change
-    between differnt runs of ``wasp``, the argument must be passed using a node. For example::
+    SymbolicNodes during execution time. Whether a task is executed depends on the signatures
+    of its source and target nodes and on its fingerprint (see :func:`Task.fingerprint`), which
+    covers the class of the task and the arguments passed to it during creation time. Arguments
+    which are only known at execution time should be passed using a node. For example::
 
       t = Task(fun=foo).use(':config')
       node(':config').write(key=value)
@@ -85,10 +109,12 @@ class Task(object):
         self._targets = nodes(targets)
         self._has_run = False
         self._always = always
+        self._cacheable = False
         self._success = False
         self._arguments = ArgumentCollection()
         self._run_list = CallableList(arg=self)
-        self._run_list.append(lambda x: self._run())
+        self._default_run = lambda x: self._run()
+        self._run_list.append(self._default_run)
         if fun is not None:
             self._run_list.append(fun)
         self._prepare_list = CallableList(arg=self)
@@ -105,6 +131,8 @@ class Task(object):
         self._result = ArgumentCollection()
         self._used_nodes = []
         self._required_arguments = []
+        self._untouched = set()
+        self._touched_values = {}
         self._init()
         self._noop = False
         self._disabled = False
@@ -164,6 +192,20 @@ class Task(object):
     the source and target nodes.
     """
 
+    def get_cacheable(self):
+        return self._cacheable
+
+    def set_cacheable(self, value):
+        self._cacheable = value
+
+    cacheable = property(get_cacheable, set_cacheable)
+    """
+    Defines whether the targets and the output of the task may be stored in
+    and restored from the action cache (see :class:`wasp.actioncache.ActionCache`).
+    This requires that the task is deterministic, i.e. it produces the same target
+    files given the same sources and arguments.
+    """
+
     @property
     def sources(self):
         """
@@ -186,7 +228,7 @@ class Task(object):
         """
         for node in self._used_nodes:
             # retrieve all nodes
-            if isinstance(node, SymbolicNode):
+            if isinstance(node, SymbolicNode) or isinstance(node, EnvNode):
                 self.use(node.read())
         for argkey in self._required_arguments:
             if argkey not in self.arguments or self.arguments[argkey].is_empty:
@@ -280,9 +322,96 @@ class Task(object):
         were actually modified by this task.
 
         :return: All targets that have been modified. The default
-            implementation returns all targets.
+            implementation returns all targets, except the ones
+            marked with :func:`Task.untouch`.
         """
-        return self._targets
+        if len(self._untouched) == 0:
+            return self._targets
+        return [t for t in self._targets if t.key not in self._untouched]
+
+    def touch(self, target, value=None):
+        """
+        Marks a target as modified by this task. If ``value`` is given, it is used
+        as the new signature value of the target instead of recomputing the signature
+        after the task has run. For example, a task which writes a file may pass
+        the checksum of the data it has written.
+
+        :param target: The target node (or anything accepted by :func:`wasp.node.node`).
+        :param value: The new signature value of the target or None.
+        """
+        key = node(target).key
+        self._untouched.discard(key)
+        if value is not None:
+            self._touched_values[key] = value
+        return self
+
+    def untouch(self, *args):
+        """
+        Marks targets as not modified by this task, e.g. because a file
+        already had the desired content and was not written. The signatures of
+        these targets are not refreshed and tasks depending on them are
+        only executed if they have changed for another reason (this is
+        similar to ``restat`` in ninja).
+        The function accepts the same positional arguments as :func:`wasp.node.nodes`.
+        """
+        for n in nodes(args):
+            self._untouched.add(n.key)
+            self._touched_values.pop(n.key, None)
+        return self
+
+    def touched_value(self, target):
+        """
+        Returns the signature value given to :func:`Task.touch` for ``target``
+        or None if the signature of the target must be recomputed.
+        """
+        return self._touched_values.get(target.key)
+
+    def fingerprint(self):
+        """
+        Returns a string which identifies the definition of the task, i.e. the
+        class of the task and the arguments passed to it before execution. If the
+        fingerprint changes between two runs (e.g. because the build script was modified),
+        the task is executed again, even if its source and target nodes are unchanged.
+        Functions passed as arguments and the functions added to ``task.run`` (e.g. using
+        the ``fun`` parameter or :class:`task`) are identified by their name and their bytecode.
+        Subclasses should extend the fingerprint with additional information defining
+        their behaviour.
+        """
+        cls = type(self)
+        args = json.dumps(factory.to_json(self.arguments), sort_keys=True, default=_fingerprint_object)
+        run = ','.join(_fingerprint_object(f) for f in self._run_list if f is not self._default_run)
+        return checksum('{0}.{1}:{2}:{3}'.format(cls.__module__, cls.__qualname__, args, run).encode('UTF-8'))
+
+    def cached_output(self):
+        """
+        Returns a json serializable object describing the output of the task (apart from its
+        target files), which is stored in the action cache once the task has run successfully.
+        By default, this is the result of the task (see :attr:`Task.result`).
+        """
+        return {'result': factory.to_json(dict(self.result))}
+
+    def discovered_sources(self):
+        """
+        Returns the paths of files which were read by the task, but are not known before
+        it has run (e.g. the headers included by a source file). Only available **after**
+        the task has run or its output has been restored. The action cache stores their
+        content digests and only restores the outputs of the task if they are unchanged.
+        """
+        return []
+
+    def restore_output(self, output):
+        """
+        Called instead of :func:`Task.run` if the targets of the task have been restored from the
+        action cache. ``output`` is the object previously returned by :func:`Task.cached_output`.
+        The default implementation restores the result of the task, writes it to all target
+        :class:`wasp.node.SymbolicNode` objects and marks the task as successful. Afterwards,
+        ``on_success()`` and ``postprocess()`` are called as if the task had run.
+        """
+        self.result = ArgumentCollection.from_dict(factory.from_json(output['result']))
+        for node in self.targets:
+            if isinstance(node, SymbolicNode):
+                node.write(self.result)
+        self.success = True
 
     @property
     def new_nodes(self):
@@ -310,7 +439,7 @@ class Task(object):
         if not use:
             return
         for node in ext:
-            if isinstance(node, SymbolicNode):
+            if isinstance(node, SymbolicNode) or isinstance(node, EnvNode):
                 self.use(node)
         return self
 
@@ -356,10 +485,12 @@ class Task(object):
          * :class:`wasp.argument.ArgumentCollection`: uses all its arguments
          * :class:`wasp.node.SymbolicNode`: Adds the node as a dependency and retrieves
             arguments from it.
+         * :class:`wasp.node.EnvNode`: Adds the node as a dependency and retrieves the value
+            of the environment variable as argument.
          * :class:`wasp.node.Node`: Adds the node as a dependency.
          * :class:`Task`: Adds the task as a dependency of ``self`` by creating an empty node.
          * ``str``: If formatted as a valid identifier for a :class:`wasp.node.SymbolicNode`
-            uses the node. Otherwise, an empty argument is added and it is attempted to
+            or a :class:`wasp.node.EnvNode` uses the node. Otherwise, an empty argument is added and it is attempted to
             fill it automatically (by calling ``Argument.retrieve_all()``).
          * :class:`TaskGroup`: Uses the ``group.target_task`` if given,
             otherwise all tasks contained in the task group
@@ -380,7 +511,7 @@ class Task(object):
                         self.use(t)
                 else:
                     self.use(a.target_task)
-            elif isinstance(a, SymbolicNode):
+            elif isinstance(a, SymbolicNode) or isinstance(a, EnvNode):
                 self._used_nodes.append(a)
                 self.sources.append(a)
             elif isinstance(a, Node):
@@ -391,7 +522,7 @@ class Task(object):
                 self._used_nodes.append(x)
                 self.sources.append(x)
             elif isinstance(a, str):
-                if is_symbolic_node_string(a):
+                if is_symbolic_node_string(a) or is_env_node_string(a):
                     x = node(a)
                     self._used_nodes.append(x)
                     self.sources.append(x)
@@ -132,6 +132,9 @@ class CallableList(list):
         return self._collect_returns_fun(ret)
 
 
+_lock_creation_lock = threading.Lock()
+
+
 def lock(f):
     class LockWrapper(object):
         def __init__(self, f):
@@ -142,7 +145,10 @@ def lock(f):
                 raise TypeError('Function `{0}` cannot be used as class '
                                 'method with an @lock decorator.'.format(self._f.__name__))
             if not hasattr(instance, '__lock__'):
-                object.__setattr__(instance, '__lock__', threading.Lock())
+                # make sure that two threads do not assign different locks
+                with _lock_creation_lock:
+                    if not hasattr(instance, '__lock__'):
+                        object.__setattr__(instance, '__lock__', threading.Lock())
 
             @functools.wraps(self._f)
             def wrapper(*args, **kw):
@@ -468,6 +474,26 @@ class Proxy(object):
         return repr(data['obj'])
 
 
+class StripedLock(object):
+    """
+    A fixed set of locks which are selected based on the hash of a key.
+    This allows protecting a large number of objects (e.g. all signatures)
+    without using one global lock, on which all threads would contend,
+    and without allocating one lock per object.
+
+    :param stripes: Number of locks to be used.
+    """
+    def __init__(self, stripes=64):
+        assert stripes > 0
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __call__(self, key):
+        """
+        Returns the lock which protects the object identified by ``key``.
+        """
+        return self._locks[hash(key) % len(self._locks)]
+
+
 class Lock(object):
     def __init__(self):
         self._lock = threading.Lock()
@@ -0,0 +1,378 @@
+"""
+Persistent worker processes for tools with an expensive startup.
+
+Instead of spawning a new process for each task, a :class:`WorkerTask` sends a request
+to a long-lived worker process, which handles many requests of the same tool one after
+another. The workers are kept in a :class:`WorkerPool`, which spawns a new worker if all
+workers of a tool are busy. Thus, at most one worker per concurrently running task is
+started. The workers are stopped when ``wasp`` exits.
+
+Protocol: The parent process writes requests to ``stdin`` of the worker and reads the
+responses from its ``stdout``, one response per request, in the same order. Each message
+is a JSON object encoded as UTF-8 and prefixed by its length in bytes as 4 byte
+unsigned big endian integer. Requests have the following keys:
+
+ * ``request_id``: Integer identifying the request.
+ * ``arguments``: List of string arguments, similar to a command line.
+ * ``cwd``: Working directory in which the request is handled.
+
+Responses have the following keys:
+
+ * ``request_id``: Identifier of the request.
+ * ``exit_code``: Integer, 0 on success.
+ * ``output``: Output to be shown to the user as string.
+
+The worker exits as soon as its ``stdin`` is closed. Workers may be written in any
+language. For workers written in python, :func:`serve` implements the protocol and
+:func:`python_worker` returns the command line for running a handler function in a
+worker process.
+"""
+
+import atexit
+import io
+import json
+import os
+import struct
+import sys
+import threading
+import traceback
+from contextlib import contextmanager, redirect_stdout, redirect_stderr
+from subprocess import Popen, PIPE, TimeoutExpired
+
+from .task import Task, TaskFailedError
+from .logging import LogStr
+from .util import checksum
+from .fs import top_dir, relocatable_path
+
+
+HEADER = struct.Struct('>I')
+"""
+Length prefix of the messages.
+"""
+
+STOP_TIMEOUT = 5
+"""
+Time in seconds a worker may take to exit after its ``stdin`` has been closed.
+"""
+
+BOOTSTRAP = 'import sys; sys.path.insert(0, sys.argv[1]); from wasp.worker import main; main()'
+
+
+class WorkerError(Exception):
+    """
+    Raised if communicating with a worker fails, e.g. because it has crashed.
+    """
+    pass
+
+
+def write_message(f, message):
+    """
+    Writes ``message`` (a json serializable object) to the binary file object ``f``.
+    """
+    data = json.dumps(message).encode('UTF-8')
+    f.write(HEADER.pack(len(data)) + data)
+    f.flush()
+
+
+def _read_exactly(f, size):
+    ret = b''
+    while len(ret) < size:
+        data = f.read(size - len(ret))
+        if not data:
+            return None
+        ret += data
+    return ret
+
+
+def read_message(f):
+    """
+    Reads a message from the binary file object ``f``.
+
+    :return: The decoded message or None if the file has been closed.
+    """
+    header = _read_exactly(f, HEADER.size)
+    if header is None:
+        return None
+    data = _read_exactly(f, HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode('UTF-8'))
+
+
+def _handle(handler, request):
+    output = io.StringIO()
+    cwd = os.getcwd()
+    try:
+        with redirect_stdout(output), redirect_stderr(output):
+            if request.get('cwd') is not None:
+                os.chdir(request['cwd'])
+            exit_code = handler(request['arguments'])
+    except Exception:
+        output.write(traceback.format_exc())
+        exit_code = 1
+    finally:
+        os.chdir(cwd)
+    return 0 if exit_code is None else exit_code, output.getvalue()
+
+
+def serve(handler, stdin=None, stdout=None):
+    """
+    Implements the worker side of the protocol: Reads requests until ``stdin``
+    is closed and calls ``handler(arguments)`` for each of them. The handler
+    returns the exit code (None is equivalent to 0). Everything it prints is
+    sent to the parent process as output. Exceptions are reported as failures.
+
+    :param stdin: Binary file object from which requests are read, by default ``stdin``.
+    :param stdout: Binary file object to which responses are written, by default ``stdout``.
+    """
+    if stdin is None:
+        stdin = os.fdopen(os.dup(0), 'rb')
+    if stdout is None:
+        stdout = os.fdopen(os.dup(1), 'wb')
+        # output of the handler (e.g. of subprocesses) must not corrupt the protocol
+        os.dup2(2, 1)
+    while True:
+        request = read_message(stdin)
+        if request is None:
+            return
+        exit_code, output = _handle(handler, request)
+        write_message(stdout, {'request_id': request['request_id'], 'exit_code': exit_code, 'output': output})
+
+
+def python_worker(handler):
+    """
+    Returns the command line for running ``handler`` in a worker process using
+    the current python interpreter, which is able to import ``wasp``.
+
+    :param handler: The handler function in the format ``'<path of python file>:<function name>'``.
+    """
+    import wasp
+    path = os.path.dirname(os.path.dirname(os.path.abspath(wasp.__file__)))
+    return [sys.executable, '-c', BOOTSTRAP, path, handler]
+
+
+def main():
+    """
+    Entry point of worker processes created with :func:`python_worker`.
+    """
+    from .util import load_module_by_path
+    fpath, _, name = sys.argv[2].rpartition(':')
+    handler = getattr(load_module_by_path(fpath), name)
+    serve(handler)
+
+
+_file_checksums = {}
+
+
+def _file_checksum(fpath):
+    st = os.stat(fpath)
+    key = (fpath, st.st_mtime_ns, st.st_size)
+    ret = _file_checksums.get(key)
+    if ret is None:
+        with open(fpath, 'rb') as f:
+            ret = checksum(f.read())
+        _file_checksums[key] = ret
+    return ret
+
+
+def worker_checksum(argv):
+    """
+    Returns a checksum identifying the worker started with the command line ``argv``.
+    Paths are converted using :func:`wasp.fs.relocatable_path` and the contents of the
+    handlers (``'<path of python file>:<function name>'``, see :func:`python_worker`) and
+    of the other files of the project referenced by ``argv`` are included, s.t. the
+    checksum changes if they are edited.
+    """
+    data = []
+    for arg in argv:
+        fpath, sep, name = arg, '', ''
+        if not os.path.isfile(arg) and ':' in arg:
+            # '<path of python file>:<function name>'
+            fpath, sep, name = arg.rpartition(':')
+        abspath = os.path.abspath(fpath)
+        if os.path.isabs(fpath) or os.path.exists(abspath):
+            fpath = relocatable_path(abspath)
+        data.append(fpath + sep + name)
+        if os.path.isfile(abspath) and (sep != '' or relocatable_path(abspath) != abspath):
+            data.append(_file_checksum(abspath))
+    return checksum('\0'.join(data).encode('UTF-8'))
+
+
+class Worker(object):
+    """
+    A worker process started with the command line ``argv``.
+    """
+
+    def __init__(self, argv, cwd=None):
+        self._argv = argv
+        self._process = Popen(argv, stdin=PIPE, stdout=PIPE, cwd=cwd)
+        self._request_id = 0
+
+    @property
+    def alive(self):
+        """
+        True if the worker process is still running.
+        """
+        return self._process.poll() is None
+
+    def request(self, arguments, cwd=None):
+        """
+        Sends a request to the worker and waits for the response.
+
+        :param arguments: List of string arguments.
+        :param cwd: Working directory in which the request is handled.
+        :return: Tuple of ``exit_code`` and ``output``.
+        """
+        self._request_id += 1
+        try:
+            write_message(self._process.stdin, {'request_id': self._request_id, 'arguments': arguments, 'cwd': cwd})
+            response = read_message(self._process.stdout)
+        except (OSError, ValueError) as e:
+            raise WorkerError('Communication with worker `{0}` failed: {1}'.format(self._argv[0], e))
+        if response is None:
+            raise WorkerError('Worker `{0}` exited unexpectedly.'.format(self._argv[0]))
+        if response.get('request_id') != self._request_id:
+            raise WorkerError('Worker `{0}` sent an invalid response.'.format(self._argv[0]))
+        return response['exit_code'], response['output']
+
+    def close(self):
+        """
+        Stops the worker process.
+        """
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._process.wait(timeout=STOP_TIMEOUT)
+        except TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._process.stdout.close()
+
+
+class WorkerPool(object):
+    """
+    Keeps the idle workers of each tool (identified by the command line of the worker).
+    If the files of the project referenced by the command line change (see :func:`worker_checksum`),
+    the idle workers are stopped and new ones are started.
+    """
+
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self, argv):
+        """
+        Context manager which returns an idle :class:`Worker` started with ``argv`` or
+        starts a new one. The worker is returned to the pool afterwards, unless
+        an error has occurred.
+        """
+        key = (tuple(argv), worker_checksum(argv))
+        worker = None
+        stale = []
+        with self._lock:
+            for other in [k for k in self._idle.keys() if k[0] == key[0] and k != key]:
+                # e.g. the handler has been edited
+                stale.extend(self._idle.pop(other))
+            idle = self._idle.setdefault(key, [])
+            while worker is None and len(idle) > 0:
+                worker = idle.pop()
+                if not worker.alive:
+                    stale.append(worker)
+                    worker = None
+        for w in stale:
+            w.close()
+        if worker is None:
+            worker = Worker(list(argv), cwd=top_dir())
+        try:
+            yield worker
+        except BaseException:
+            worker.close()
+            raise
+        with self._lock:
+            if self._idle.get(key) is idle:
+                idle.append(worker)
+                worker = None
+        if worker is not None:
+            # the worker has become stale while the request was handled
+            worker.close()
+
+    def shutdown(self):
+        """
+        Stops all idle workers.
+        """
+        with self._lock:
+            workers = [w for idle in self._idle.values() for w in idle]
+            self._idle = {}
+        for worker in workers:
+            worker.close()
+
+
+pool = WorkerPool()
+"""
+The :class:`WorkerPool` of the current process.
+"""
+
+atexit.register(pool.shutdown)
+
+
+class WorkerTask(Task):
+    """
+    Base class for tasks which are executed by a persistent worker process (see :mod:`wasp.worker`).
+    Subclasses define the command line of the worker using the ``worker`` attribute and
+    the arguments of the request by overriding :func:`worker_arguments`.
+
+    :param sources: Source nodes consumed by the task.
+    :param targets: Target nodes produced by the task.
+    :param always: Determines whether the task should be executed regardless of whether targets
+        or sources have changed.
+    """
+    worker = None
+
+    def __init__(self, sources=None, targets=None, always=False):
+        super().__init__(sources=sources, targets=targets, always=always)
+        self._output = None
+
+    @property
+    def output(self):
+        """
+        Returns the output of the worker for this task. Only available **after** the task has run.
+        """
+        return self._output
+
+    def worker_arguments(self):
+        """
+        Returns the list of string arguments sent to the worker.
+        """
+        raise NotImplementedError
+
+    def fingerprint(self):
+        """
+        Extends :func:`wasp.task.Task.fingerprint` with the command line of the worker
+        and the files it references (see :func:`worker_checksum`).
+        """
+        data = '{0}:{1}'.format(super().fingerprint(), worker_checksum(self.worker))
+        return checksum(data.encode('UTF-8'))
+
+    def _run(self):
+        arguments = self.worker_arguments()
+        try:
+            with pool.acquire(self.worker) as worker:
+                exit_code, self._output = worker.request(arguments, cwd=top_dir())
+        except (OSError, WorkerError) as e:
+            raise TaskFailedError(str(e))
+        self.success = exit_code == 0
+        description = '{0} {1}'.format(os.path.basename(self.worker[-1]), ' '.join(arguments))
+        output = self._output.strip()
+        if not self.success:
+            return_value_format = self.log.color('  --> ' + str(exit_code), fg='red', style='bright')
+            lines = [LogStr(description) + return_value_format]
+            if output != '':
+                lines.append(output)
+            self.log.fatal(self.log.format_fail(*lines))
+            return
+        self.log.info(self.log.format_success() + description)
+        if output != '':
+            self.log.info(self.log.format_info(output))
@@ -12,6 +12,7 @@ import wasp
 
 def setup_context():
     Directory(__file__).join('c4che.json').remove()
+    Directory(__file__).join('c4che.journal').remove()
     wasp.ctx.__init__()
     init_context(Directory(__file__))
     return wasp.ctx
@@ -0,0 +1,161 @@
+from wasp import directory, file, shell, log, ShellTask
+from wasp.actioncache import ActionCache, RemoteCache, CacheRequestHandler, parse_size
+from wasp.execution import run_task
+from tests import setup_context
+from http.server import ThreadingHTTPServer
+from threading import Thread
+import os
+
+
+def prepare():
+    curdir = directory(__file__)
+    testdir = directory(curdir.join('test-dir'))
+    testdir.remove(recursive=True)
+    testdir.mkdir()
+    with open(testdir.join('src.txt').path, 'w') as f:
+        f.write('hello')
+    return testdir
+
+
+def make_task(testdir):
+    t = shell('cat {src} > {tgt} && echo run >> runs.txt && echo done',
+              sources=testdir.join('src.txt'), targets=testdir.join('tgt.txt'), cwd=testdir)
+    t.log = log
+    return t
+
+
+def runs(testdir):
+    with open(testdir.join('runs.txt').path, 'r') as f:
+        return len(f.readlines())
+
+
+def test_parse_size():
+    assert parse_size(100) == 100
+    assert parse_size('2k') == 2048
+    assert parse_size('10 GiB') == 10 * 1024 ** 3
+
+
+def test_action_cache():
+    ctx = setup_context()
+    testdir = prepare()
+    cache = ActionCache(testdir.join('cache').path, max_size='1M')
+    ctx.action_cache = cache
+    t = make_task(testdir)
+    assert cache.cacheable(t)
+    assert run_task(t, None)
+    assert runs(testdir) == 1
+    assert cache.size > 0
+    # restore the target after it has been removed
+    os.remove(testdir.join('tgt.txt').path)
+    t = make_task(testdir)
+    assert run_task(t, None)
+    assert runs(testdir) == 1
+    assert t.out.stdout == 'done'
+    assert t.commandstring is not None
+    with open(testdir.join('tgt.txt').path, 'r') as f:
+        assert f.read() == 'hello'
+    # changing a source results in a miss
+    with open(testdir.join('src.txt').path, 'w') as f:
+        f.write('world')
+    t = make_task(testdir)
+    assert run_task(t, None)
+    assert runs(testdir) == 2
+    # eviction
+    cache = ActionCache(testdir.join('cache').path, max_size=1)
+    ctx.action_cache = cache
+    with open(testdir.join('src.txt').path, 'w') as f:
+        f.write('foo')
+    t = make_task(testdir)
+    assert run_task(t, None)
+    assert runs(testdir) == 3
+    assert cache.size <= 1
+    assert cache.lookup(cache.action_key(t)) is None
+    ctx.action_cache = None
+
+
+class IncludingTask(ShellTask):
+    """
+    Copies its source and a file named in the source, which is discovered while running.
+    """
+
+    def __init__(self, testdir):
+        super().__init__(sources=testdir.join('src.txt'), targets=testdir.join('tgt.txt'), cwd=testdir)
+        self._testdir = testdir
+        self.successes = 0
+        self.on_success.append(lambda task: setattr(task, 'successes', task.successes + 1))
+
+    @property
+    def cmd(self):
+        return 'cat {src} $(cat {src}) > {tgt} && echo run >> runs.txt'
+
+    def discovered_sources(self):
+        with open(self._testdir.join('src.txt').path, 'r') as f:
+            return [self._testdir.join(f.read().strip()).path]
+
+
+def test_discovered_sources():
+    ctx = setup_context()
+    testdir = prepare()
+    ctx.action_cache = ActionCache(testdir.join('cache').path, max_size='1M')
+    with open(testdir.join('src.txt').path, 'w') as f:
+        f.write('hdr.txt')
+    with open(testdir.join('hdr.txt').path, 'w') as f:
+        f.write('old')
+    t = IncludingTask(testdir)
+    t.log = log
+    assert run_task(t, None)
+    assert runs(testdir) == 1
+    # restored tasks run the success callbacks
+    os.remove(testdir.join('tgt.txt').path)
+    t = IncludingTask(testdir)
+    t.log = log
+    assert run_task(t, None)
+    assert runs(testdir) == 1
+    assert t.successes == 1
+    # the discovered file has changed, the action must not be restored
+    with open(testdir.join('hdr.txt').path, 'w') as f:
+        f.write('new')
+    t = IncludingTask(testdir)
+    t.log = log
+    assert run_task(t, None)
+    assert runs(testdir) == 2
+    with open(testdir.join('tgt.txt').path, 'r') as f:
+        assert f.read().endswith('new')
+    ctx.action_cache = None
+
+
+def test_remote_cache():
+    ctx = setup_context()
+    testdir = prepare()
+    server = ThreadingHTTPServer(('localhost', 0), CacheRequestHandler)
+    server.cache = ActionCache(testdir.join('server').path)
+    thread = Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        url = 'http://localhost:{0}'.format(server.server_address[1])
+        ctx.action_cache = ActionCache(testdir.join('cache-a').path, remote=RemoteCache(url))
+        assert run_task(make_task(testdir), None)
+        ctx.action_cache.flush()
+        assert runs(testdir) == 1
+        assert server.cache.size > 0
+        # a different local cache retrieves the outputs from the server
+        ctx.action_cache = ActionCache(testdir.join('cache-b').path, remote=RemoteCache(url, upload=False))
+        os.remove(testdir.join('tgt.txt').path)
+        t = make_task(testdir)
+        assert run_task(t, None)
+        assert runs(testdir) == 1
+        with open(testdir.join('tgt.txt').path, 'r') as f:
+            assert f.read() == 'hello'
+        assert ctx.action_cache.size > 0
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        ctx.action_cache = None
+
+
+if __name__ == '__main__':
+    test_parse_size()
+    test_action_cache()
+    test_discovered_sources()
+    test_remote_cache()
@@ -0,0 +1,71 @@
+import os
+
+from wasp import directory, FileNode
+from wasp.builtin import _gc, _add_gc_options
+from wasp.signature import RUN_COUNTS_PREFIX
+from tests import setup_context
+
+
+def prepare():
+    ctx = setup_context()
+    curdir = directory(__file__)
+    testdir = directory(curdir.join('test-dir'))
+    testdir.remove(recursive=True)
+    testdir.mkdir()
+    paths = {}
+    for name in ['a.o', 'a.d', 'b.o']:
+        paths[name] = testdir.join(name).path
+        with open(paths[name], 'w') as f:
+            f.write(name)
+    return ctx, paths
+
+
+def simulate_run(ctx, paths, partial=False):
+    """
+    Simulates a run of the `build` command using the nodes of ``paths``.
+    """
+    ctx.reset()
+    for fpath in paths:
+        sig = FileNode(fpath).signature(ns='build')
+        sig.refresh()
+        ctx.signatures.add(sig, ns='build')
+    if partial:
+        ctx.signatures.mark_partial('build')
+    ctx.signatures.save(ctx.cache)
+
+
+def gc(ctx, keep_runs):
+    ctx.reset()
+    _add_gc_options(ctx.options)
+    ctx.options.group('gc')['keep_runs'].value = keep_runs
+    _gc()
+
+
+def test_gc():
+    ctx, paths = prepare()
+    simulate_run(ctx, [paths['a.o'], paths['b.o']])
+    for i in range(2):
+        simulate_run(ctx, [paths['b.o']])
+    gc(ctx, 3)
+    assert all(os.path.exists(f) for f in paths.values())
+    gc(ctx, 2)
+    # the stale target is removed together with its byproducts
+    assert not os.path.exists(paths['a.o'])
+    assert not os.path.exists(paths['a.d'])
+    assert os.path.exists(paths['b.o'])
+
+
+def test_gc_partial():
+    ctx, paths = prepare()
+    simulate_run(ctx, [paths['a.o'], paths['b.o']])
+    # e.g. runs with --target or runs in which only some directories were loaded
+    for i in range(3):
+        simulate_run(ctx, [paths['b.o']], partial=True)
+    assert ctx.cache.prefix(RUN_COUNTS_PREFIX)['build'] == 1
+    gc(ctx, 1)
+    assert all(os.path.exists(f) for f in paths.values())
+
+
+if __name__ == '__main__':
+    test_gc()
+    test_gc_partial()
@@ -1,8 +1,15 @@
-from wasp.cache import Cache
-from wasp.fs import File
-from tests import test_dir
+from wasp.cache import Cache, JsonStorage, SqliteStorage, BinaryStorage, ShardedStorage, FileLock, Journal
+from wasp.cache import shard_prefix, split_shard, cache_shard
+from wasp.fs import File, relocatable_path
+from wasp.recursion import RecursionIndex, RECURSION_FILE, RECURSION_VERSION
+from wasp import recursion
+from tests import test_dir, setup_context
 
+from urllib.parse import quote
+import json
 import os
+import subprocess
+import sys
 
 
 def test_cache():
@@ -16,3 +23,214 @@ def test_cache():
     assert f.path == 'test'
 
 
+class RecordingStorage(SqliteStorage):
+
+    def __init__(self, fpath, migrate_from=None):
+        super().__init__(fpath, migrate_from=migrate_from)
+        self.loaded = []
+        self.changes = None
+
+    def load_prefix(self, prefix):
+        self.loaded.append(prefix)
+        return super().load_prefix(prefix)
+
+    def save(self, changes, removed):
+        self.changes = changes
+        super().save(changes, removed)
+
+
+def test_sqlite_cache():
+    os.chdir(os.path.abspath(test_dir))
+    jsonfile = 'cache/sqlite-cache.json'
+    dbfile = 'cache/cache.sqlite'
+    for f in [jsonfile, dbfile]:
+        if os.path.exists(f):
+            os.remove(f)
+    json_cache = Cache(storage=JsonStorage(jsonfile))
+    json_cache.prefix('test')['foo'] = File('test')
+    json_cache.prefix('other')['bar'] = 'baz'
+    json_cache.save()
+    # migrate from the json file
+    storage = RecordingStorage(dbfile, migrate_from=jsonfile)
+    cache = Cache(storage=storage)
+    cache.load()
+    assert not os.path.exists(jsonfile)
+    assert storage.loaded == []
+    assert cache.prefix('test')['foo'].path == 'test'
+    assert storage.loaded == ['test']
+    cache.prefix('test')['new'] = 1
+    cache.save()
+    assert storage.changes == {'test': ({'new': 1}, set())}
+    cache.load()
+    assert cache.prefix('other')['bar'] == 'baz'
+    assert cache.prefix('test')['new'] == 1
+    del cache.prefix('test')['foo']
+    cache.save()
+    assert storage.changes == {'test': ({}, {'foo'})}
+    storage.close()
+
+
+class CountingBinaryStorage(BinaryStorage):
+
+    def __init__(self, fpath, compress=True):
+        super().__init__(fpath, compress=compress)
+        self.decoded = []
+
+    def load_prefix(self, prefix):
+        self.decoded.append(prefix)
+        return super().load_prefix(prefix)
+
+
+def test_binary_cache():
+    os.chdir(os.path.abspath(test_dir))
+    for compress in [True, False]:
+        fpath = 'cache/cache.bin'
+        if os.path.exists(fpath):
+            os.remove(fpath)
+        cache = Cache(storage=BinaryStorage(fpath, compress=compress))
+        value = {'str': 'some/path', 'int': -3, 'big': 2**70, 'float': 1.5,
+                 'list': [None, True, False, 'some/path'], 'nested': {'a': []}}
+        cache.prefix('test')['value'] = value
+        cache.prefix('test')['file'] = File('test')
+        cache.prefix('other')['x'] = 1
+        cache.save()
+        storage = CountingBinaryStorage(fpath, compress=compress)
+        cache = Cache(storage=storage)
+        cache.load()
+        assert set(cache.prefixes()) == {'test', 'other'}
+        assert storage.decoded == []
+        assert cache.prefix('test')['value'] == value
+        assert cache.prefix('test')['file'].path == 'test'
+        assert storage.decoded == ['test']
+        cache.prefix('test')['value'] = 1
+        cache.save()
+        cache.load()
+        assert cache.prefix('test')['value'] == 1
+        assert cache.prefix('other')['x'] == 1
+
+
+def test_concurrent_save():
+    os.chdir(os.path.abspath(test_dir))
+    lock = FileLock('cache/c4che.lock')
+    backends = [(JsonStorage, 'cache/concurrent.json'), (SqliteStorage, 'cache/concurrent.sqlite'),
+                (BinaryStorage, 'cache/concurrent.bin')]
+    for cls, fpath in backends:
+        if os.path.exists(fpath):
+            os.remove(fpath)
+        first = Cache(storage=cls(fpath))
+        first.prefix('signaturedb/build')['old'] = 1
+        first.prefix('signaturedb/build')['removed'] = 1
+        first.save()
+        # two processes load the cache and modify it concurrently
+        caches = [Cache(storage=cls(fpath), lock=lock), Cache(storage=cls(fpath), lock=lock)]
+        for cache in caches:
+            cache.load()
+        caches[0].prefix('signaturedb/build')['a'] = 'a'
+        caches[0].prefix('run-counts')['build'] = 1
+        del caches[0].prefix('signaturedb/build')['removed']
+        caches[1].prefix('signaturedb/build')['b'] = 'b'
+        caches[1].prefix('signaturedb/test')['b'] = 'b'
+        caches[1].prefix('run-counts')['test'] = 1
+        for cache in caches:
+            cache.save()
+        cache = Cache(storage=cls(fpath))
+        cache.load()
+        assert cache.prefix('signaturedb/build') == {'old': 1, 'a': 'a', 'b': 'b'}
+        assert cache.prefix('signaturedb/test') == {'b': 'b'}
+        assert cache.prefix('run-counts') == {'build': 1, 'test': 1}
+        for c in caches + [cache, first]:
+            c.storage.close()
+
+
+def test_sharded_cache():
+    os.chdir(os.path.abspath(test_dir))
+    assert shard_prefix('signaturedb/build', '') == 'signaturedb/build'
+    assert split_shard(shard_prefix('signaturedb/build', 'sub/dir')) == ('signaturedb/build', 'sub/dir')
+    directory = 'cache/sharded'
+    if os.path.exists(directory):
+        for f in os.listdir(directory):
+            os.remove(os.path.join(directory, f))
+    cache = Cache(storage=ShardedStorage(directory))
+    cache.prefix(shard_prefix('signaturedb/build', 'a'))['x'] = 1
+    cache.prefix(shard_prefix('signaturedb/build', 'b'))['y'] = File('test')
+    cache.save()
+    assert len(os.listdir(directory)) == 2
+    fpath_b = os.path.join(directory, quote('signaturedb/build@b', safe='') + '.json')
+    mtime = os.stat(fpath_b).st_mtime_ns
+    os.utime(fpath_b, ns=(mtime - 10 ** 9, mtime - 10 ** 9))
+    # only the modified shard is written
+    cache = Cache(storage=ShardedStorage(directory))
+    cache.load()
+    cache.prefix(shard_prefix('signaturedb/build', 'a'))['x'] = 2
+    cache.save()
+    assert os.stat(fpath_b).st_mtime_ns == mtime - 10 ** 9
+    cache = Cache(storage=ShardedStorage(directory))
+    cache.load()
+    assert set(cache.prefixes()) == {'signaturedb/build@a', 'signaturedb/build@b'}
+    assert cache.prefix('signaturedb/build@a')['x'] == 2
+    assert cache.prefix('signaturedb/build@b')['y'].path == 'test'
+
+
+def test_cache_shard():
+    os.chdir(os.path.abspath(test_dir))
+    setup_context()
+    with open(os.path.join('cache', RECURSION_FILE), 'w') as f:
+        json.dump({'version': RECURSION_VERSION, 'directories': {'.': {}, 'sub': {}, 'sub/dir': {}},
+                   'targets': {}}, f)
+    index = recursion.index
+    try:
+        # the shards do not depend on which directories have been loaded
+        recursion.index = RecursionIndex()
+        recursion.index.load('cache')
+        assert cache_shard(os.path.abspath('sub/dir/a.c')) == 'sub/dir'
+        assert cache_shard(os.path.abspath('sub/b.c')) == 'sub'
+        assert cache_shard(os.path.abspath('other/c.c')) == ''
+        assert cache_shard(':glob/' + relocatable_path(os.path.abspath('sub/dir')) + '/1234') == 'sub/dir'
+        assert cache_shard('$PATH') == ''
+        recursion.index = RecursionIndex()
+        assert cache_shard(os.path.abspath('sub/dir/a.c')) == ''
+    finally:
+        recursion.index = index
+        os.remove(os.path.join('cache', RECURSION_FILE))
+
+
+def test_journal_dead_process():
+    os.chdir(os.path.abspath(test_dir))
+    fpath = 'cache/journal.json'
+    journal_path = 'cache/journal.journal'
+    for f in [fpath, journal_path]:
+        if os.path.exists(f):
+            os.remove(f)
+    # a process which was interrupted and has exited since
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    with open(journal_path, 'w') as f:
+        f.write(json.dumps(['test', 'value', 'A', process.pid]) + '\n')
+    cache = Cache(storage=JsonStorage(fpath), journal=Journal(journal_path))
+    cache.load()
+    assert cache.prefix('test')['value'] == 'A'
+    assert not os.path.exists(journal_path)
+    cache.prefix('test')['value'] = 'B'
+    cache.save()
+    # the record of the exited process must not override later saves
+    cache = Cache(storage=JsonStorage(fpath), journal=Journal(journal_path))
+    cache.load()
+    assert cache.prefix('test')['value'] == 'B'
+    # records of running processes are kept
+    with open(journal_path, 'w') as f:
+        f.write(json.dumps(['test', 'value', 'C', os.getppid()]) + '\n')
+    cache = Cache(storage=JsonStorage(fpath), journal=Journal(journal_path))
+    cache.load()
+    assert cache.prefix('test')['value'] == 'C'
+    assert os.path.exists(journal_path)
+    os.remove(journal_path)
+
+
+if __name__ == '__main__':
+    test_cache()
+    test_sqlite_cache()
+    test_binary_cache()
+    test_concurrent_save()
+    test_sharded_cache()
+    test_cache_shard()
+    test_journal_dead_process()
@@ -1,8 +1,10 @@
-from wasp import node, Node
-from wasp.execution import TaskGraph
+from wasp import node, Node, FileNode, directory
+from wasp.execution import TaskGraph, run_task, limit
 from wasp.signature import UnchangedSignature
 from wasp.task import Task
 from tests import setup_context
+from wasp.main import init_context
+import wasp
 
 
 class DummyTask(Task):
@@ -58,7 +60,184 @@ def test_simple_dependencies():
     graph.task_completed(p3, True)
 
 
+class RestatTask(Task):
+    def __init__(self, target, value=None):
+        super().__init__(targets=target)
+        self._value = value
+
+    def _run(self):
+        if self._value is None:
+            self.untouch(self.targets)
+        else:
+            self.touch(self.targets[0], value=self._value)
+        self.success = True
+
+
+def test_restat():
+    setup_context()
+    testdir = directory(__file__).join('test-dir')
+    testdir.mkdir()
+    fpath = testdir.join('restat.txt').path
+    with open(fpath, 'w') as f:
+        f.write('asdf')
+    target = FileNode(fpath)
+    sig = target.signature()
+    sig.refresh()
+    old_value = sig.value
+    t = RestatTask(target)
+    with open(fpath, 'w') as f:
+        f.write('blabla')
+    assert run_task(t, None)
+    assert len(t.touched()) == 0
+    # the target was not touched, thus the signature is not refreshed
+    assert target.signature().value == old_value
+    t = RestatTask(target, value='1234')
+    assert t.touched() == [target]
+    assert run_task(t, None)
+    # the value provided by the task is used as is
+    assert target.signature().value == '1234'
+    graph = TaskGraph([RestatTask(target), DummyTask().use(target)])
+    t = graph.pop()
+    assert isinstance(t, RestatTask)
+    run_task(t, None)
+    graph.task_completed(t, True)
+    # untouched targets are still promoted, s.t. consumers may run
+    assert target.key in graph._leafs
+
+
+def test_journal():
+    setup_context()
+    src = node(':journal/src')
+    mid = node(':journal/mid')
+    tgt = node(':journal/tgt')
+    for i, n in enumerate([src, mid, tgt]):
+        n.write(value=i)
+    t1 = DummyTask().use(src).produce(mid)
+    t2 = DummyTask().use(mid).produce(tgt)
+    graph = TaskGraph([t1, t2])
+    p = graph.pop()
+    assert p == t1
+    assert run_task(p, None)
+    graph.task_completed(p, True)
+    wasp.ctx.cache.sync()
+    # simulate an interrupted run, i.e. the cache is never saved
+    wasp.ctx.__init__()
+    init_context(directory(__file__))
+    assert node(':journal/src').read()['value'].value == 0
+    t1 = DummyTask().use(src).produce(mid)
+    t2 = DummyTask().use(mid).produce(tgt)
+    graph = TaskGraph([t1, t2])
+    assert graph.pop() == t2
+
+
+def test_journal_siblings():
+    setup_context()
+    src = node(':journal-siblings/src')
+    a = node(':journal-siblings/a')
+    b = node(':journal-siblings/b')
+    for i, n in enumerate([src, a, b]):
+        n.write(value=i)
+    graph = TaskGraph([DummyTask().use(src).produce(a)])
+    p = graph.pop()
+    assert run_task(p, None)
+    graph.task_completed(p, True)
+    graph = TaskGraph([DummyTask().use(src).produce(b)])
+    p = graph.pop()
+    assert run_task(p, None)
+    graph.task_completed(p, True)
+    wasp.ctx.save()
+    src.write(value=3)
+    t1 = DummyTask().use(src).produce(a)
+    t2 = DummyTask().use(src).produce(b)
+    graph = TaskGraph([t1, t2])
+    p = graph.pop()
+    assert run_task(p, None)
+    graph.task_completed(p, True)
+    wasp.ctx.cache.sync()
+    # simulate an interrupted run, the sibling consuming the same source has not run
+    wasp.ctx.__init__()
+    init_context(directory(__file__))
+    t1 = DummyTask().use(src).produce(a)
+    t2 = DummyTask().use(src).produce(b)
+    graph = TaskGraph([t1, t2])
+    remaining = t2 if p.targets[0].key == a.key else t1
+    assert graph.pop() is remaining
+    assert graph.pop() is None
+
+
+def test_fingerprint():
+    setup_context()
+    src = node(':fingerprint/src')
+    tgt = node(':fingerprint/tgt')
+    src.write(value=1)
+    t = DummyTask().use(src, foo=1).produce(tgt)
+    graph = TaskGraph([t])
+    assert graph.pop() == t
+    assert run_task(t, None)
+    graph.task_completed(t, True)
+    wasp.ctx.save()
+    wasp.ctx.__init__()
+    init_context(directory(__file__))
+    graph = TaskGraph([DummyTask().use(src, foo=1).produce(tgt)])
+    assert graph.pop() is None
+    t = DummyTask().use(src, foo=2).produce(tgt)
+    graph = TaskGraph([t])
+    assert graph.pop() == t
+    # functions are identified by their code
+    namespace = {}
+    exec('def fun(x):\n    return x + 1\n', namespace)
+    fun1 = namespace['fun']
+    exec('def fun(x):\n    return x + 1\n', namespace)
+    fun2 = namespace['fun']
+    exec('def fun(x):\n    return x + 2\n', namespace)
+    fun3 = namespace['fun']
+    assert DummyTask().use(fun=fun1).fingerprint() == DummyTask().use(fun=fun2).fingerprint()
+    assert DummyTask().use(fun=fun1).fingerprint() != DummyTask().use(fun=fun3).fingerprint()
+    # functions added to task.run are part of the fingerprint
+    exec('def fun(t):\n    return None\n', namespace)
+    fun1 = namespace['fun']
+    exec('def fun(t):\n    return None\n', namespace)
+    fun2 = namespace['fun']
+    exec('def fun(t):\n    return 1\n', namespace)
+    fun3 = namespace['fun']
+    assert Task(fun=fun1).fingerprint() == Task(fun=fun2).fingerprint()
+    assert Task(fun=fun1).fingerprint() != Task(fun=fun3).fingerprint()
+    assert Task(fun=fun1).fingerprint() != Task().fingerprint()
+    t = Task(fun=fun1).use(src).produce(tgt)
+    graph = TaskGraph([t])
+    assert graph.pop() == t
+    assert run_task(t, None)
+    graph.task_completed(t, True)
+    graph = TaskGraph([Task(fun=fun2).use(src).produce(tgt)])
+    assert graph.pop() is None
+    t = Task(fun=fun3).use(src).produce(tgt)
+    graph = TaskGraph([t])
+    assert graph.pop() == t
+
+
+def test_limit():
+    setup_context()
+    n1 = node(':limit/n1')
+    n2 = node(':limit/n2')
+    n3 = node(':limit/n3')
+    t1 = DummyTask().produce(n1)
+    t2 = DummyTask().use(n1).produce(n2)
+    t3 = DummyTask().produce(n3)
+    assert limit([t1, t2, t3], [n2]) == [t1, t2]
+    assert limit([t1, t2, t3], [n3]) == [t3]
+    assert limit([t1, t2, t3], [node(':limit/unknown')]) == []
+    graph = TaskGraph([t1, t2, t3], produce=[n1])
+    assert graph.pop() == t1
+    graph.task_completed(t1, True)
+    assert graph.completed
+
+
 if __name__ == '__main__':
     test_simple_dependencies()
     test_always()
     test_not_run()
+    test_restat()
+    test_journal()
+    test_journal_siblings()
+    test_fingerprint()
+    test_limit()
@@ -1,5 +1,9 @@
-from wasp import directory, Directory, file, factory, File
-from wasp.fs import FileCollection
+from wasp import directory, Directory, file, factory, File, ArgumentCollection
+from wasp.fs import FileCollection, write_if_changed, glob, GlobNode, relocatable_path, expand_path
+from wasp import ctx
+from wasp.signature import FileSignature
+from tests import setup_context
+import os
 
 
 def prepare():
@@ -75,8 +79,79 @@ def test_file_collection():
         assert f.extension == 'asdf'
 
 
+def test_write_if_changed():
+    prepare()
+    curdir = directory(__file__)
+    testdir = directory(curdir.join('test-dir'))
+    f = testdir.join('written.txt')
+    changed, value = write_if_changed(f, 'asdf')
+    assert changed
+    mtime = os.stat(f.path).st_mtime_ns
+    changed, same_value = write_if_changed(f, 'asdf')
+    assert not changed
+    assert same_value == value
+    assert os.stat(f.path).st_mtime_ns == mtime
+    changed, new_value = write_if_changed(f, b'blabla')
+    assert changed
+    assert new_value != value
+
+
+def test_glob_node():
+    setup_context()
+    prepare()
+    testdir = directory(directory(__file__).join('test-dir'))
+    n = glob(testdir, r'.*\.txt$')
+    assert isinstance(n, GlobNode)
+    assert n.matches == sorted([testdir.join('a.txt').path, testdir.join('c.txt').path,
+                                testdir.join('dira/dirb/b.txt').path])
+    v = n.signature().refresh()
+    assert v is not None
+    assert n.signature().refresh() == v
+    with open(testdir.join('dira/d.txt').path, 'w') as f:
+        f.write('asdf')
+    newv = n.signature().refresh()
+    assert newv != v
+    assert testdir.join('dira/d.txt').path in n.read()['matches'].value
+    flat = glob(testdir, r'.*\.txt$', exclude='c', recursive=False)
+    assert flat.matches == [testdir.join('a.txt').path]
+    assert flat.key != n.key
+    # the keys remain valid if the project is moved
+    assert n.key.startswith(':glob/' + relocatable_path(os.path.abspath(testdir.path)) + '/')
+    assert n.key.startswith(':glob/@')
+    listings = ctx.cache.prefix('directory-listings')
+    assert relocatable_path(os.path.abspath(testdir.join('dira').path)) in listings
+    assert all(k.startswith('@') for k in listings.keys())
+    failed = False
+    try:
+        n.write(ArgumentCollection())
+    except TypeError:
+        failed = True
+    assert failed
+
+
+def test_relocatable_path():
+    setup_context()
+    builddir = os.path.abspath(ctx.builddir.path)
+    fpath = os.path.join(builddir, 'sub', 'foo.o')
+    relocated = relocatable_path(fpath)
+    assert relocated == '@builddir/sub/foo.o'
+    assert expand_path(relocated) == fpath
+    assert relocatable_path('relative/path') == 'relative/path'
+    assert relocatable_path('/some/other/path') == '/some/other/path'
+    sig = FileSignature(fpath, value='1234', valid=True)
+    d = factory.to_json(sig)
+    assert d['key'] == relocated
+    assert d['path'] == relocated
+    assert factory.from_json(d).key == fpath
+    f = File(fpath)
+    assert factory.from_json(factory.to_json(f)).path == f.path
+
+
 if __name__ == '__main__':
     test_directory()
     test_serialize()
     test_file()
     test_file_collection()
+    test_write_if_changed()
+    test_glob_node()
+    test_relocatable_path()
@@ -0,0 +1,52 @@
+from wasp import directory, memoize
+from tests import setup_context
+
+
+calls = []
+
+
+def prepare():
+    curdir = directory(__file__)
+    testdir = directory(curdir.join('test-dir'))
+    testdir.remove(recursive=True)
+    testdir.mkdir()
+    with open(testdir.join('version.txt').path, 'w') as f:
+        f.write('1.0')
+    return testdir
+
+
+def test_memoize():
+    ctx = setup_context()
+    testdir = prepare()
+    version_file = testdir.join('version.txt').path
+
+    @memoize(depends=version_file, env='WASP_MEMO_TEST')
+    def read_version(prefix):
+        calls.append(prefix)
+        with open(version_file, 'r') as f:
+            return prefix + f.read()
+
+    assert read_version('v') == 'v1.0'
+    assert read_version('v') == 'v1.0'
+    assert calls == ['v']
+    # different arguments
+    assert read_version(prefix='r') == 'r1.0'
+    assert calls == ['v', 'r']
+    # the values are persisted in the cache
+    ctx.save()
+    ctx.load()
+    assert read_version('v') == 'v1.0'
+    assert calls == ['v', 'r']
+    # changing a dependency invalidates the value
+    with open(version_file, 'w') as f:
+        f.write('2.0')
+    assert read_version('v') == 'v2.0'
+    assert calls == ['v', 'r', 'v']
+    ctx.env['WASP_MEMO_TEST'] = 'foo'
+    assert read_version('v') == 'v2.0'
+    assert calls == ['v', 'r', 'v', 'v']
+    del ctx.env['WASP_MEMO_TEST']
+
+
+if __name__ == '__main__':
+    test_memoize()
@@ -1,5 +1,5 @@
 from wasp.fs import directory
-from wasp import FileNode, SymbolicNode, ArgumentCollection
+from wasp import FileNode, SymbolicNode, EnvNode, ArgumentCollection, node, ctx, Task
 from tests import setup_context
 
 
@@ -53,7 +53,30 @@ def test_symbolic_node():
     assert node2.signature().value == v
 
 
+def test_env_node():
+    setup_context()
+    ctx.env['WASP_TEST_VAR'] = 'foo'
+    n = node('$WASP_TEST_VAR')
+    assert isinstance(n, EnvNode)
+    v = n.signature().refresh()
+    assert v is not None
+    assert v != 'foo'
+    assert n.read()['wasp_test_var'].value == 'foo'
+    ctx.env['WASP_TEST_VAR'] = 'bar'
+    assert n.signature().refresh() != v
+    del ctx.env['WASP_TEST_VAR']
+    assert n.signature().refresh() is not None
+    assert 'wasp_test_var' not in n.read()
+    ctx.env['WASP_TEST_VAR'] = 'foo'
+    assert n.signature().refresh() == v
+    t = Task().use('$WASP_TEST_VAR')
+    assert n.key in [x.key for x in t.sources]
+    t.check()
+    assert t.arguments['wasp_test_var'].value == 'foo'
+
+
 if __name__ == '__main__':
     test_file_node()
     test_symbolic_node()
+    test_env_node()
 
@@ -0,0 +1,92 @@
+import os
+import sys
+
+from wasp import directory, FileNode, node, Argument
+from wasp.noop import Manifest, up_to_date, MANIFEST_FILE
+from wasp.task import Task
+from tests import setup_context
+
+
+def prepare():
+    curdir = directory(__file__)
+    testdir = directory(curdir.join('test-dir'))
+    testdir.remove(recursive=True)
+    testdir.mkdir()
+    for name in ['src.txt', 'tgt.txt']:
+        with open(testdir.join(name).path, 'w') as f:
+            f.write(name)
+    return testdir
+
+
+def make_manifest(testdir):
+    manifest = Manifest()
+    task = Task(sources=FileNode(testdir.join('src.txt').path), targets=FileNode(testdir.join('tgt.txt').path))
+    task.use(node('$WASP_NOOP_TEST'))
+    manifest.track(task)
+    manifest.executed('build', [task])
+    manifest.requested(['build'])
+    return manifest
+
+
+def test_manifest():
+    setup_context()
+    testdir = prepare()
+    builddir = testdir.mkdir('build').path
+    argv = sys.argv[1:]
+    make_manifest(testdir).save(builddir, [], [], True)
+    assert up_to_date(builddir, argv) == ''
+    assert up_to_date(builddir, argv + ['-j', '2']) is None
+    # environment variables used by tasks are recorded
+    os.environ['WASP_NOOP_TEST'] = '1'
+    assert up_to_date(builddir, argv) is None
+    del os.environ['WASP_NOOP_TEST']
+    assert up_to_date(builddir, argv) == ''
+    # new files in the directories of the sources
+    with open(testdir.join('new.txt').path, 'w') as f:
+        f.write('new')
+    assert up_to_date(builddir, argv) is None
+    make_manifest(testdir).save(builddir, [], [], True)
+    assert up_to_date(builddir, argv) == ''
+    with open(testdir.join('src.txt').path, 'a') as f:
+        f.write('changed')
+    assert up_to_date(builddir, argv) is None
+    # a task has run, thus the manifest is removed
+    manifest = make_manifest(testdir)
+    manifest.invalidate()
+    manifest.save(builddir, [], [], True)
+    assert not os.path.exists(os.path.join(builddir, MANIFEST_FILE))
+    # commands without tasks may have side effects
+    manifest = make_manifest(testdir)
+    manifest.requested(['build', 'clear-cache'])
+    manifest.save(builddir, [], [], True)
+    assert not os.path.exists(os.path.join(builddir, MANIFEST_FILE))
+
+
+def test_manifest_env():
+    ctx = setup_context()
+    testdir = prepare()
+    builddir = testdir.mkdir('build').path
+    argv = sys.argv[1:]
+    os.environ.pop('NOOP_TEST_FLAGS', None)
+    ctx.env.load_from_env()
+    # variables read by build scripts, e.g. using Argument.retrieve_all()
+    assert Argument('noop_test_flags').retrieve_all().value is None
+    make_manifest(testdir).save(builddir, [], [], True)
+    assert up_to_date(builddir, argv) == ''
+    os.environ['NOOP_TEST_FLAGS'] = '-O2'
+    assert up_to_date(builddir, argv) is None
+    # the whole environment has been read
+    ctx.env.load_from_env()
+    dict(ctx.env.items())
+    make_manifest(testdir).save(builddir, [], [], True)
+    assert up_to_date(builddir, argv) == ''
+    os.environ['NOOP_TEST_OTHER'] = '1'
+    assert up_to_date(builddir, argv) is None
+    del os.environ['NOOP_TEST_FLAGS']
+    del os.environ['NOOP_TEST_OTHER']
+    ctx.env.load_from_env()
+
+
+if __name__ == '__main__':
+    test_manifest()
+    test_manifest_env()
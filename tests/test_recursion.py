@@ -0,0 +1,118 @@
+from wasp import decorators, directory, Command, _recurse_files
+from wasp import recursion
+from wasp.main import load_recursive
+from wasp.recursion import RecursionIndex, TOPDIR, directory_key
+from wasp.task import Task
+from tests import setup_context
+
+
+def prepare():
+    curdir = directory(__file__)
+    testdir = directory(curdir.join('test-dir'))
+    testdir.remove(recursive=True)
+    for name in ['a', 'b', 'c']:
+        d = directory(testdir.join(name))
+        d.mkdir()
+        with open(d.join('build.py').path, 'w') as f:
+            f.write('# {0}\n'.format(name))
+    return testdir
+
+
+def load(index, directories):
+    """
+    Simulates loading the build scripts of ``directories``, which is a list
+    of ``(directory, [command names])`` tuples, and returns the registered commands.
+    """
+    ret = {}
+    ncommands = len(decorators.commands)
+    try:
+        with index.loading(TOPDIR, None):
+            pass
+        for d, names in directories:
+            with index.loading(d, TOPDIR):
+                for name in names:
+                    com = Command(name, lambda: None)
+                    decorators.commands.append(com)
+                    ret[(d, name)] = com
+    finally:
+        del decorators.commands[ncommands:]
+    return ret
+
+
+def test_select():
+    setup_context()
+    testdir = prepare()
+    a = directory_key(testdir.join('a').path)
+    b = directory_key(testdir.join('b').path)
+    index = RecursionIndex()
+    index.load(testdir.path)
+    # nothing has been recorded so far
+    assert index.select(['build', '-t', 'a.txt'], set()) is None
+    commands = load(index, [(a, ['build']), (b, ['build', 'doc'])])
+    index.loaded(complete=True)
+    ta = Task(targets='a.txt')
+    tb = Task(sources='a.txt', targets='b.txt')
+    index.own(commands[(a, 'build')], [ta])
+    index.own(commands[(b, 'build')], tb)
+    index.record([ta, tb])
+    assert index.select(['build', '-t', 'a.txt'], set()) == {TOPDIR, a}
+    assert index.select(['build', '--target=a.txt'], set()) == {TOPDIR, a}
+    assert index.select(['doc'], set()) == {TOPDIR, b}
+    # requires all directories
+    assert index.select(['build', '-t', 'b.txt'], set()) is None
+    assert index.select(['build'], set()) is None
+    # unknown target
+    assert index.select(['build', '-t', 'c.txt'], set()) is None
+    # command not declared by a recursed directory
+    assert index.select(['clean', 'build', '-t', 'a.txt'], {'clean'}) is None
+    # the index is persisted
+    index.save()
+    index = RecursionIndex()
+    index.load(testdir.path)
+    assert index.select(['build', '-t', 'a.txt'], set()) == {TOPDIR, a}
+    # changing a build script invalidates the index
+    with open(testdir.join('b', 'build.py').path, 'a') as f:
+        f.write('# changed\n')
+    assert index.select(['build', '-t', 'a.txt'], set()) is None
+    # directories which register more than commands are always loaded
+    c = directory_key(testdir.join('c').path)
+    index = RecursionIndex()
+    commands = load(index, [(a, ['build']), (b, ['build'])])
+    nconfig = len(decorators.config)
+    try:
+        with index.loading(c, TOPDIR):
+            decorators.config.append(lambda: None)
+    finally:
+        del decorators.config[nconfig:]
+    index.loaded(complete=True)
+    ta = Task(targets='a.txt')
+    index.own(commands[(a, 'build')], [ta])
+    index.record([ta])
+    assert index.select(['build', '-t', 'a.txt'], set()) == {TOPDIR, a, c}
+
+
+def test_load_unknown_directory():
+    setup_context()
+    testdir = prepare()
+    paths = [testdir.join(name).path for name in ['a', 'b', 'c']]
+    a, b, c = [directory_key(path) for path in paths]
+    recurse_files = list(_recurse_files)
+    index = recursion.index
+    try:
+        recursion.index = RecursionIndex()
+        _recurse_files[:] = paths[:2]
+        assert len(load_recursive()) == 2
+        assert recursion.index.directories == {a, b}
+        assert load_recursive({TOPDIR, a}) == [testdir.join('a', 'build.py').path]
+        # a directory added since the index was stored is loaded, together with all others
+        _recurse_files.append(paths[2])
+        assert len(load_recursive({TOPDIR, a})) == 3
+        assert recursion.index.known(c)
+    finally:
+        _recurse_files[:] = recurse_files
+        recursion.index = index
+
+
+if __name__ == '__main__':
+    test_select()
+    test_load_unknown_directory()
@@ -0,0 +1,127 @@
+from wasp.server import Server, _Connection, _StreamWriter
+from wasp.noop import manifest as noop_manifest
+from wasp import ctx, directory, Command
+from wasp.shell import run_attached
+from tests import setup_context
+import json
+import os
+import socket
+
+
+def test_connection():
+    server, client = socket.socketpair()
+    connection = _Connection(server)
+    client.sendall(b'{"argv": ["build"], "env": {}}\n')
+    assert connection.receive() == {'argv': ['build'], 'env': {}}
+    out = _StreamWriter(connection, 'stdout', True)
+    assert out.isatty()
+    print('hello', file=out)
+    connection.send({'exit': 0})
+    connection.close()
+    with client, client.makefile('rb') as f:
+        msgs = [json.loads(line.decode('UTF-8')) for line in f]
+    assert ''.join(msg.get('stdout', '') for msg in msgs) == 'hello\n'
+    assert msgs[-1] == {'exit': 0}
+    # the output is dropped once the client has gone away
+    connection.send({'stdout': 'dropped'})
+
+
+def hello_fun():
+    print('hello from server')
+
+
+def child_fun():
+    run_attached('echo output of child && echo error of child 1>&2')
+
+
+def prepare():
+    setup_context()
+    curdir = directory(__file__)
+    testdir = directory(curdir.join('test-dir'))
+    testdir.remove(recursive=True)
+    testdir.mkdir()
+    script = testdir.join('build.py').path
+    with open(script, 'w') as f:
+        f.write('# build script\n')
+    ctx.commands.add(Command('hello', hello_fun))
+    ctx.commands.add(Command('child', child_fun))
+    return testdir, script
+
+
+def request(server, argv, listening=True):
+    """
+    Sends a request to ``server`` through a socket and returns the messages of the response.
+    """
+    if listening:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(server._path)
+        sock, _ = server._sock.accept()
+    else:
+        sock, client = socket.socketpair()
+    client.sendall((json.dumps({'argv': argv, 'env': dict(os.environ)}) + '\n').encode('UTF-8'))
+    connection = _Connection(sock)
+    try:
+        restart = server._handle(connection)
+    finally:
+        connection.close()
+    with client, client.makefile('rb') as f:
+        msgs = [json.loads(line.decode('UTF-8')) for line in f]
+    return restart, msgs
+
+
+def test_request():
+    testdir, script = prepare()
+    server = Server(os.getcwd(), [script])
+    server._bind()
+    try:
+        noop_manifest.track(object())
+        restart, msgs = request(server, ['hello'])
+    finally:
+        server._unbind()
+    assert not restart
+    assert 'hello from server' in ''.join(msg.get('stdout', '') for msg in msgs)
+    assert msgs[-1] == {'exit': 0}
+    # the state of the previous invocation is not kept
+    assert noop_manifest._tasks == []
+    assert not os.path.exists(server._path)
+
+
+def test_child_output():
+    testdir, script = prepare()
+    server = Server(os.getcwd(), [script])
+    server._bind()
+    try:
+        restart, msgs = request(server, ['child'])
+    finally:
+        server._unbind()
+    # the output of processes writing to the file descriptors of the server is forwarded
+    assert 'output of child\n' in ''.join(msg.get('stdout', '') for msg in msgs)
+    assert 'error of child\n' in ''.join(msg.get('stderr', '') for msg in msgs)
+    assert msgs[-1] == {'exit': 0}
+
+
+def test_restart():
+    testdir, script = prepare()
+    registered = testdir.join('registered.txt').path
+    with open(registered, 'w') as f:
+        f.write('a')
+    noop_manifest.watch(registered)
+    try:
+        server = Server(os.getcwd(), [script])
+    finally:
+        noop_manifest._files.discard(registered)
+    restart, msgs = request(server, ['hello'], listening=False)
+    assert not restart and msgs[-1] == {'exit': 0}
+    # files registered by the build scripts are watched
+    with open(registered, 'w') as f:
+        f.write('changed')
+    restart, msgs = request(server, ['hello'], listening=False)
+    assert restart
+    assert msgs == [{'restart': True}]
+
+
+if __name__ == '__main__':
+    test_connection()
+    test_request()
+    test_child_output()
+    test_restart()
@@ -0,0 +1,222 @@
+from time import monotonic, sleep
+
+import io
+import os
+import sys
+
+from wasp import log, directory
+from wasp.shell import run, shell, ProcessOut, COMMAND_NOT_FOUND
+from wasp.logging import Logger
+from wasp.task import TaskFailedError
+from tests import setup_context
+
+
+def test_run():
+    exit_code, out = run('echo foo && echo bar 1>&2 && echo baz && printf last')
+    assert exit_code == 0
+    assert out.stdout == 'foo\nbaz\nlast'
+    assert out.stderr == 'bar'
+    exit_code, out = run('exit 3')
+    assert exit_code == 3
+    assert out.stdout == '' and out.stderr == ''
+
+    exit_code, out = run(['printf', '%s\\n', 'a b', '$HOME'])
+    assert exit_code == 0
+    assert out.stdout == 'a b\n$HOME'
+    exit_code, out = run(['this-command-does-not-exist'])
+    assert exit_code == COMMAND_NOT_FOUND
+    assert out.stderr != ''
+
+
+def test_argv():
+    setup_context()
+    t = shell(['printf', '%s\\n', '{src}', '--out={tgt}', '{flags}', '{missing}'],
+              sources=['a b.txt', 'c.txt'], targets='d.txt').use(flags=['-x', '', '-y'])
+    t.log = log
+    t.run()
+    assert t.success
+    assert t.out.stdout.split('\n') == ['a b.txt', 'c.txt', '--out=d.txt', '-x', '-y']
+    assert t.commandstring == "printf '%s\\n' 'a b.txt' c.txt --out=d.txt -x -y"
+
+
+def test_env():
+    setup_context()
+    t1 = shell(['sh', '-c', 'echo $FOO']).use(env={'FOO': 'bar'})
+    t2 = shell(['sh', '-c', 'echo $FOO']).use(env={'FOO': 'bar'})
+    assert t1._make_env() is t2._make_env()
+    assert t1._make_env()['PATH'] == os.environ['PATH']
+    assert shell('true')._make_env() is None
+    t3 = shell(['sh', '-c', 'echo $FOO']).use(env={'FOO': 'bar'}, clearenv=True)
+    assert t3._make_env() == {'FOO': 'bar'}
+    t1.log = log
+    t1.run()
+    assert t1.out.stdout == 'bar'
+
+
+def test_timeout():
+    start = monotonic()
+    exit_code, out = run('echo started && sleep 10', timeout=0.2)
+    assert monotonic() - start < 5
+    assert exit_code is None
+    assert out.stdout == 'started'
+    assert 'timeout' in out.stderr
+    start = monotonic()
+    exit_code, out = run('sleep 0.1', timeout=5)
+    assert exit_code == 0
+    assert monotonic() - start < 5
+
+
+def test_timeout_children():
+    setup_context()
+    testdir = directory(__file__).join('test-dir')
+    testdir.mkdir()
+    marker = testdir.join('timeout-marker.txt').path
+    if os.path.exists(marker):
+        os.remove(marker)
+    # the children of the process are killed as well
+    exit_code, out = run('(sleep 0.5 && echo late > {0}) & wait'.format(marker), timeout=0.2)
+    assert exit_code is None
+    sleep(1)
+    assert not os.path.exists(marker)
+
+
+def test_shell_timeout():
+    setup_context()
+    t = shell('sleep 10').use(timeout=0.2)
+    t.log = log
+    t.run()
+    assert not t.success
+    # the timeout is enforced if the output is not captured
+    start = monotonic()
+    t = shell('sleep 10', pretty=False).use(timeout=0.2)
+    t.log = log
+    t.run()
+    assert not t.success
+    assert monotonic() - start < 5
+
+
+def test_fail_pattern():
+    lines = []
+    start = monotonic()
+    exit_code, out = run('echo foo && echo "main.c:1: error: bar" 1>&2 && sleep 10',
+                         fail_pattern='error:', on_line=lambda line, stdout: lines.append((line, stdout)))
+    assert monotonic() - start < 5
+    assert exit_code is None
+    assert lines[:2] == [('foo', True), ('main.c:1: error: bar', False)]
+    assert 'error:' in lines[-1][0] and not lines[-1][1]
+    assert out.stderr.split('\n')[0] == 'main.c:1: error: bar'
+    exit_code, out = run('echo foo', fail_pattern='error:')
+    assert exit_code == 0
+    # the children of the process are killed as well
+    testdir = directory(__file__).join('test-dir')
+    testdir.mkdir()
+    marker = testdir.join('fail-marker.txt').path
+    if os.path.exists(marker):
+        os.remove(marker)
+    exit_code, out = run('(sleep 0.5 && echo late > {0}) & echo error: && wait'.format(marker),
+                         fail_pattern='error:')
+    assert exit_code is None
+    sleep(1)
+    assert not os.path.exists(marker)
+    # the output of commands which are not captured cannot be matched
+    setup_context()
+    t = shell('echo error:', pretty=False).use(fail_pattern='error:')
+    t.log = log
+    try:
+        t.run()
+        failed = False
+    except TaskFailedError:
+        failed = True
+    assert failed
+
+
+def test_stream():
+    setup_context()
+    buf = io.StringIO()
+    t = shell('echo out && echo err 1>&2', targets='out.txt').use(fail_pattern='^never$')
+    t.log = Logger(io=buf, verbosity=Logger.INFO, pretty=False)
+    t.run()
+    assert t.success
+    assert buf.getvalue().split('\n')[:2] == ['[out.txt]  out', '[out.txt]  err']
+    assert t.out.stdout == 'out' and t.out.stderr == 'err'
+    buf = io.StringIO()
+    t = shell('echo out && echo err 1>&2', targets='out.txt')
+    t.log = Logger(io=buf, verbosity=Logger.INFO, pretty=False, grouped=True)
+    t.run()
+    assert '[out.txt]' not in buf.getvalue()
+    assert 'err' in buf.getvalue()
+
+
+def test_process_out():
+    curdir = directory(__file__)
+    testdir = directory(curdir.join('test-dir'))
+    testdir.remove(recursive=True)
+    logfile = testdir.join('logs', 'out.log').path
+    out = ProcessOut(limit=40, log=logfile)
+    out.write('first')
+    out.write('error', stdout=False)
+    assert out.log is None and not out.truncated
+    for i in range(100):
+        out.write('line {0}'.format(i))
+    out.write('last error', stdout=False)
+    out.finished()
+    assert out.truncated
+    assert out.log == logfile
+    stdout = out.stdout.split('\n')
+    assert stdout[0] == 'first'
+    assert stdout[-1] == 'line 99'
+    assert 'lines omitted' in out.stdout
+    assert out.stderr == 'error\nlast error'
+    assert out.merged.split('\n')[-1] == 'last error'
+    assert len(out.merged) < 100
+    view = out.map_log()
+    try:
+        lines = view[:].decode('UTF-8').split('\n')
+    finally:
+        view.close()
+    assert lines[:3] == ['first', 'error', 'line 0']
+    assert lines[-3:] == ['line 99', 'last error', '']
+    # output below the limit is not written to the log
+    out = ProcessOut(log=testdir.join('logs', 'small.log').path)
+    out.write('foo')
+    out.finished()
+    assert out.log is None and out.map_log() is None
+    assert not os.path.exists(testdir.join('logs', 'small.log').path)
+    # without a log, the complete output is kept
+    out = ProcessOut(limit=40)
+    for i in range(100):
+        out.write('line {0}'.format(i))
+    out.finished()
+    assert not out.truncated
+    assert out.stdout.split('\n') == ['line {0}'.format(i) for i in range(100)]
+    exit_code, out = run([sys.executable, '-c', 'for i in range(100000): print("line", i)'])
+    assert exit_code == 0
+    assert out.stdout.split('\n') == ['line {0}'.format(i) for i in range(100000)]
+
+
+def test_run_log():
+    curdir = directory(__file__)
+    testdir = directory(curdir.join('test-dir'))
+    testdir.remove(recursive=True)
+    logfile = testdir.join('logs', 'seq.log').path
+    exit_code, out = run('seq 1 100000', log=logfile)
+    assert exit_code == 0
+    assert out.truncated
+    assert out.stdout.startswith('1\n2\n')
+    assert out.stdout.endswith('99999\n100000')
+    assert out.log == logfile
+    with open(logfile, 'r') as f:
+        assert f.read() == ''.join('{0}\n'.format(i) for i in range(1, 100001))
+
+
+if __name__ == '__main__':
+    test_run()
+    test_argv()
+    test_env()
+    test_timeout()
+    test_timeout_children()
+    test_shell_timeout()
+    test_fail_pattern()
+    test_stream()
+    test_process_out()
+    test_run_log()
@@ -0,0 +1,119 @@
+import io
+import os
+import tempfile
+
+from wasp import log, TaskFailedError
+from wasp.worker import WorkerTask, python_worker, serve, read_message, write_message, pool, worker_checksum
+from tests import setup_context
+
+
+HANDLER = '''
+import os
+import sys
+
+
+def handle(arguments):
+    if arguments[0] == 'fail':
+        raise ValueError('failed')
+    if arguments[0] == 'crash':
+        os._exit(3)
+    print(os.getpid())
+    print(' '.join(arguments[1:]), file=sys.stderr)
+'''
+
+
+def prepare(tmpdir):
+    fpath = os.path.join(tmpdir, 'handler.py')
+    with open(fpath, 'w') as f:
+        f.write(HANDLER)
+    return fpath
+
+
+def make_task(fpath, *arguments):
+    class EchoTask(WorkerTask):
+        worker = python_worker(os.path.abspath(fpath) + ':handle')
+
+        def worker_arguments(self):
+            return list(arguments)
+
+    t = EchoTask(always=True)
+    t.log = log
+    return t
+
+
+def test_serve():
+    requests = io.BytesIO()
+    write_message(requests, {'request_id': 1, 'arguments': ['foo'], 'cwd': None})
+    write_message(requests, {'request_id': 2, 'arguments': ['bar'], 'cwd': None})
+    requests.seek(0)
+    responses = io.BytesIO()
+
+    def handler(arguments):
+        print(arguments[0])
+        return 0 if arguments[0] == 'foo' else 2
+
+    serve(handler, stdin=requests, stdout=responses)
+    responses.seek(0)
+    assert read_message(responses) == {'request_id': 1, 'exit_code': 0, 'output': 'foo\n'}
+    assert read_message(responses) == {'request_id': 2, 'exit_code': 2, 'output': 'bar\n'}
+    assert read_message(responses) is None
+
+
+def test_worker_task():
+    setup_context()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fpath = prepare(tmpdir)
+        pids = set()
+        for i in range(3):
+            t = make_task(fpath, 'echo', str(i))
+            t.run()
+            assert t.success
+            pid, arg = t.output.strip().split('\n')
+            assert arg == str(i)
+            pids.add(pid)
+        # all requests were handled by the same process
+        assert len(pids) == 1
+        assert pids.pop() != str(os.getpid())
+        t = make_task(fpath, 'fail')
+        t.run()
+        assert not t.success
+        assert 'ValueError: failed' in t.output
+        t = make_task(fpath, 'crash')
+        try:
+            t.run()
+            assert False
+        except TaskFailedError:
+            pass
+        # a new worker is started after the crash
+        t = make_task(fpath, 'echo', 'again')
+        t.run()
+        assert t.success
+        pool.shutdown()
+
+
+def test_handler_changed():
+    setup_context()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fpath = prepare(tmpdir)
+        t = make_task(fpath, 'echo', 'before')
+        fingerprint = t.fingerprint()
+        t.run()
+        assert t.success
+        pid = t.output.split('\n')[0]
+        # paths are relocatable, thus equivalent paths result in the same checksum
+        assert worker_checksum(t.worker) == worker_checksum(python_worker(os.path.relpath(fpath) + ':handle'))
+        with open(fpath, 'a') as f:
+            f.write('\n# edited\n')
+        t = make_task(fpath, 'echo', 'after')
+        assert t.fingerprint() != fingerprint
+        t.run()
+        assert t.success
+        # the worker running the old handler has been replaced
+        assert t.output.split('\n')[0] != pid
+        pool.shutdown()
+
+
+if __name__ == '__main__':
+    test_serve()
+    test_worker_task()
+    test_handler_changed()
@@ -1,11 +1,13 @@
 import json
 import os
+import shlex
 from json import JSONDecodeError
 
 from wasp import ShellTask, find_exe, Task, quote, empty, spawn
 from wasp import group, TaskFailedError, ctx
 from wasp import nodes, FileNode, node, Argument
 from wasp import file, directory, osinfo, StringOption, files
+from wasp.fs import write_if_changed
 from wasp.shell import run as run_command
 from wasp.shell import ShellTaskPrinter
 from wasp.logging import LogStr
@@ -328,6 +330,29 @@ elif osinfo.linux:
         return t
 
 
+def _split_flags(values):
+    """
+    Flags may be given as strings containing multiple arguments. Splits them
+    into a list of arguments and removes duplicate strings.
+    """
+    return [flag for value in dict.fromkeys(values) for flag in shlex.split(value, posix=not osinfo.windows)]
+
+
+def _split_command(values):
+    """
+    Splits the compiler or linker command, which may be given as a string containing
+    multiple arguments (e.g. ``ccache gcc``). Paths of executables are passed as a
+    single argument, since they may contain spaces.
+    """
+    ret = []
+    for value in dict.fromkeys(values):
+        if os.path.isfile(value):
+            ret.append(value)
+        else:
+            ret.extend(shlex.split(value, posix=not osinfo.windows))
+    return ret
+
+
 class CompileTask(ShellTask):
     extensions = []
     require_keys = []
@@ -336,6 +361,7 @@ class CompileTask(ShellTask):
         super().__init__(sources=source, targets=target)
         self._use_default = use_default
         self._depfile = None
+        self._restored = False
         self._new_headers = set()
         self._old_headers = set()
         if scan_ignore is not None:
@@ -406,6 +432,25 @@ class CompileTask(ShellTask):
         kw['obj'] = quote(self._obj.path)
         return kw
 
+    def _process_argv(self):
+        kw = super()._process_argv()
+        include = self.arguments.value('includes', [])
+        include = ['-I' + directory(x).relative(self._cwd, skip_if_abs=True).path for x in include]
+        kw['includes'] = list(dict.fromkeys(include))
+        for key in ['cc', 'cxx']:
+            kw[key] = _split_command(kw.get(key, []))
+        for key in ['cflags', 'cxxflags']:
+            kw[key] = _split_flags(kw.get(key, []))
+        csource = self.arguments.value('csource', None)
+        if csource is None:
+            raise TaskFailedError('No sources recognized. Are your source files '
+                                  'using the right extensions? Expected one of [{}]'
+                                  .format(', '.join(self.extensions)))
+        kw['csource'] = [csource]
+        kw['defines'] = ['-D' + d for d in dict.fromkeys(self.arguments.value('defines', []))]
+        kw['obj'] = [self._obj.path]
+        return kw
+
     def _read_depfile(self):
         with open(self._depfile.path) as f:
             deps = f.read()
@@ -429,10 +474,23 @@ class CompileTask(ShellTask):
         self.result['headers'] = list(sorted(headers))
 
     def _on_success(self):
-        if self._scan:
+        if self._scan and not self._restored:
             self._read_depfile()
         super()._on_success()
 
+    def restore_output(self, output):
+        # the depfile is not restored, use the headers stored with the output
+        self._restored = True
+        super().restore_output(output)
+        if self._scan:
+            headers = set(self.result.value('headers', []))
+            self._new_headers = headers - self._old_headers
+
+    def discovered_sources(self):
+        if not self._scan:
+            return []
+        return self.result.value('headers', [])
+
     @property
     def new_nodes(self):
         return self._new_headers
@@ -457,7 +515,7 @@ class CxxCompile(CompileTask):
         if self._compilername == 'msvc':
             return '{cxx} {cflags} {cxxflags} {includes} {defines} /c /Fo{obj} /Tp{csource}'
         else:
-            return '{cxx} {cflags} {cxxflags} {includes} {defines} -MMD -c -o {obj} {csource}'
+            return ['{cxx}', '{cflags}', '{cxxflags}', '{includes}', '{defines}', '-MMD', '-c', '-o', '{obj}', '{csource}']
 
 
 class CCompile(CompileTask):
@@ -479,7 +537,7 @@ class CCompile(CompileTask):
         if self._compilername == 'msvc':
             return '{cc} {cflags} {includes} {defines} /c /Fo{tgt} /Tc{csource}'
         else:
-            return '{cc} {cflags} {includes} {defines} -MMD -c -o {tgt} {csource}'
+            return ['{cc}', '{cflags}', '{includes}', '{defines}', '-MMD', '-c', '-o', '{tgt}', '{csource}']
 
     def postprocess(self):
         pass
@@ -510,7 +568,7 @@ class Link(ShellTask):
         if self._linkername == 'msvc':
             return '{ld} {ldflags} {libraries} {src} {static_libs} /OUT:{lnk_tgt}'
         else:
-            return '{ld} {ldflags} {lib_includes} -o {tgt} {src} {static_libs} {libraries}'
+            return ['{ld}', '{ldflags}', '{lib_includes}', '-o', '{tgt}', '{src}', '{static_libs}', '{libraries}']
 
     def use_arg(self, arg):
         if arg.key in ['ldflags', 'libraries', 'static_libraries']:
@@ -518,8 +576,10 @@ class Link(ShellTask):
             return
         super().use_arg(arg)
 
-    def _process_args(self):
-        kw = super()._process_args()
+    def _libraries(self):
+        """
+        Returns the library directories and the linker arguments for the libraries.
+        """
         lib_includes = set()
         libraries = []
         for lib in self.arguments.value('libraries', []):
@@ -537,6 +597,11 @@ class Link(ShellTask):
                 libraries.append('-l' + lib[3:])
             else:
                 libraries.append('-l:' + lib)
+        return lib_includes, libraries
+
+    def _process_args(self):
+        kw = super()._process_args()
+        lib_includes, libraries = self._libraries()
         static_libs = self.arguments.value('static_libraries', [])
         kw['lib_includes'] = ' '.join('-L' + quote(include) for include in lib_includes)
         kw['libraries'] = ' '.join(quote(l) for l in libraries)
@@ -545,6 +610,16 @@ class Link(ShellTask):
         kw['lnk_tgt'] = kw['tgt'].replace('.lib', '.dll')  # TODO: not nice...
         return kw
 
+    def _process_argv(self):
+        kw = super()._process_argv()
+        lib_includes, libraries = self._libraries()
+        kw['lib_includes'] = ['-L' + include for include in sorted(lib_includes)]
+        kw['libraries'] = libraries
+        kw['ld'] = _split_command(kw.get('ld', []))
+        kw['ldflags'] = _split_flags(kw.get('ldflags', []))
+        kw['static_libs'] = [str(x) for x in self.arguments.value('static_libraries', [])]
+        return kw
+
 
 def compile(sources, bd_path=None, use_default=True, scan_ignore=None, scan=True):
     ret = []
@@ -601,7 +676,9 @@ class CompileInfoTask(Task):
     CATENATE_KEYS = ['cflags', 'includes', 'defines', 'ldflags', 'libraries', 'static_libraries']
 
     def __init__(self, fname, excludes):
-        super().__init__()
+        # the task always runs, but only touches the file if its
+        # content changes. Thus, consumers of the file are only run if required.
+        super().__init__(targets=fname, always=True)
         self._fname = str(fname)
         self._excludes = excludes
 
@@ -634,8 +711,11 @@ class CompileInfoTask(Task):
                 v = Argument(k)
                 v.value = libs
             args.append(v.to_json())
-        with open(self._fname, 'w') as f:
-            json.dump(args, f)
+        changed, value = write_if_changed(self._fname, json.dumps(args))
+        if changed:
+            self.touch(self._fname, value=value)
+        else:
+            self.untouch(self._fname)
         self.success = True
 
 
@@ -1,5 +1,8 @@
-from wasp import Task
+import json
+
+from wasp import Task, WorkerTask, python_worker
 from wasp.node import FileNode
+from wasp.fs import write_if_changed
 
 try:
     from jinja2 import Template
@@ -16,15 +19,50 @@ class TemplatingTask(Task):
         with open(self._templating_src, 'r') as f:
             data = f.read()
         template = Template(data)
-        kw = self.arguments.dict()
+        kw = {key: arg.value for key, arg in self.arguments.items()}
         processed = template.render(**kw)
         for target in self.targets:
             if not isinstance(target, FileNode):
                 continue
-            with open(target.path, 'w') as f:
-                f.write(processed)
+            changed, value = write_if_changed(target.path, processed)
+            if changed:
+                self.touch(target, value=value)
+            else:
+                self.untouch(target)
         self.success = True
 
 
-def template(source, target):
+def render(arguments):
+    """
+    Handler of the worker process of :class:`TemplatingWorkerTask`. Expects the
+    path of the template, the template arguments as json and the target paths.
+    """
+    source, kw, targets = arguments[0], json.loads(arguments[1]), arguments[2:]
+    with open(source, 'r') as f:
+        data = f.read()
+    processed = Template(data).render(**kw)
+    for target in targets:
+        write_if_changed(target, processed)
+
+
+class TemplatingWorkerTask(WorkerTask):
+    """
+    Equivalent to :class:`TemplatingTask`, but renders the template in a persistent worker
+    process. The arguments are passed to the template as json.
+    """
+    worker = python_worker(__file__ + ':render')
+
+    def __init__(self, source, target):
+        super().__init__(sources=source, targets=target)
+        self._templating_src = source
+
+    def worker_arguments(self):
+        kw = json.dumps({key: arg.value for key, arg in self.arguments.items()}, default=str)
+        targets = [target.path for target in self.targets if isinstance(target, FileNode)]
+        return [str(self._templating_src), kw] + targets
+
+
+def template(source, target, worker=False):
+    if worker:
+        return TemplatingWorkerTask(source, target)
     return TemplatingTask(source, target)